@@ -7,16 +7,24 @@ import streamlit as st
 from utils.json_to_word import json_report_to_docx
 from utils.utils import ensure_dir, abspath, safe_get
 from rag.rag import FaissRAG
+from rag.store_registry import get_registry, get_store
+from utils.llm_cache import cache_stats
 
 # -----------------------------
 # Rag知识库管理函数
 # -----------------------------
 def load_store_fresh(store_dir: str):
+    # 写操作（入库/删除）用独立实例
     ensure_dir(store_dir)
     return FaissRAG.load(store_dir)
 
+def load_store_cached(store_dir: str):
+    # 只读操作（状态/列表）走注册表缓存
+    ensure_dir(store_dir)
+    return get_store(store_dir)
+
 def store_status(store_dir: str) -> Dict[str, Any]:
-    rag = load_store_fresh(store_dir)
+    rag = load_store_cached(store_dir)
     try:
         ntotal = int(rag.index.ntotal) if rag.index is not None else 0
     except Exception:
@@ -35,10 +43,12 @@ def store_status(store_dir: str) -> Dict[str, Any]:
         "dim": getattr(rag, "dim", None),
         "ntotal": ntotal,
         "docs": docs_count,
+        "registry": get_registry().stats(),
+        "llm_cache": cache_stats(),
     }
 
 def list_docs(store_dir: str) -> List[Dict[str, Any]]:
-    rag = load_store_fresh(store_dir)
+    rag = load_store_cached(store_dir)
     if not hasattr(rag, "list_docs"):
         return []
     try:
@@ -49,8 +59,8 @@ def list_docs(store_dir: str) -> List[Dict[str, Any]]:
 
 def add_files_into_store(store_dir: str, paths: List[str]) -> Dict[str, Any]:
     rag = load_store_fresh(store_dir)
-    added = rag.add_files(paths)
-    rag.save(store_dir)
+    # 传 store_dir：检查点入库（定期提交，失败不丢已完成部分）
+    added = rag.add_files(paths, store_dir=store_dir)
     return added if isinstance(added, dict) else {"added": added}
 
 def remove_doc_from_store_by_id(store_dir: str, doc_id: str) -> bool:
@@ -61,15 +71,12 @@ def remove_doc_from_store_by_id(store_dir: str, doc_id: str) -> bool:
 
 def clear_store_files(store_dir: str) -> int:
     removed = 0
-    # 优先使用 store_paths
-    if hasattr(FaissRAG, "store_paths"):
-        p = FaissRAG.store_paths(store_dir)
-        for k in ["index", "chunks", "manifest"]:
-            fp = p.get(k)
-            if fp and os.path.exists(fp):
-                os.remove(fp)
-                removed += 1
-        return removed
+    # 优先使用 clear_store（持写锁，含快照目录）；同时丢弃注册表中的已加载实例
+    if hasattr(FaissRAG, "clear_store"):
+        try:
+            return int(FaissRAG.clear_store(store_dir))
+        finally:
+            get_registry().invalidate(store_dir)
 
     # 兜底：常见文件名
     for name in ["index.faiss", "chunks.jsonl", "manifest.json"]:
@@ -77,6 +84,7 @@ def clear_store_files(store_dir: str) -> int:
         if os.path.exists(fp):
             os.remove(fp)
             removed += 1
+    get_registry().invalidate(store_dir)
     return removed
 
 # -----------------------------
@@ -65,7 +65,7 @@ def render_kb_management_tab(
         st.divider()
         st.markdown("#### 清空操作")
         confirm_clear = st.checkbox(
-            "我确认要清空整个向量库（会删除index/chunks/manifest所有文件）",
+            "我确认要清空整个向量库（会删除全部快照及index/chunks/manifest文件）",
             value=False,
             key="kb_confirm_clear",
         )
@@ -161,6 +161,11 @@ def render_involution_measure_yearly_tab(
             st.error("起始年份不能大于结束年份。")
 
         enable_rag = st.checkbox("启用本地知识库（RAG）", value=True, key="m_enable_rag")
+        multi_year = st.checkbox(
+            "多年份合并生成（减少模型调用次数）",
+            value=bool(getattr(settings, "MEASURE_MULTI_YEAR", False)),
+            key="m_multi_year",
+        )
 
         # 兜底默认值，避免右侧调用时变量未定义
         rag_top_k_default = int(getattr(settings, "TOP_K", 10))
@@ -223,6 +228,7 @@ def render_involution_measure_yearly_tab(
                                 rag_store_dir=str(rag_store_dir),
                                 rag_top_k=int(rag_top_k),
                                 output_plot_dir=str(output_plot_dir),
+                                multi_year=bool(multi_year),
                             )
                         else:
                             out = measure_yearly_no_rag_fn(
@@ -230,6 +236,7 @@ def render_involution_measure_yearly_tab(
                                 start=str(start),
                                 end=str(end),
                                 output_plot_dir=str(output_plot_dir),
+                                multi_year=bool(multi_year),
                             )
 
                         st.session_state["yearly_last_out"] = out
@@ -98,45 +98,49 @@ def render_policy_simulation_tab(
                 if not policies:
                     st.warning("请按照规定格式输入政策内容！")
                 else:
-                    for i in range(1, MAX_RETRY + 1):
-                        with st.spinner(
-                                f"正在进行政策仿真与报告生成...（第 {i} 次）"):
-                            try:
-                                if enable_rag:
-                                    out = simulate_policy_fn(
-                                        policies,
-                                        industry_scope=str(industry_scope),
-                                        time_horizon_months=int(horizon),
-                                        top_k=int(top_k),
-                                        store_dir=str(store_dir),
-                                    )
-                                else:
-                                    out = simulate_policy_no_rag_fn(
-                                        policies,
-                                        industry_scope=str(industry_scope),
-                                        time_horizon_months=int(horizon),
-                                    )
-
-                                st.session_state["policy_last_out"] = out
-                                st.session_state["policy_last_tag"] = now_tag_fn()
-                            except Exception as e:
-                                st.error("政策仿真执行重试中。")
-                        # 成功：直接保存并退出循环
-                        if out:
-                            st.toast(f"政策仿真成功")
-                            st.session_state["policy_last_out"] = out
-                            st.session_state["policy_last_tag"] = now_tag_fn()
-                            break
-
-                        # 失败：未到上限则提示并继续；到上限则落库错误信息并提示失败
-                        if i < MAX_RETRY + 1:
-                            st.warning(f"第 {i} 次政策仿真失败，正在自动重试...")
-                            continue
-
+                    progress = st.empty()
+                    done_fields: List[str] = []
+
+                    def _on_field(path: tuple, value: Any) -> None:
+                        # 流式生成：每完成一个顶层章节就刷新进度，无需等待整份报告
+                        if len(path) != 1:
+                            return
+                        title = value.get("title") if isinstance(value, dict) else None
+                        done_fields.append(f"{path[0]}（{title}）" if title else str(path[0]))
+                        progress.caption("已生成：" + "、".join(done_fields))
+
+                    # 格式错误的修复 / 重新生成（至多 MAX_RETRY 次）在 utils.llm 内完成，检索只做一次
+                    out = None
+                    err_msg = "政策仿真返回结构不完整（policies 为空或格式不正确）。"
+                    with st.spinner("正在进行政策仿真与报告生成..."):
+                        try:
+                            if enable_rag:
+                                out = simulate_policy_fn(
+                                    policies,
+                                    industry_scope=str(industry_scope),
+                                    time_horizon_months=int(horizon),
+                                    top_k=int(top_k),
+                                    store_dir=str(store_dir),
+                                    on_field=_on_field,
+                                )
+                            else:
+                                out = simulate_policy_no_rag_fn(
+                                    policies,
+                                    industry_scope=str(industry_scope),
+                                    time_horizon_months=int(horizon),
+                                    on_field=_on_field,
+                                )
+                        except Exception as e:
+                            err_msg = str(e)
+                    progress.empty()
+
+                    if out:
+                        st.toast(f"政策仿真成功")
+                        st.session_state["policy_last_out"] = out
+                        st.session_state["policy_last_tag"] = now_tag_fn()
+                    else:
                         st.session_state["policy_last_out"] = None
-                        st.session_state["policy_last_err"] = {
-                            "message": "政策仿真返回结构不完整（policies 为空或格式不正确）。",
-                        }
+                        st.session_state["policy_last_err"] = {"message": err_msg}
                         st.error(
                             f"政策仿真连续 {MAX_RETRY} 次失败，请检查模型配置/网络/政策输入格式后重试。")
 
@@ -0,0 +1,476 @@
+# mock_llm_server.py
+# 本地 OpenAI 兼容模拟服务（离线压测用）：/chat/completions 按提示词类型（内卷识别 / 单年测定 / 多年份测定 / 政策仿真）
+# 返回符合 schema 的 JSON（支持 stream=True 的 SSE），/embeddings 返回本地确定性向量；
+# 可配置延迟、生成速度、5xx / 429 注入、服务端并发上限与截断输出，用于端到端压测并发、缓存与重试逻辑
+from __future__ import annotations
+
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.llm import HashingEmbeddingBackend
+from utils.json_repair import repair_json
+from utils.prompts import METRICS, TAXONOMY
+from utils.rate_limit import estimate_messages_tokens, estimate_tokens
+
+# 按一般规律逐年上升的指标（与测定提示词第 7 条一致），模拟数据中给出上升趋势
+_RISING = {
+    "digital_intangible_asset_investment_intensity",
+    "digital_talent_investment_intensity",
+    "employee_training_investment_intensity",
+    "sales_personnel_intensity",
+}
+_LEVERS = ["定价", "产能", "研发", "渠道", "供应链账期", "并购退出", "其他"]
+_IMPACT_KEYS = ["pricing", "capacity", "rnd", "channels", "supply_chain_terms", "mna_exit"]
+_CITE_RE = re.compile(r"chunk_id=(\S+)(?: doc_id=(\S+))?")
+
+
+@dataclass
+class MockConfig:
+    latency_ms: float = 200.0      # 首字节前的固定延迟
+    jitter_ms: float = 50.0        # 延迟随机抖动（均匀分布 ±jitter）
+    tokens_per_sec: float = 0.0    # 生成速度（估算 token/秒）；0 表示输出立即返回
+    error_rate: float = 0.0        # 返回 500 的概率
+    rate_429: float = 0.0          # 随机返回 429 的概率
+    max_concurrency: int = 0       # 服务端并发上限，超出直接 429；0 表示不限
+    retry_after: float = 1.0       # 429 响应的 Retry-After（秒）
+    bad_json_rate: float = 0.0     # 输出被截断（模拟 max_tokens 截断，finish_reason=length）的概率
+    seed: int = 0
+
+
+# -----------------------------
+# 提示词解析与模拟输出
+# -----------------------------
+def _content(messages: List[Dict[str, Any]], role: str) -> str:
+    return "\n".join(str(m.get("content") or "") for m in messages if m.get("role") == role)
+
+
+def _cites(text: str, limit: int = 3) -> List[Dict[str, str]]:
+    out: List[Dict[str, str]] = []
+    for chunk_id, doc_id in _CITE_RE.findall(text):
+        if len(out) >= limit:
+            break
+        out.append({"chunk_id": chunk_id, "doc_id": doc_id or ""})
+    return out
+
+
+def _conf(rng: random.Random) -> float:
+    v = round(rng.uniform(0.55, 0.9), 2)
+    return v if v != 0.5 else 0.55
+
+
+def _identify(rng: random.Random, user: str) -> Dict[str, Any]:
+    cites = _cites(user)
+    labels = []
+    for t in rng.sample(TAXONOMY, k=rng.randint(3, min(6, len(TAXONOMY)))):
+        labels.append({
+            "label_id": t["id"],
+            "label_name": t["name"],
+            "score": rng.randint(40, 90),
+            "confidence": _conf(rng),
+            "evidence_level": "strong" if cites else "none",
+            "rationale": f"（模拟输出）{t['definition']}",
+            "evidences": cites[:2],
+        })
+    labels.sort(key=lambda x: x["score"], reverse=True)
+    return {
+        "overall": {"has_involution": True, "confidence": _conf(rng), "summary": "（模拟输出）存在较明显的内卷式竞争特征。"},
+        "labels": labels,
+        "notes": ["mock server 生成的模拟结果，仅用于压测。"],
+    }
+
+
+def _year_item(rng: random.Random, label: str, start: str, end: str, cites: List[Dict[str, str]]) -> Dict[str, Any]:
+    year = int(label) if label.isdigit() else 2020
+    metrics: Dict[str, float] = {}
+    for m in METRICS:
+        base = rng.uniform(0.25, 0.75)
+        if m["key"] in _RISING:
+            base = min(0.95, 0.2 + 0.05 * max(0, year - 2012) + rng.uniform(0.0, 0.05))
+        metrics[m["key"]] = round(base, 3)
+    return {
+        "period": label,
+        "time_window": {"start": start, "end": end},
+        "metrics": metrics,
+        "metric_confidence": {m["key"]: _conf(rng) for m in METRICS},
+        "overall_confidence": _conf(rng),
+        "rationale": f"（模拟输出）{label} 年指标估计。",
+        "used_evidence": cites,
+        "notes": ["mock server 生成的模拟结果。"],
+    }
+
+
+def _company(user: str) -> str:
+    m = re.search(r"企业：(.+)", user)
+    return m.group(1).strip() if m else ""
+
+
+def _year_measure(rng: random.Random, user: str) -> Dict[str, Any]:
+    m = re.search(r"年份：(\d{4})（([^~]+)~([^）]+)）", user)
+    label, start, end = m.groups() if m else ("2020", "2020-01-01", "2020-12-31")
+    out = {"company": _company(user)}
+    out.update(_year_item(rng, label, start, end, _cites(user)))
+    return out
+
+
+def _multi_year_measure(rng: random.Random, user: str) -> Dict[str, Any]:
+    years = []
+    for block in re.split(r"^## ", user, flags=re.M)[1:]:
+        m = re.match(r"(\d{4})（([^~]+)~([^）]+)）", block)
+        if m:
+            years.append(_year_item(rng, m.group(1), m.group(2), m.group(3), _cites(block)))
+    return {"company": _company(user), "years": years}
+
+
+def _policy(rng: random.Random, user: str) -> Dict[str, Any]:
+    scope = (re.search(r"行业范围：(.+)", user) or [None, "中国新能源汽车行业"])[1].strip()
+    horizon = int((re.search(r"仿真时间跨度：(\d+)", user) or [None, "24"])[1])
+    m = re.search(r"用户政策输入[^\n]*\n(.*?)\nRAG证据片段", user, re.S)
+    items = [ln.strip().lstrip("-").strip() for ln in (m.group(1) if m else "").splitlines() if ln.strip()]
+    names = [x[:30] for x in items] or ["政策1"]
+    cites = _cites(user)
+    text = "（模拟输出）" + "该部分为压测用的占位论述。" * 40
+    bullets = [f"（模拟）要点{i}" for i in range(1, 4)]
+
+    def _range(lo: float, hi: float) -> List[float]:
+        a = round(rng.uniform(lo, hi), 1)
+        return [a, round(min(100.0, a + rng.uniform(3, 10)), 1)]
+
+    policies = []
+    for x, name in enumerate(names, start=1):
+        base = _range(55, 75)
+        after = _range(40, 60)
+        policies.append({
+            "x": x,
+            "policy_name": name,
+            "3.x.1": {"title": "政策内容", "policy_measures": bullets,
+                      "parameters": [{"name": "强度", "value": None, "note": "输入未给出可量化参数"}]},
+            "3.x.2": {"title": "政策作用机制", "mechanism_chain": bullets,
+                      "primary_levers": rng.sample(_LEVERS, k=2)},
+            "3.x.3": {"title": "适用场景与边界条件", "applicable_when": bullets,
+                      "boundary_conditions": bullets, "failure_modes": bullets},
+            "3.x.4": {
+                "title": "政策对企业行为/产业行为的影响",
+                "involution_index": {
+                    "baseline_range": base,
+                    "after_range": after,
+                    "change_range": sorted([round(after[0] - base[1], 1), round(after[1] - base[0], 1)]),
+                },
+                "behavior_impacts": {k: {"direction": rng.choice(["up", "down", "mixed"]), "text": "（模拟）"}
+                                     for k in _IMPACT_KEYS},
+                "kpis": bullets,
+                "side_effects": bullets,
+            },
+        })
+    xs = list(range(1, len(names) + 1))
+    return {
+        "meta": {"industry_scope": scope, "time_horizon_months": horizon, "policy_count": len(names),
+                 "assumptions": ["mock server 模拟输出"]},
+        "chapter1": {"title": "引言", "1.1": {"title": "新能源汽车行业内卷现象概述", "text": text,
+                                             "bullets": bullets, "key_risks": bullets, "evidence": cites}},
+        "chapter2": {
+            "title": "行业状态",
+            "2.1": {"title": "当前新能源行业状态", "text": text, "bullets": bullets,
+                    "involution_index_baseline_range": _range(55, 75), "confidence": _conf(rng), "evidence": cites},
+            "2.2": {"title": "未来趋势预测", "text": text, "bullets": bullets, "trend_points": bullets,
+                    "risk_triggers": bullets, "evidence": cites},
+        },
+        "chapter3": {"title": "政策情景设定", "policies": policies},
+        "chapter4": {
+            "title": "政策建议",
+            "4.1": {"title": "推荐方案（主推/备选/不建议）",
+                    "primary": [{"policy_x": xs[0], "why": "（模拟）"}],
+                    "secondary": [{"policy_x": x, "why": "（模拟）"} for x in xs[1:]],
+                    "not_recommended": []},
+            "4.2": {"title": "分场景选择规则", "rules": [{"scene": "（模拟）价格战加剧", "triggers": bullets,
+                                                      "recommended_policy_x": xs, "expected_results": bullets,
+                                                      "watchouts": bullets}]},
+            "4.3": {"title": "配套机制及注意事项", "supporting_mechanisms": bullets,
+                    "governance_and_disclosure": bullets, "exit_and_consumer_protection": bullets,
+                    "monitoring_and_iteration": bullets},
+        },
+        "evidence_used": [dict(c, reason="（模拟）") for c in cites],
+        "notes": ["mock server 生成的模拟结果。" if cites else "证据为空，以下为基于常识与行业逻辑的推演（模拟）。"],
+        "disclaimer": "本报告为本地模拟服务生成，仅用于压测。",
+    }
+
+
+def canned_reply(messages: List[Dict[str, Any]]) -> Tuple[str, str]:
+    """
+    根据提示词类型生成模拟输出，返回 (类型, 输出文本)。同一组 messages 的输出固定（按内容哈希取随机种子）。
+    """
+    system = _content(messages, "system")
+    user = _content(messages, "user")
+    digest = hashlib.sha256(json.dumps(messages, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).digest()
+    rng = random.Random(int.from_bytes(digest[:8], "big"))
+
+    if system.startswith("你是 JSON 修复器"):
+        raw = user.split("待修复的输出：\n", 1)[-1]
+        return "repair", repair_json(raw) or "{}"
+    if '"chapter1"' in system:
+        kind, out = "policy", _policy(rng, user)
+    elif '"years": [' in system:
+        kind, out = "multi_year_measure", _multi_year_measure(rng, user)
+    elif '"metric_confidence"' in system:
+        kind, out = "year_measure", _year_measure(rng, user)
+    elif '"labels"' in system:
+        kind, out = "identify", _identify(rng, user)
+    else:
+        kind, out = "other", {"ok": True}
+    return kind, json.dumps(out, ensure_ascii=False)
+
+
+# -----------------------------
+# HTTP 服务
+# -----------------------------
+class MockState:
+    """
+    服务端计数（GET /stats 查看）。
+    """
+
+    def __init__(self, config: MockConfig) -> None:
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.peak_inflight = 0
+        self.counts: Dict[str, int] = {}
+
+    def bump(self, key: str, n: int = 1) -> None:
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + n
+
+    def roll(self, p: float) -> bool:
+        with self.lock:
+            return p > 0 and self.rng.random() < p
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "config": asdict(self.config),
+                "inflight": self.inflight,
+                "peak_inflight": self.peak_inflight,
+                "counts": dict(self.counts),
+            }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: MockState  # 由 make_server 绑定到子类上
+
+    def log_message(self, fmt: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, status: int, obj: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str, code: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self._send_json(status, {"error": {"message": message, "type": code, "code": code}}, headers)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.state.stats())
+        elif self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+        else:
+            self._send_error(404, f"unknown path {self.path}", "not_found")
+
+    def do_POST(self) -> None:
+        st = self.state
+        cfg = st.config
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        except ValueError:
+            self._send_error(400, "invalid JSON body", "invalid_request_error")
+            return
+
+        path = self.path.rstrip("/")
+        if not (path.endswith("/chat/completions") or path.endswith("/embeddings")):
+            self._send_error(404, f"unknown path {self.path}", "not_found")
+            return
+
+        with st.lock:
+            st.inflight += 1
+            st.peak_inflight = max(st.peak_inflight, st.inflight)
+            over = 0 < cfg.max_concurrency < st.inflight
+        try:
+            st.bump("requests")
+            if over or st.roll(cfg.rate_429):
+                st.bump("status_429")
+                self._send_error(429, "Rate limit exceeded (mock)", "rate_limit_exceeded",
+                                 {"Retry-After": f"{cfg.retry_after:g}"})
+                return
+            if st.roll(cfg.error_rate):
+                st.bump("status_500")
+                self._send_error(500, "Internal server error (mock)", "server_error")
+                return
+
+            with st.lock:
+                jitter = st.rng.uniform(-cfg.jitter_ms, cfg.jitter_ms)
+            time.sleep(max(0.0, cfg.latency_ms + jitter) / 1000.0)
+
+            if path.endswith("/embeddings"):
+                self._embeddings(body)
+            else:
+                self._chat(body)
+        except (BrokenPipeError, ConnectionResetError):
+            st.bump("client_aborted")  # 客户端提前关闭（例如流式解析发现错误后中止）
+            self.close_connection = True
+        finally:
+            with st.lock:
+                st.inflight -= 1
+
+    def _embeddings(self, body: Dict[str, Any]) -> None:
+        texts = body.get("input")
+        texts = [texts] if isinstance(texts, str) else list(texts or [])
+        dim = int(body.get("dimensions") or 1024)
+        vecs = HashingEmbeddingBackend(dim=dim).embed([str(t) for t in texts])
+        n_tokens = sum(estimate_tokens(str(t)) for t in texts)
+        self.state.bump("embeddings")
+        self.state.bump("embedding_inputs", len(texts))
+        self._send_json(200, {
+            "object": "list",
+            "model": body.get("model") or "mock-embedding",
+            "data": [{"object": "embedding", "index": i, "embedding": v.tolist()} for i, v in enumerate(vecs)],
+            "usage": {"prompt_tokens": n_tokens, "total_tokens": n_tokens},
+        })
+
+    def _chat(self, body: Dict[str, Any]) -> None:
+        st = self.state
+        cfg = st.config
+        messages = list(body.get("messages") or [])
+        kind, content = canned_reply(messages)
+        st.bump(f"chat_{kind}")
+        finish = "stop"
+        if kind != "repair" and st.roll(cfg.bad_json_rate):
+            content = content[: max(1, int(len(content) * 0.6))]
+            finish = "length"
+            st.bump("truncated")
+
+        prompt_tokens = estimate_messages_tokens(messages)
+        out_tokens = estimate_tokens(content)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": out_tokens,
+                 "total_tokens": prompt_tokens + out_tokens}
+        model = body.get("model") or "mock"
+        rid = f"mock-{hashlib.md5(content.encode('utf-8')).hexdigest()[:12]}"
+
+        if not body.get("stream"):
+            if cfg.tokens_per_sec > 0:
+                time.sleep(out_tokens / cfg.tokens_per_sec)
+            self._send_json(200, {
+                "id": rid, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": finish,
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.close_connection = True
+
+        def _event(delta: Dict[str, Any], finish_reason: Optional[str] = None, **extra: Any) -> None:
+            chunk = {"id": rid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            chunk.update(extra)
+            self.wfile.write(b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+        _event({"role": "assistant", "content": ""})
+        step = 16
+        for i in range(0, len(content), step):
+            piece = content[i:i + step]
+            if cfg.tokens_per_sec > 0:
+                time.sleep(estimate_tokens(piece) / cfg.tokens_per_sec)
+            _event({"content": piece})
+        _event({}, finish)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self.wfile.write(b"data: " + json.dumps({"id": rid, "object": "chat.completion.chunk", "model": model,
+                                                     "choices": [], "usage": usage}).encode("utf-8") + b"\n\n")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def make_server(config: Optional[MockConfig] = None, *, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    """
+    创建（未启动的）模拟服务；port=0 时由系统分配端口。
+    """
+    state = MockState(config or MockConfig())
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    srv = ThreadingHTTPServer((host, port), handler)
+    srv.daemon_threads = True
+    srv.state = state  # type: ignore[attr-defined]
+    return srv
+
+
+def start_server(config: Optional[MockConfig] = None, *, host: str = "127.0.0.1", port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    在后台线程启动模拟服务，返回 (server, base_url)；把 settings.BASE_URL 设为 base_url 即可让 utils.llm 走模拟服务。
+    结束时调用 server.shutdown()。
+    """
+    srv = make_server(config, host=host, port=port)
+    threading.Thread(target=srv.serve_forever, name="mock-llm-server", daemon=True).start()
+    return srv, f"http://{host}:{srv.server_address[1]}/v1"
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Local OpenAI-compatible mock server for offline load testing (chat + embeddings)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--latency-ms", type=float, default=200.0, help="Fixed latency before the first byte")
+    p.add_argument("--jitter-ms", type=float, default=50.0, help="Uniform latency jitter (+/-)")
+    p.add_argument("--tokens-per-sec", type=float, default=0.0, help="Simulated generation speed (0 = instant)")
+    p.add_argument("--error-rate", type=float, default=0.0, help="Probability of HTTP 500")
+    p.add_argument("--rate-429", type=float, default=0.0, help="Probability of HTTP 429")
+    p.add_argument("--max-concurrency", type=int, default=0, help="Server-side concurrency cap, excess requests get 429 (0 = unlimited)")
+    p.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on 429")
+    p.add_argument("--bad-json-rate", type=float, default=0.0, help="Probability of a truncated (finish_reason=length) chat output")
+    p.add_argument("--seed", type=int, default=0)
+    return p
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    config = MockConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        error_rate=args.error_rate,
+        rate_429=args.rate_429,
+        max_concurrency=args.max_concurrency,
+        retry_after=args.retry_after,
+        bad_json_rate=args.bad_json_rate,
+        seed=args.seed,
+    )
+    srv = make_server(config, host=args.host, port=args.port)
+    print(f"[mock] serving on http://{args.host}:{srv.server_address[1]}/v1  (stats: GET /v1/stats)")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
+    #在项目根目录运行（离线，API Key 任意非空值即可）：
+    #python -m benchmarks.mock_llm_server --port 8765 --latency-ms 300 --tokens-per-sec 200 --rate-429 0.05 --max-concurrency 6
+    #然后在设置页把 BASE_URL 选为“本地模拟（压测）”，或 settings.BASE_URL = "http://127.0.0.1:8765/v1"
@@ -0,0 +1,303 @@
+# rag_bench.py
+# RAG 性能基准：合成语料（10k / 100k / 1M chunks）+ 本地确定性 embedding，
+# 测量 add_files / save / load / search / remove_doc 与库体积，结果写为 JSON 便于跨版本对比回归
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import faiss
+
+from utils import settings
+from utils.llm import set_embedding_backend
+from rag.rag import FaissRAG
+
+# 各索引类型 -> FaissRAG 构造参数（新增索引选项时在此登记即可纳入基准）
+INDEX_TYPES: Dict[str, Dict[str, Any]] = {
+    "flat": {},
+    "flat_parents": {"parent_chunk_size": 3200},  # 父子切分：子块无重叠，向量数更少
+    "pca128": {"pca_dim": 128},  # PCA 降维第一阶段检索 + 全精度精排
+    "pca256": {"pca_dim": 256},
+}
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+_VOCAB = [
+    "新能源汽车", "价格战", "降价", "毛利率", "净利润", "产能", "产能利用率", "扩产", "电池", "电芯",
+    "专利", "研发费用", "研发人员", "招聘", "销售费用", "渠道", "返利", "补贴", "经销商", "库存",
+    "供应链", "账期", "应付账款", "现金流", "集中度", "同质化", "智能驾驶", "座舱", "出口", "海外",
+    "比亚迪", "特斯拉", "理想汽车", "蔚来", "小鹏", "吉利", "长城", "上汽", "广汽", "长安",
+    "同比", "环比", "增长", "下滑", "季度", "年度", "万辆", "亿元", "百分点", "市场份额",
+]
+
+
+# -----------------------------
+# 合成语料
+# -----------------------------
+def _synthetic_text(rng: random.Random, n_chars: int) -> str:
+    parts: List[str] = []
+    size = 0
+    while size < n_chars:
+        w = rng.choice(_VOCAB)
+        if rng.random() < 0.15:
+            w = f"{w}{rng.randint(1, 999)}{rng.choice(['%', '亿元', '万辆', '项'])}"
+        parts.append(w)
+        size += len(w)
+        if rng.random() < 0.08:
+            parts.append("。")
+            size += 1
+    return "".join(parts)[:n_chars]
+
+
+def make_corpus(
+    out_dir: str,
+    n_chunks: int,
+    *,
+    chunk_size: int,
+    overlap: int,
+    chunks_per_doc: int = 50,
+    seed: int = 42,
+) -> Dict[str, Any]:
+    """
+    生成约 n_chunks 个切片的 txt 语料（每篇 chunks_per_doc 个切片），返回 {"paths", "n_docs", "bytes"}。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    stride = chunk_size - overlap
+    paths: List[str] = []
+    total_bytes = 0
+    remaining = int(n_chunks)
+    i = 0
+    while remaining > 0:
+        k = min(chunks_per_doc, remaining)
+        n_chars = chunk_size + stride * (k - 1)
+        text = f"文档{i:07d} " + _synthetic_text(rng, n_chars - 9)
+        fp = os.path.join(out_dir, f"doc_{i:07d}.txt")
+        with open(fp, "w", encoding="utf-8") as f:
+            f.write(text)
+        total_bytes += os.path.getsize(fp)
+        paths.append(fp)
+        remaining -= k
+        i += 1
+    return {"paths": paths, "n_docs": len(paths), "bytes": total_bytes}
+
+
+# -----------------------------
+# 计时工具
+# -----------------------------
+def _timed(fn: Callable[[], Any]) -> Tuple[float, Any]:
+    t0 = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - t0, out
+
+
+def _dir_size(d: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(d):
+        for fn in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, fn))
+            except OSError:
+                pass
+    return total
+
+
+def _max_rss_mb() -> Optional[float]:
+    try:
+        import resource  # noqa
+        r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(r / 1024.0 / (1024.0 if sys.platform == "darwin" else 1.0), 1)
+    except Exception:
+        return None
+
+
+def _pct(vals: List[float], q: float) -> float:
+    return float(np.percentile(np.array(vals, dtype=np.float64), q * 100)) if vals else 0.0
+
+
+# -----------------------------
+# 单组基准
+# -----------------------------
+def bench_one(
+    index_type: str,
+    corpus: Dict[str, Any],
+    *,
+    work_dir: str,
+    n_queries: int = 200,
+    top_k: int = 10,
+    remove_frac: float = 0.01,
+    seed: int = 7,
+) -> Dict[str, Any]:
+    store_dir = os.path.join(work_dir, f"store_{index_type}")
+    shutil.rmtree(store_dir, ignore_errors=True)
+    paths: List[str] = corpus["paths"]
+
+    rag = FaissRAG(**INDEX_TYPES[index_type])
+    t_add, _ = _timed(lambda: rag.add_files(paths))
+    n_chunks = int(rag.index.ntotal) if rag.index is not None else 0
+
+    t_save, _ = _timed(lambda: rag.save(store_dir))
+    store_bytes = _dir_size(store_dir)
+    del rag
+
+    t_load, rag = _timed(lambda: FaissRAG.load(store_dir))
+    # 向量数不足 RAG_PCA_MIN_TRAIN 时不会训练 PCA，结果等同 flat：如实记录
+    pca_active = rag.pca is not None
+
+    # 查询：从语料词表随机组合（命中率不重要，测的是延迟）
+    rng = random.Random(seed)
+    queries = [" ".join(rng.sample(_VOCAB, 4)) for _ in range(n_queries)]
+    rag.search(queries[0], top_k=top_k)  # warm-up
+    lat: List[float] = []
+    for q in queries:
+        dt, _ = _timed(lambda: rag.search(q, top_k=top_k))
+        lat.append(dt)
+
+    # 删除：按比例随机删除文档
+    doc_ids = sorted(rag.docs.keys())
+    n_remove = max(1, int(len(doc_ids) * remove_frac))
+    victims = random.Random(seed).sample(doc_ids, min(n_remove, len(doc_ids)))
+    t_remove, _ = _timed(lambda: [rag.remove_doc(doc_id=d) for d in victims])
+    t_save_after_remove, _ = _timed(lambda: rag.save(store_dir))
+
+    return {
+        "index_type": index_type,
+        "pca_disabled": bool(INDEX_TYPES[index_type].get("pca_dim")) and not pca_active,
+        "n_docs": corpus["n_docs"],
+        "n_chunks": n_chunks,
+        "corpus_bytes": corpus["bytes"],
+        "add_files": {
+            "sec": round(t_add, 4),
+            "docs_per_sec": round(corpus["n_docs"] / t_add, 2) if t_add > 0 else None,
+            "chunks_per_sec": round(n_chunks / t_add, 2) if t_add > 0 else None,
+        },
+        "save": {"sec": round(t_save, 4)},
+        "load": {"sec": round(t_load, 4)},
+        "search": {
+            "n_queries": n_queries,
+            "top_k": top_k,
+            "p50_ms": round(_pct(lat, 0.50) * 1000, 3),
+            "p95_ms": round(_pct(lat, 0.95) * 1000, 3),
+            "p99_ms": round(_pct(lat, 0.99) * 1000, 3),
+            "qps": round(len(lat) / sum(lat), 2) if lat else None,
+        },
+        "remove_doc": {
+            "n_docs": len(victims),
+            "sec": round(t_remove, 4),
+            "ms_per_doc": round(t_remove / len(victims) * 1000, 3) if victims else None,
+            "save_after_sec": round(t_save_after_remove, 4),
+        },
+        "store_bytes": store_bytes,
+        "max_rss_mb": _max_rss_mb(),
+    }
+
+
+def run_benchmarks(
+    sizes: List[int],
+    index_types: List[str],
+    *,
+    work_dir: Optional[str] = None,
+    n_queries: int = 200,
+    keep: bool = False,
+) -> Dict[str, Any]:
+    set_embedding_backend("local_hash")
+    chunk_size = int(getattr(settings, "CHUNK_SIZE", 800))
+    overlap = int(getattr(settings, "CHUNK_OVERLAP", 120))
+    root = work_dir or tempfile.mkdtemp(prefix="rag_bench_")
+    os.makedirs(root, exist_ok=True)
+
+    # pca_dim >= 向量维度时 PCA 不会启用，结果与 flat 相同：跳过该变体并在 meta 中注明
+    embed_dim = int(getattr(settings, "EMBED_DIM", 1024))
+    skipped = {it: f"pca_dim >= embed_dim ({embed_dim})" for it in index_types
+               if int(INDEX_TYPES[it].get("pca_dim") or 0) >= embed_dim}
+    for it, why in skipped.items():
+        print(f"[bench] skip index={it}: {why}", flush=True)
+    index_types = [it for it in index_types if it not in skipped]
+
+    results: List[Dict[str, Any]] = []
+    try:
+        for n in sizes:
+            corpus_dir = os.path.join(root, f"corpus_{n}")
+            t_gen, corpus = _timed(lambda: make_corpus(corpus_dir, n, chunk_size=chunk_size, overlap=overlap))
+            for it in index_types:
+                print(f"[bench] size={n} index={it} ...", flush=True)
+                r = bench_one(it, corpus, work_dir=os.path.join(root, f"run_{n}"), n_queries=n_queries)
+                r["n_chunks_target"] = n
+                r["corpus_gen_sec"] = round(t_gen, 3)
+                results.append(r)
+                print(
+                    f"[bench] size={n} index={it}{' (pca_disabled)' if r['pca_disabled'] else ''} "
+                    f"add={r['add_files']['sec']}s save={r['save']['sec']}s "
+                    f"load={r['load']['sec']}s search_p50={r['search']['p50_ms']}ms "
+                    f"store={r['store_bytes'] / 1e6:.1f}MB",
+                    flush=True,
+                )
+            if not keep:
+                shutil.rmtree(corpus_dir, ignore_errors=True)
+                shutil.rmtree(os.path.join(root, f"run_{n}"), ignore_errors=True)
+    finally:
+        set_embedding_backend(None)
+        if not keep and work_dir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "faiss": getattr(faiss, "__version__", None),
+            "embed_backend": "local_hash",
+            "embed_dim": embed_dim,
+            "chunk_size": chunk_size,
+            "overlap": overlap,
+            "skipped": skipped,
+        },
+        "results": results,
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="RAG performance benchmark on synthetic corpora (offline, local_hash embeddings)")
+    p.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Target chunk counts (default: 10000 100000 1000000)")
+    p.add_argument("--index-types", nargs="+", default=list(INDEX_TYPES), choices=list(INDEX_TYPES), help="Index types to benchmark")
+    p.add_argument("--dim", type=int, default=None, help="Embedding dim (default: settings.EMBED_DIM)")
+    p.add_argument("--queries", type=int, default=200, help="Number of search queries per run")
+    p.add_argument("--work-dir", default=None, help="Working dir for corpora/stores (default: temp dir)")
+    p.add_argument("--keep", action="store_true", help="Keep generated corpora and stores")
+    p.add_argument("--out", default=None, help="Output JSON path (default: bench_output/rag_bench_<timestamp>.json)")
+    return p
+
+
+def main() -> int:
+    args = build_parser().parse_args()
+    if args.dim:
+        settings.EMBED_DIM = int(args.dim)
+
+    report = run_benchmarks(args.sizes, args.index_types, work_dir=args.work_dir, n_queries=args.queries, keep=args.keep)
+
+    out = args.out or os.path.join("bench_output", f"rag_bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[bench] results: {os.path.abspath(out)}")
+    return 0
+
+
+# ---------------------------
+# 本地快速测试
+# ---------------------------
+if __name__ == "__main__":
+    raise SystemExit(main())
+    #在项目根目录运行（离线，无需 API Key）：
+    #python -m benchmarks.rag_bench --sizes 10000 --queries 100
+    #python -m benchmarks.rag_bench --sizes 10000 100000 1000000 --dim 256 --out bench_output/v1.json
@@ -1,11 +1,13 @@
 # identify.py
 from __future__ import annotations
 
-from typing import List, Optional
+from typing import Any, Callable, Dict, List, Optional
 from utils import settings
 from rag.rag import FaissRAG
+from rag.store_registry import get_store
+from rag.federated import federated_search
 from utils.prompts import build_identify_messages  # type: ignore
-from utils.llm import chat_json  # type: ignore
+from utils.llm import chat_json, chat_json_stream  # type: ignore
 from utils.json_utils import save_json, pretty_print_json  # type: ignore
 
 def _get_store_dir() -> str:
@@ -16,7 +18,7 @@ def load_rag_or_none(store_dir: Optional[str] = None) -> Optional[FaissRAG]:
     若库存在且非空：返回 FaissRAG；否则返回 None（后续走“无 RAG 对话”路径）。
     """
     d = store_dir or _get_store_dir()
-    rag = FaissRAG.load(d)
+    rag = get_store(d)  # 注册表缓存：库未更新时不重复加载
     return None if rag.is_empty() else rag
 
 def identify(
@@ -24,24 +26,34 @@ def identify(
     *,
     top_k: int = 12,
     store_dir: Optional[str] = None,
+    store_dirs: Optional[List[str]] = None,
+    store_quotas: Optional[Dict[str, int]] = None,
+    on_field: Optional[Callable[[tuple, Any], None]] = None,
 ) -> dict:
     """
     默认从本地知识库检索证据；
     若库不存在或为空：直接对话，不走 RAG。
+    传入 store_dirs 时对多个库联合检索（并发、分数归一化、store_quotas 为每库最多条数）。
+    on_field：流式生成时每个闭合字段的回调 (path, value)，见 utils.llm.chat_json_stream。
     """
-    rag = load_rag_or_none(store_dir)
     evidence: List[dict] = []
-    if rag is not None:
-        evidence = rag.search(user_query, top_k=top_k)
+    if store_dirs:
+        evidence = federated_search(user_query, store_dirs, top_k=top_k, quotas=store_quotas)["hits"]
+    else:
+        rag = load_rag_or_none(store_dir)
+        if rag is not None:
+            evidence = rag.search(user_query, top_k=top_k)
 
     #优先传 evidence；如签名不同，用兜底逻辑
+    pack: Dict[str, Any] = {}
     try:
-        messages = build_identify_messages(user_query, evidence_hits=evidence)
+        messages = build_identify_messages(user_query, evidence_hits=evidence, pack_info=pack)
     except TypeError:
         rag_text = "\n\n".join([h.get("text", "") for h in evidence]) if evidence else ""
         messages = build_identify_messages(user_query, evidence_hits=rag_text)  # type: ignore
 
-    out = chat_json(messages)
+    # 传入 on_field 时流式生成：字段一闭合就回调，便于 UI 提前展示
+    out = chat_json_stream(messages, on_field=on_field) if on_field else chat_json(messages)
 
     # 把证据附加回输出，便于可解释性与调试
     if isinstance(out, dict):
@@ -49,17 +61,21 @@ def identify(
         out["rag"]["used"] = bool(evidence)
         out["rag"]["top_k"] = int(top_k)
         out["rag"]["store_dir"] = store_dir or _get_store_dir()
+        if store_dirs:
+            out["rag"]["store_dirs"] = list(store_dirs)
         out["rag"]["hits"] = evidence
+        out["rag"]["evidence_pack"] = pack  # 证据 token 预算与实际装入情况
 
     return out
 
 
-def identify_from_none(user_query: str) -> dict:
+def identify_from_none(user_query: str, *, on_field: Optional[Callable[[tuple, Any], None]] = None) -> dict:
     """
     “无 RAG”识别接口。
     """
     messages = build_identify_messages(user_query, evidence_hits=[])
-    out = chat_json(messages)
+    # 传入 on_field 时流式生成：字段一闭合就回调，便于 UI 提前展示
+    out = chat_json_stream(messages, on_field=on_field) if on_field else chat_json(messages)
     if isinstance(out, dict):
         out.setdefault("rag", {})
         out["rag"]["used"] = False
@@ -4,15 +4,17 @@ from dataclasses import dataclass
 from typing import Dict, Any, List, Optional
 import os
 import re
+import math
 from utils import settings
 from utils.llm import chat_json
-from utils.metrics_b import build_compact_series_with_entropy
+from utils.metrics_b import build_compact_series_with_entropy, safe_float
 from utils.plotting import plot_involution_trend
-from utils.prompts import build_year_measure_messages
+from utils.prompts import METRICS, build_multi_year_measure_messages, build_year_measure_messages
 from utils.json_utils import save_json, pretty_print_json
 # RAG导入测试
 try:
     from rag.rag import FaissRAG
+    from rag.store_registry import get_store
 except Exception as e:
     raise ImportError("缺少 rag.py 或 FaissRAG。请确认 rag.py 在同目录且包含 FaissRAG.load/search/is_empty。") from e
 
@@ -66,11 +68,114 @@ def _rag_query(company: str, ylabel: str, start: str, end: str) -> str:
 
 def _load_store(store_dir: Optional[str] = None) -> FaissRAG:
     d = store_dir or getattr(settings, "RAG_STORE_DIR", "rag_store")
-    return FaissRAG.load(d)
+    return get_store(d)  # 注册表缓存：库未更新时不重复加载
 
 def _ensure_dir(path: str) -> None:
     os.makedirs(path, exist_ok=True)
 
+# -----------------------------
+# 年度结果标准化 / 多年份合并生成
+# -----------------------------
+def _series_item(one_out: Dict[str, Any], label: str) -> Dict[str, Any]:
+    """
+    单年模型输出 -> series 项（build_compact_series_with_entropy / plotting 使用的结构）。
+    """
+    period = one_out.get("period") or label
+    return {
+        "period": period,  # 推荐模型输出也用 "2010"；这里兼容已有结构
+        "metrics": one_out.get("metrics", {}),
+        "confidence": one_out.get("overall_confidence", 0.5),
+        "rationale": one_out.get("rationale", ""),
+        "used_evidence": one_out.get("used_evidence", []),
+        "notes": one_out.get("notes", []),
+    }
+
+
+def _valid_year_out(item: Any) -> bool:
+    """
+    多年份输出中的单年项是否可用：metrics 为 dict 且 METRICS 的每个指标都是数值。
+    """
+    if not isinstance(item, dict) or not isinstance(item.get("metrics"), dict):
+        return False
+    return all(safe_float(item["metrics"].get(m["key"])) is not None for m in METRICS)
+
+
+def _year_windows(years: List[YearPeriod]) -> List[List[YearPeriod]]:
+    """
+    按输出预算切分年份窗口：每窗口年数 <= MEASURE_MULTI_YEAR_MAX，
+    且 年数 × MEASURE_YEAR_OUTPUT_TOKENS 不超过 MAX_TOKENS；窗口大小尽量均匀（10 年 / 每窗 4 年 -> 4+3+3）。
+    """
+    per_year = max(1, int(getattr(settings, "MEASURE_YEAR_OUTPUT_TOKENS", 900)))
+    max_years = max(1, int(getattr(settings, "MEASURE_MULTI_YEAR_MAX", 5)))
+    size = max(1, min(max_years, (int(getattr(settings, "MAX_TOKENS", 4096)) - 200) // per_year))
+    n_windows = math.ceil(len(years) / size) if years else 0
+    out: List[List[YearPeriod]] = []
+    i = 0
+    for w in range(n_windows):
+        k = math.ceil((len(years) - i) / (n_windows - w))
+        out.append(years[i:i + k])
+        i += k
+    return out
+
+
+def _measure_series(
+    company: str,
+    years: List[YearPeriod],
+    hits_by_year: Dict[str, List[Dict[str, Any]]],
+    packs: Optional[Dict[str, Dict[str, Any]]],
+    multi_year: bool,
+) -> List[Dict[str, Any]]:
+    """
+    生成各年份 series 项：
+    - multi_year=False：每年一次模型调用
+    - multi_year=True：按 _year_windows 切分，每个窗口一次调用；窗口输出解析失败、缺少某年或该年指标不完整时，
+      只对这些年份回退为单年调用
+    """
+    def _one_year(y: YearPeriod) -> Dict[str, Any]:
+        pack = packs.setdefault(y.label, {}) if packs is not None else None
+        messages = build_year_measure_messages(
+            company, y.label, y.start, y.end, hits_by_year.get(y.label) or [], pack_info=pack
+        )
+        return _series_item(chat_json(messages), y.label)
+
+    if not multi_year:
+        return [_one_year(y) for y in years]
+
+    series: List[Dict[str, Any]] = []
+    for window in _year_windows(years):
+        if len(window) == 1:
+            series.append(_one_year(window[0]))
+            continue
+        messages = build_multi_year_measure_messages(
+            company,
+            [(y.label, y.start, y.end) for y in window],
+            hits_by_year,
+            pack_info=packs,
+        )
+        try:
+            out = chat_json(messages)
+        except ValueError:
+            out = {}
+
+        by_label: Dict[str, Dict[str, Any]] = {}
+        for item in out.get("years") or []:
+            if not _valid_year_out(item):
+                continue
+            try:
+                label = str(_extract_year(str(item.get("period") or "")))
+            except ValueError:
+                continue
+            by_label.setdefault(label, item)
+
+        for y in window:
+            item = by_label.get(y.label)
+            if item is None:
+                series.append(_one_year(y))
+            else:
+                item["period"] = y.label
+                series.append(_series_item(item, y.label))
+    return series
+
 # -----------------------------
 # 主函数：按年份循环测度
 # -----------------------------
@@ -82,43 +187,29 @@ def measure_company_yearly(
     rag_store_dir: Optional[str] = None,
     rag_top_k: int = 10,
     output_plot_dir: str = "output",
+    multi_year: Optional[bool] = None,
 ) -> Dict[str, Any]:
+    """
+    multi_year：多个年份合并为一次模型调用（None 时取 settings.MEASURE_MULTI_YEAR）。
+    """
+    if multi_year is None:
+        multi_year = bool(getattr(settings, "MEASURE_MULTI_YEAR", False))
     # 获取年份列表
     years = split_to_years(start, end)
     # 获取知识库地址
     store = _load_store(rag_store_dir)
     use_rag = not store.is_empty()
 
-    series: List[Dict[str, Any]] = []
+    # 年度：若库非空则检索；库为空则 hits=[]
+    hits_by_year: Dict[str, List[Dict[str, Any]]] = {}
     for y in years:
         y_query = _rag_query(company, y.label, y.start, y.end)
+        hits_by_year[y.label] = store.search(y_query, top_k=rag_top_k) if use_rag else []
 
-        # 年度：若库非空则检索；库为空则 hits=[]
-        hits = store.search(y_query, top_k=rag_top_k) if use_rag else []
-
-        # 年度：调用一次模型（prompts 若未实现 year 版，回退用 quarter 版）
-        messages = build_year_measure_messages(company, y.label, y.start, y.end, hits)
-        one_out = chat_json(messages)
-
-        # 标准化：把年度结果放进 series，便于复用 attach_index / plotting
-        period = one_out.get("period") or y.label
-        series.append(
-            {
-                "period": period,  # 推荐模型输出也用 "2010"；这里兼容已有结构
-                "metrics": one_out.get("metrics", {}),
-                "confidence": one_out.get("overall_confidence", 0.5),
-                "rationale": one_out.get("rationale", ""),
-                "used_evidence": one_out.get("used_evidence", []),
-                "notes": one_out.get("notes", []),
-            }
-        )
+    packs: Dict[str, Dict[str, Any]] = {}
+    series = _measure_series(company, years, hits_by_year, packs, multi_year)
 
-    # 如 store 具备 close()，兼容旧实现；FaissRAG 通常不需要
-    if hasattr(store, "close"):
-        try:
-            store.close()
-        except Exception:
-            pass
+    # store 来自共享注册表（其它会话可能正在使用），不在这里 close
 
     result: Dict[str, Any] = {
         "company": company,
@@ -130,10 +221,13 @@ def measure_company_yearly(
             "used": bool(use_rag),
             "store_dir": rag_store_dir or getattr(settings, "RAG_STORE_DIR", "rag_store"),
             "top_k": int(rag_top_k),
+            "evidence_pack": packs,  # 各年份证据 token 预算与实际装入情况
             "store_empty": not use_rag,
         },
+        "multi_year": bool(multi_year),
         "notes": [
-            "按年份依次循环生成：每个年份（可选）RAG检索 + 一次LLM生成。",
+            "多年份合并生成：按输出预算切分年份窗口，每个窗口一次LLM生成；缺失或不完整的年份回退为单年生成。"
+            if multi_year else "按年份依次循环生成：每个年份（可选）RAG检索 + 一次LLM生成。",
             "若向量库为空，则不使用RAG，直接生成年度测度结果。",
         ],
     }
@@ -156,30 +250,14 @@ def measure_company_yearly_from_none(
     end: str,
     *,
     output_plot_dir: str = "output",
+    multi_year: Optional[bool] = None,
 ) -> Dict[str, Any]:
+    if multi_year is None:
+        multi_year = bool(getattr(settings, "MEASURE_MULTI_YEAR", False))
     # 获取年份列表
     years = split_to_years(start, end)
 
-    series: List[Dict[str, Any]] = []
-    for y in years:
-        y_query = _rag_query(company, y.label, y.start, y.end)
-
-        # 年度：调用一次模型（prompts 若未实现 year 版，回退用 quarter 版）
-        messages = build_year_measure_messages(company, y.label, y.start, y.end,rag_hits=[])
-        one_out = chat_json(messages)
-
-        # 标准化：把年度结果放进 series，便于复用 attach_index / plotting
-        period = one_out.get("period") or y.label
-        series.append(
-            {
-                "period": period,  # 推荐模型输出也用 "2010"；这里兼容已有结构
-                "metrics": one_out.get("metrics", {}),
-                "confidence": one_out.get("overall_confidence", 0.5),
-                "rationale": one_out.get("rationale", ""),
-                "used_evidence": one_out.get("used_evidence", []),
-                "notes": one_out.get("notes", []),
-            }
-        )
+    series = _measure_series(company, years, {}, None, multi_year)
 
     result: Dict[str, Any] = {
         "company": company,
@@ -193,8 +271,10 @@ def measure_company_yearly_from_none(
             "top_k": 0,
             "store_empty": True,
         },
+        "multi_year": bool(multi_year),
         "notes": [
-            "按年份依次循环生成：每个年份（可选）RAG检索 + 一次LLM生成。",
+            "多年份合并生成：按输出预算切分年份窗口，每个窗口一次LLM生成；缺失或不完整的年份回退为单年生成。"
+            if multi_year else "按年份依次循环生成：每个年份（可选）RAG检索 + 一次LLM生成。",
             "若向量库为空，则不使用RAG，直接生成年度测度结果。",
         ],
     }
@@ -1,9 +1,11 @@
 from __future__ import annotations
-from typing import List, Optional, Union, Dict, Any
+from typing import Any, Callable, Dict, List, Optional, Union
 from utils import settings
 from rag.rag import FaissRAG
+from rag.store_registry import get_store
+from rag.federated import federated_search
 from utils.prompts import build_policy_simulation_messages
-from utils.llm import chat_json
+from utils.llm import chat_json, chat_json_stream
 from utils.json_utils import save_json, pretty_print_json
 
 def _get_store_dir() -> str:
@@ -12,7 +14,7 @@ def _get_store_dir() -> str:
 def load_rag_or_none(store_dir: Optional[str] = None) -> Optional[FaissRAG]:
 
     d = store_dir or _get_store_dir()
-    rag = FaissRAG.load(d)
+    rag = get_store(d)  # 注册表缓存：库未更新时不重复加载
     return None if rag.is_empty() else rag
 
 
@@ -23,34 +25,52 @@ def simulate_policy(
     time_horizon_months: int = 24,
     top_k: int = 12,
     store_dir: Optional[str] = None,
+    store_dirs: Optional[List[str]] = None,
+    store_quotas: Optional[Dict[str, int]] = None,
+    on_field: Optional[Callable[[tuple, Any], None]] = None,
 ) -> dict:
+    """
+    传入 store_dirs 时对多个库联合检索（并发、分数归一化、store_quotas 为每库最多条数），否则只检索 store_dir。
+    on_field：流式生成时每个闭合字段的回调 (path, value)，见 utils.llm.chat_json_stream。
+    """
 
     if isinstance(policy_input, list):
         policy_text = "\n".join([f"- {x}" for x in policy_input if str(x).strip()])
     else:
         policy_text = str(policy_input).strip()
 
-    rag = load_rag_or_none(store_dir)
+    retrieval_query = (
+        f"{industry_scope} 内卷 价格战 产能 研发 渠道 供应链 并购 退出 政策干预\n"
+        f"用户政策设定：{policy_text}"
+    )
     evidence: List[Dict[str, Any]] = []
-    if rag is not None:
-        retrieval_query = (
-            f"{industry_scope} 内卷 价格战 产能 研发 渠道 供应链 并购 退出 政策干预\n"
-            f"用户政策设定：{policy_text}"
-        )
-        evidence = rag.search(retrieval_query, top_k=top_k)
+    if store_dirs:
+        evidence = federated_search(retrieval_query, store_dirs, top_k=top_k, quotas=store_quotas)["hits"]
+    else:
+        rag = load_rag_or_none(store_dir)
+        if rag is not None:
+            evidence = rag.search(retrieval_query, top_k=top_k)
 
+    pack: Dict[str, Any] = {}
     try:
         messages = build_policy_simulation_messages(
             policy_input_text=policy_text,
             industry_scope=industry_scope,
             time_horizon_months=time_horizon_months,
             evidence_hits=evidence,
+            pack_info=pack,
         )
     except TypeError:
 
         messages = build_policy_simulation_messages(policy_text, evidence)
 
-    out = chat_json(messages)
+    # 传入 on_field 时流式生成：字段一闭合就回调，便于 UI 提前展示；
+    # 格式错误在 utils.llm 内修复 / 重试（至多 MAX_RETRY 次生成），检索结果不重算
+    attempts = int(getattr(settings, "MAX_RETRY", 5))
+    if on_field:
+        out = chat_json_stream(messages, on_field=on_field, max_attempts=attempts)
+    else:
+        out = chat_json(messages, max_attempts=attempts)
 
     # RAG
     if isinstance(out, dict):
@@ -58,7 +78,10 @@ def simulate_policy(
         out["rag"]["used"] = bool(evidence)
         out["rag"]["top_k"] = int(top_k)
         out["rag"]["store_dir"] = store_dir or _get_store_dir()
+        if store_dirs:
+            out["rag"]["store_dirs"] = list(store_dirs)
         out["rag"]["hits"] = evidence
+        out["rag"]["evidence_pack"] = pack  # 证据 token 预算与实际装入情况
 
     return out
 
@@ -68,6 +91,7 @@ def simulate_policy_from_none(
     *,
     industry_scope: str = "中国新能源汽车行业",
     time_horizon_months: int = 24,
+    on_field: Optional[Callable[[tuple, Any], None]] = None,
 ) -> dict:
     """无RAG."""
     if isinstance(policy_input, list):
@@ -81,7 +105,13 @@ def simulate_policy_from_none(
         time_horizon_months=time_horizon_months,
         evidence_hits=[],
     )
-    out = chat_json(messages)
+    # 传入 on_field 时流式生成：字段一闭合就回调，便于 UI 提前展示；
+    # 格式错误在 utils.llm 内修复 / 重试（至多 MAX_RETRY 次生成），检索结果不重算
+    attempts = int(getattr(settings, "MAX_RETRY", 5))
+    if on_field:
+        out = chat_json_stream(messages, on_field=on_field, max_attempts=attempts)
+    else:
+        out = chat_json(messages, max_attempts=attempts)
     if isinstance(out, dict):
         out.setdefault("rag", {})
         out["rag"]["used"] = False
@@ -0,0 +1,343 @@
+# bulk_ingest.py
+# 批量入库流水线：parse → chunk → embed → index 分阶段并行（有界队列），实时输出吞吐统计，结束时写 JSON 汇总
+from __future__ import annotations
+
+import os
+import glob
+import json
+import time
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from utils import settings
+from rag.rag import FaissRAG, SYNC_EXTENSIONS, _norm_path, _now_iso, _write_json_file
+
+_STOP = object()  # 队列结束哨兵
+
+
+# -----------------------------
+# 路径展开：目录 / glob / 文件
+# -----------------------------
+def expand_paths(specs: Iterable[str], *, extensions: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    把 目录 / glob / 文件路径 展开为去重后的文件列表（目录递归，仅保留支持的扩展名）。
+    显式给出的文件路径不做扩展名过滤。
+    """
+    exts = {e.lower() for e in (extensions or getattr(settings, "SYNC_EXTENSIONS", SYNC_EXTENSIONS))}
+    out: List[str] = []
+    seen = set()
+
+    def _push(p: str) -> None:
+        np_ = _norm_path(p)
+        if np_ not in seen:
+            seen.add(np_)
+            out.append(np_)
+
+    def _walk(d: str) -> None:
+        for dirpath, dirnames, filenames in os.walk(d):
+            dirnames[:] = sorted(x for x in dirnames if not x.startswith("."))
+            for fn in sorted(filenames):
+                if not fn.startswith(".") and os.path.splitext(fn)[1].lower() in exts:
+                    _push(os.path.join(dirpath, fn))
+
+    for spec in specs:
+        if os.path.isdir(spec):
+            _walk(spec)
+        elif os.path.isfile(spec):
+            _push(spec)
+        else:
+            for m in sorted(glob.glob(spec, recursive=True)):
+                if os.path.isdir(m):
+                    _walk(m)
+                elif os.path.splitext(m)[1].lower() in exts:
+                    _push(m)
+    return out
+
+
+# -----------------------------
+# 吞吐统计
+# -----------------------------
+def _percentile(sorted_vals: List[float], q: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    idx = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[idx]
+
+
+@dataclass
+class IngestStats:
+    total_files: int = 0
+    parsed_files: int = 0
+    skipped_files: int = 0          # 空文件 / 已存在（同内容）
+    failed_files: List[Dict[str, str]] = field(default_factory=list)
+    indexed_docs: int = 0
+    indexed_chunks: int = 0
+    embedded_chunks: int = 0
+    embed_calls: int = 0
+    embed_latencies: List[float] = field(default_factory=list)  # 秒，每次 embedding 请求
+    checkpoints: int = 0
+    started: float = field(default_factory=time.monotonic)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **kw: int) -> None:
+        with self._lock:
+            for k, v in kw.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    def record_embed(self, latency: float, n_chunks: int) -> None:
+        with self._lock:
+            self.embed_latencies.append(float(latency))
+            self.embed_calls += 1
+            self.embedded_chunks += int(n_chunks)
+
+    def record_failure(self, path: str, err: BaseException) -> None:
+        with self._lock:
+            self.failed_files.append({"path": path, "error": f"{type(err).__name__}: {err}"})
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = max(1e-9, time.monotonic() - self.started)
+            lat = sorted(self.embed_latencies)
+            done = self.indexed_docs + self.skipped_files + len(self.failed_files)
+            rate = done / elapsed
+            remaining = max(0, self.total_files - done)
+            return {
+                "elapsed_sec": round(elapsed, 3),
+                "total_files": self.total_files,
+                "done_files": done,
+                "parsed_files": self.parsed_files,
+                "skipped_files": self.skipped_files,
+                "failed_files": len(self.failed_files),
+                "indexed_docs": self.indexed_docs,
+                "indexed_chunks": self.indexed_chunks,
+                "embedded_chunks": self.embedded_chunks,
+                "embed_calls": self.embed_calls,
+                "checkpoints": self.checkpoints,
+                "docs_per_sec": round(self.indexed_docs / elapsed, 3),
+                "chunks_per_sec": round(self.indexed_chunks / elapsed, 3),
+                "embed_latency_ms": {
+                    "p50": None if not lat else round(_percentile(lat, 0.50) * 1000, 1),
+                    "p90": None if not lat else round(_percentile(lat, 0.90) * 1000, 1),
+                    "p99": None if not lat else round(_percentile(lat, 0.99) * 1000, 1),
+                    "max": None if not lat else round(lat[-1] * 1000, 1),
+                },
+                "eta_sec": round(remaining / rate, 1) if rate > 0 else None,
+            }
+
+
+def format_progress(snap: Dict[str, Any]) -> str:
+    lat = snap.get("embed_latency_ms") or {}
+    eta = snap.get("eta_sec")
+    return (
+        f"[bulk] {snap['done_files']}/{snap['total_files']} files"
+        f" | docs/s={snap['docs_per_sec']:.2f} chunks/s={snap['chunks_per_sec']:.1f}"
+        f" | embed p50={lat.get('p50')}ms p90={lat.get('p90')}ms p99={lat.get('p99')}ms"
+        f" | failed={snap['failed_files']} | eta={'-' if eta is None else f'{eta:.0f}s'}"
+    )
+
+
+# -----------------------------
+# 流水线
+# -----------------------------
+def bulk_ingest(
+    rag: FaissRAG,
+    paths: List[str],
+    *,
+    store_dir: str,
+    parse_workers: Optional[int] = None,
+    embed_workers: Optional[int] = None,
+    queue_size: Optional[int] = None,
+    checkpoint_docs: Optional[int] = None,
+    checkpoint_chunks: Optional[int] = None,
+    progress_every: float = 2.0,
+    progress_fn: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    多阶段并行入库：
+    - parse 线程：load_document + 切分（CPU/IO）
+    - embed 线程：按 EMBED_BATCH 分批调用 embedding 接口（网络），逐次记录延迟
+    - index 线程（单线程，唯一写 rag 的位置）：写入 faiss + 元数据，按检查点阈值 save
+    阶段之间用有界队列衔接，内存占用与队列长度成正比而非与语料规模成正比。
+    单个文件解析失败只记录并跳过；embedding/写入失败则停止流水线（summary["ok"]=False），
+    已写入索引的文档仍会提交，重新运行时已入库文档（同内容 hash）会被跳过。
+    返回汇总 dict（同 IngestStats.snapshot + 元信息），成功与否都可直接落盘用于容量规划。
+    """
+    n_parse = max(1, int(parse_workers or getattr(settings, "INGEST_PARSE_WORKERS", 2)))
+    n_embed = max(1, int(embed_workers or getattr(settings, "INGEST_EMBED_WORKERS", 4)))
+    qsize = max(1, int(queue_size or getattr(settings, "INGEST_QUEUE_SIZE", 16)))
+    every_docs = max(1, int(checkpoint_docs or getattr(settings, "INGEST_CHECKPOINT_DOCS", 20)))
+    every_chunks = max(1, int(checkpoint_chunks or getattr(settings, "INGEST_CHECKPOINT_CHUNKS", 2000)))
+    batch = max(1, int(getattr(settings, "EMBED_BATCH", 10)))
+
+    stats = IngestStats(total_files=len(paths))
+    path_q: "queue.Queue[Any]" = queue.Queue()
+    parsed_q: "queue.Queue[Any]" = queue.Queue(maxsize=qsize)
+    embedded_q: "queue.Queue[Any]" = queue.Queue(maxsize=qsize)
+    abort = threading.Event()
+    fatal: List[BaseException] = []
+
+    # parse 线程只读这份启动时的 doc_id 快照（跳过已入库文档，省去 embedding）；
+    # rag.docs 只由 index 线程读写（save 重放时还会整体替换），最终去重也在 index 线程
+    known_ids = frozenset(rag.docs)
+
+    for p in paths:
+        path_q.put(p)
+    for _ in range(n_parse):
+        path_q.put(_STOP)  # 每个 parse 线程一个
+
+    def _put(q: "queue.Queue[Any]", item: Any) -> bool:
+        # 有界队列的可中断 put：下游已中止时不再阻塞
+        while not abort.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fail(e: BaseException) -> None:
+        fatal.append(e)
+        abort.set()
+
+    def parse_worker() -> None:
+        while not abort.is_set():
+            path = path_q.get()
+            if path is _STOP:
+                break
+            try:
+                _, prepared = rag._prepare_doc(path, skip_existing=False)
+            except Exception as e:
+                stats.record_failure(path, e)
+                continue
+            stats.add(parsed_files=1)
+            if prepared is None or prepared.doc_id in known_ids:
+                stats.add(skipped_files=1)
+                continue
+            if not _put(parsed_q, prepared):
+                break
+
+    def embed_worker() -> None:
+        while not abort.is_set():
+            try:
+                item = parsed_q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if item is _STOP:
+                break
+            texts = [t for (_, _, t) in item.pieces]
+            try:
+                parts: List[np.ndarray] = []
+                for i in range(0, len(texts), batch):
+                    t0 = time.monotonic()
+                    parts.append(rag._embed_chunks(texts[i:i + batch]))
+                    stats.record_embed(time.monotonic() - t0, len(texts[i:i + batch]))
+                vecs = np.vstack(parts)
+            except Exception as e:
+                _fail(e)
+                break
+            if not _put(embedded_q, (item, vecs)):
+                break
+
+    pending = {"docs": 0, "chunks": 0}  # 上次提交后新写入的文档 / 切片数（只由 index 线程修改）
+
+    def index_worker() -> None:
+        # 唯一读写 rag 的线程；中止后继续排空队列直到收到 STOP，避免上游阻塞
+        while True:
+            item = embedded_q.get()
+            if item is _STOP:
+                break
+            if abort.is_set():
+                continue
+            prepared, vecs = item
+            if prepared.doc_id in rag.docs:
+                # 同一批中内容重复 / 其它写者已提交的文件：后到者跳过
+                stats.add(skipped_files=1)
+                continue
+            try:
+                entry = rag._insert_prepared(prepared, vecs)
+                stats.add(indexed_docs=1, indexed_chunks=int(entry["n_chunks"]))
+                pending["docs"] += 1
+                pending["chunks"] += int(entry["n_chunks"])
+                if pending["docs"] >= every_docs or pending["chunks"] >= every_chunks:
+                    rag.save(store_dir)
+                    stats.add(checkpoints=1)
+                    pending["docs"] = pending["chunks"] = 0
+            except Exception as e:
+                _fail(e)
+
+    parsers = [threading.Thread(target=parse_worker, name=f"bulk-parse-{i}", daemon=True) for i in range(n_parse)]
+    embedders = [threading.Thread(target=embed_worker, name=f"bulk-embed-{i}", daemon=True) for i in range(n_embed)]
+    indexer = threading.Thread(target=index_worker, name="bulk-index", daemon=True)
+
+    def coordinator() -> None:
+        # 上游阶段全部结束后再向下游发 STOP
+        for t in parsers:
+            t.join()
+        for _ in embedders:
+            _put(parsed_q, _STOP)
+        for t in embedders:
+            t.join()
+        embedded_q.put(_STOP)
+
+    for t in parsers + embedders + [indexer]:
+        t.start()
+    threading.Thread(target=coordinator, name="bulk-coordinator", daemon=True).start()
+
+    report = progress_fn or (lambda snap: print(format_progress(snap), flush=True))
+    while indexer.is_alive():
+        indexer.join(timeout=progress_every)
+        if indexer.is_alive():
+            report(stats.snapshot())
+
+    # 收尾提交：无论成功与否，已写入索引的文档都落盘；上次检查点后没有新文档时不再发布空快照
+    if pending["docs"]:
+        try:
+            rag.save(store_dir)
+            stats.add(checkpoints=1)
+        except Exception as e:
+            fatal.append(e)
+
+    summary = stats.snapshot()
+    summary.update(
+        {
+            "finished_at": _now_iso(),
+            "store_dir": os.path.abspath(store_dir),
+            "ok": not fatal,
+            "error": f"{type(fatal[0]).__name__}: {fatal[0]}" if fatal else None,
+            "failed": list(stats.failed_files),
+            "config": {
+                "parse_workers": n_parse,
+                "embed_workers": n_embed,
+                "queue_size": qsize,
+                "embed_batch": batch,
+                "checkpoint_docs": every_docs,
+                "checkpoint_chunks": every_chunks,
+                "embed_model": getattr(settings, "EMBED_MODEL", None),
+            },
+        }
+    )
+    report(summary)
+    return summary
+
+
+def failure_summary(err: BaseException, *, store_dir: str, total_files: int) -> Dict[str, Any]:
+    """
+    bulk_ingest 本身抛出异常（未能返回汇总）时的最小汇总，字段与正常汇总一致。
+    """
+    return {
+        "finished_at": _now_iso(),
+        "store_dir": os.path.abspath(store_dir),
+        "total_files": int(total_files),
+        "ok": False,
+        "error": f"{type(err).__name__}: {err}",
+        "failed": [],
+    }
+
+
+def write_summary(summary: Dict[str, Any], path: str) -> str:
+    _write_json_file(path, json.loads(json.dumps(summary, ensure_ascii=False, default=str)))
+    return os.path.abspath(path)
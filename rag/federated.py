@@ -0,0 +1,156 @@
+# federated.py
+# 多库联合检索：同一查询只 embedding 一次，并发检索多个知识库（财报 / 专利 / 招聘 / 价格等），
+# 分数按所有库的候选统一归一化后合并为一个 top-k，支持每库配额
+from __future__ import annotations
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+
+from utils import settings
+from rag.rag import embed_query_vector
+from rag.store_registry import get_store
+
+NORMALIZERS = ("minmax", "zscore", "store_minmax", "none")
+
+
+def _normalize(per_store: Mapping[str, List[float]], method: str) -> Dict[str, List[float]]:
+    """
+    把各库的候选分数归一化到同一尺度：
+    - minmax：以所有库候选的最小 / 最大值为锚点缩放到 [0, 1]，保留绝对相关度（只有全局最优命中为 1）
+    - zscore：以所有库候选的均值 / 标准差做 z-score
+    - store_minmax：各库分别 min-max，库内最优都为 1。即使某库只有不相关的命中，
+      其最优命中也会与其它库的最优命中同分，仅在各库分数尺度差异很大时使用
+    - none：保留原始余弦分数
+    各库使用同一 embedding 模型（维度不一致的库已跳过），余弦分数本身可比较，因此默认按全局锚点归一化。
+    """
+    if method == "none":
+        return {sd: list(v) for sd, v in per_store.items()}
+    if method not in NORMALIZERS:
+        raise ValueError(f"未知的归一化方式：{method}（可选 {NORMALIZERS}）")
+    out: Dict[str, List[float]] = {}
+    pooled = np.asarray([s for v in per_store.values() for s in v], dtype=np.float64)
+    for sd, scores in per_store.items():
+        if not scores:
+            out[sd] = []
+            continue
+        x = np.asarray(scores, dtype=np.float64)
+        ref = x if method == "store_minmax" else pooled
+        if method == "zscore":
+            std = float(ref.std())
+            out[sd] = [0.0] * len(scores) if std < 1e-12 else ((x - ref.mean()) / std).tolist()
+        else:
+            span = float(ref.max() - ref.min())
+            out[sd] = [1.0] * len(scores) if span < 1e-12 else ((x - ref.min()) / span).tolist()
+    return out
+
+
+def _rank_key(h: dict) -> tuple:
+    return h["score"], h.get("raw_score", h["score"])
+
+
+def merge_hits(
+    per_store: Mapping[str, List[dict]],
+    *,
+    top_k: int,
+    quotas: Optional[Union[int, Mapping[str, int]]] = None,
+    min_per_store: int = 0,
+) -> List[dict]:
+    """
+    合并各库已归一化的命中（每条需含 score）：
+    1) 先为每个库保留至多 min_per_store 条最优命中（保证每类证据都有代表）
+    2) 其余名额按归一化分数全局择优，单库总数不超过其配额（quotas 为 int 时对所有库生效）
+    结果按分数降序，同分时按原始余弦分数（raw_score）。
+    """
+    def _cap(sd: str) -> int:
+        if quotas is None:
+            return top_k
+        if isinstance(quotas, int):
+            return int(quotas)
+        return int(quotas.get(sd, top_k))
+
+    taken: Dict[str, int] = {sd: 0 for sd in per_store}
+    chosen: List[dict] = []
+    rest: List[dict] = []
+    for sd, hits in per_store.items():
+        ordered = sorted(hits, key=_rank_key, reverse=True)
+        n_min = min(int(min_per_store), _cap(sd), len(ordered))
+        chosen.extend(ordered[:n_min])
+        taken[sd] = n_min
+        rest.extend(ordered[n_min:])
+
+    chosen = sorted(chosen, key=_rank_key, reverse=True)[:top_k]
+    for h in sorted(rest, key=_rank_key, reverse=True):
+        if len(chosen) >= top_k:
+            break
+        sd = h["store_dir"]
+        if taken[sd] >= _cap(sd):
+            continue
+        chosen.append(h)
+        taken[sd] += 1
+    return sorted(chosen, key=_rank_key, reverse=True)
+
+
+def federated_search(
+    query: str,
+    store_dirs: Sequence[str],
+    *,
+    top_k: int = 12,
+    quotas: Optional[Union[int, Mapping[str, int]]] = None,
+    min_per_store: int = 0,
+    normalize: Optional[str] = None,
+    max_workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    并发检索多个知识库并合并为一个 top-k：
+    - 查询只 embedding 一次，各库通过 search_by_vector 并行检索（faiss 检索释放 GIL），
+      总延迟接近最慢的单库
+    - 每个库取 top_k 个候选，按 normalize 归一化后合并（见 _normalize / merge_hits），命中中附带 store_dir 与 raw_score；
+      quotas 的键与 store_dirs 一样按绝对路径匹配
+    - 空库 / 不存在的库 / 向量维度与查询不一致的库跳过，并在 stores 中记录原因
+    返回 {"hits": [...], "stores": {store_dir: {n_candidates, sec, error}}, "sec": 总耗时}
+    """
+    method = normalize or getattr(settings, "RAG_FEDERATED_NORMALIZE", "minmax")
+    dirs = list(dict.fromkeys(os.path.abspath(d) for d in store_dirs if d))
+    if quotas is not None and not isinstance(quotas, int):
+        quotas = {os.path.abspath(k): int(v) for k, v in quotas.items() if k}
+    t0 = time.perf_counter()
+    q = embed_query_vector(query)
+
+    def _one(sd: str) -> Dict[str, Any]:
+        t = time.perf_counter()
+        info: Dict[str, Any] = {"n_candidates": 0, "sec": 0.0, "error": None, "hits": []}
+        try:
+            rag = get_store(sd)
+            if rag.is_empty():
+                info["error"] = "empty"
+            elif rag.dim is not None and int(rag.dim) != int(q.shape[1]):
+                info["error"] = f"dim mismatch: store={rag.dim} query={q.shape[1]}"
+            else:
+                info["hits"] = rag.search_by_vector(q, top_k=top_k)
+        except Exception as e:
+            info["error"] = f"{type(e).__name__}: {e}"
+        info["n_candidates"] = len(info["hits"])
+        info["sec"] = round(time.perf_counter() - t, 4)
+        return info
+
+    workers = max(1, min(len(dirs), int(max_workers or getattr(settings, "RAG_FEDERATED_WORKERS", 8)))) if dirs else 1
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="federated") as ex:
+        results = dict(zip(dirs, ex.map(_one, dirs)))
+
+    raw_hits = {sd: info.pop("hits") for sd, info in results.items()}
+    norm = _normalize({sd: [h["score"] for h in hits] for sd, hits in raw_hits.items()}, method)
+    per_store: Dict[str, List[dict]] = {
+        sd: [dict(h, raw_score=h["score"], score=float(s), store_dir=sd) for h, s in zip(hits, norm[sd])]
+        for sd, hits in raw_hits.items()
+    }
+
+    return {
+        "hits": merge_hits(per_store, top_k=top_k, quotas=quotas, min_per_store=min_per_store),
+        "stores": results,
+        "normalize": method,
+        "sec": round(time.perf_counter() - t0, 4),
+    }
@@ -0,0 +1,350 @@
+# packed_store.py
+# 单文件打包格式：把 向量 / 切片元数据 / 文本 打包为一个按 64 字节对齐的二进制文件，目标机器上直接 mmap 使用，
+# 无需再解析 chunks.jsonl（rag_store_manager export / import）
+from __future__ import annotations
+
+import os
+import json
+import shutil
+import struct
+from typing import Any, Dict, Iterator, List, MutableMapping, Optional
+
+import numpy as np
+
+from rag.rag import Chunk, FaissRAG, ParentChunk, _now_iso
+from rag.store_lock import StoreLock
+from rag.snapshots import gc_snapshots, publish_snapshot, staging_dir
+
+MAGIC = b"IIARAG01"
+FORMAT_VERSION = 2
+ALIGN = 64
+
+# 头部：magic, format_version, dim, n, 然后各 section 的 (offset, length)
+# v2：新增父段（parent_ids / parent_meta），chunk_meta 增加 parent_id 列
+_PREFIX = struct.Struct("<8sI")
+SECTIONS_BY_VERSION = {
+    1: ("ids", "vectors", "chunk_meta", "text_blob", "meta_json"),
+    2: ("ids", "vectors", "chunk_meta", "parent_ids", "parent_meta", "text_blob", "meta_json"),
+}
+HEADER_SIZE = 256
+
+_CHUNK_FIELDS_V1 = [
+    ("vector_id", "<i8"),
+    ("start", "<i8"),
+    ("end", "<i8"),
+    ("doc_idx", "<u4"),
+    ("id_len", "<u4"),
+    ("id_off", "<u8"),
+    ("text_off", "<u8"),
+    ("text_len", "<u8"),
+]
+CHUNK_META_DTYPES = {
+    1: np.dtype(_CHUNK_FIELDS_V1),
+    2: np.dtype(_CHUNK_FIELDS_V1 + [("parent_id", "<i8")]),  # -1 = 无父段
+}
+CHUNK_META_DTYPE = CHUNK_META_DTYPES[FORMAT_VERSION]
+
+PARENT_META_DTYPE = np.dtype(
+    [
+        ("start", "<i8"),
+        ("end", "<i8"),
+        ("doc_idx", "<u4"),
+        ("_pad", "<u4"),
+        ("text_off", "<u8"),
+        ("text_len", "<u8"),
+    ]
+)
+
+
+def _header_struct(version: int) -> struct.Struct:
+    return struct.Struct("<8sIIQ" + "QQ" * len(SECTIONS_BY_VERSION[version]))
+
+
+def _pad(n: int) -> int:
+    return (ALIGN - n % ALIGN) % ALIGN
+
+
+# -----------------------------
+# 导出
+# -----------------------------
+def export_packed(rag: FaissRAG, out_path: str) -> Dict[str, Any]:
+    """
+    把内存中的库写为单个打包文件（先写 .tmp 再原子替换），返回 {path, bytes, n, dim}。
+    """
+    ids, vecs = rag.all_vectors()
+    n = int(ids.shape[0])
+    dim = int(vecs.shape[1]) if n else int(rag.dim or 0)
+
+    doc_ids: List[str] = sorted(rag.docs.keys())
+    doc_pos = {d: i for i, d in enumerate(doc_ids)}
+
+    meta = np.zeros(n, dtype=CHUNK_META_DTYPE)
+    blob_parts: List[bytes] = []
+    off = 0
+    for i, vid in enumerate(ids.tolist()):
+        c = rag.chunks_by_vid[int(vid)]
+        cid = c.chunk_id.encode("utf-8")
+        txt = c.text.encode("utf-8")
+        pid = -1 if c.parent_id is None else int(c.parent_id)
+        meta[i] = (vid, c.start, c.end, doc_pos.get(c.doc_id, 0), len(cid), off, off + len(cid), len(txt), pid)
+        blob_parts.append(cid)
+        blob_parts.append(txt)
+        off += len(cid) + len(txt)
+
+    parent_ids = np.array(sorted(rag.parents_by_id.keys()), dtype=np.int64)
+    parent_meta = np.zeros(parent_ids.shape[0], dtype=PARENT_META_DTYPE)
+    for i, pid in enumerate(parent_ids.tolist()):
+        pc = rag.parents_by_id[int(pid)]
+        txt = pc.text.encode("utf-8")
+        parent_meta[i] = (pc.start, pc.end, doc_pos.get(pc.doc_id, 0), 0, off, len(txt))
+        blob_parts.append(txt)
+        off += len(txt)
+    blob = b"".join(blob_parts)
+
+    # 文档表：vector_ids 可由 chunk_meta.doc_idx 还原，不重复存储
+    docs_light = {d: {k: v for k, v in e.items() if k != "vector_ids"} for d, e in rag.docs.items()}
+    meta_json = json.dumps(
+        {
+            "exported_at": _now_iso(),
+            "generation": rag.base_generation,
+            "dim": rag.dim,
+            "metric": "cosine_ip",
+            "chunk_size": rag.chunk_size,
+            "overlap": rag.overlap,
+            "parent_chunk_size": rag.parent_chunk_size,
+            "pca_dim": rag.pca_dim,
+            "next_vector_id": rag.next_vector_id,
+            "next_parent_id": rag.next_parent_id,
+            "doc_ids": doc_ids,
+            "docs": docs_light,
+            "files": rag.file_table,
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+
+    payloads = [ids.tobytes(), vecs.tobytes(), meta.tobytes(), parent_ids.tobytes(), parent_meta.tobytes(), blob, meta_json]
+    table: List[int] = []
+    pos = HEADER_SIZE
+    for data in payloads:
+        table += [pos, len(data)]
+        pos += len(data) + _pad(len(data))
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp = out_path + ".tmp"
+    with open(tmp, "wb") as f:
+        header = _header_struct(FORMAT_VERSION).pack(MAGIC, FORMAT_VERSION, dim, n, *table)
+        f.write(header + b"\0" * (HEADER_SIZE - len(header)))
+        for data in payloads:
+            f.write(data)
+            f.write(b"\0" * _pad(len(data)))
+        f.flush()
+        try:
+            os.fsync(f.fileno())
+        except Exception:
+            pass
+    os.replace(tmp, out_path)
+    return {"path": os.path.abspath(out_path), "bytes": os.path.getsize(out_path), "n": n, "dim": dim}
+
+
+# -----------------------------
+# 读取（mmap，零解析）
+# -----------------------------
+def read_header(path: str) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) < _PREFIX.size:
+        raise ValueError(f"不是有效的打包库文件（文件过短）：{path}")
+    magic, version = _PREFIX.unpack(raw[:_PREFIX.size])
+    if magic != MAGIC:
+        raise ValueError(f"不是有效的打包库文件（magic 不匹配）：{path}")
+    if version not in SECTIONS_BY_VERSION:
+        raise ValueError(f"不支持的打包库版本 {version}（当前支持 ≤{FORMAT_VERSION}）：{path}")
+    hs = _header_struct(version)
+    if len(raw) < hs.size:
+        raise ValueError(f"不是有效的打包库文件（头部不完整）：{path}")
+    fields = hs.unpack(raw[:hs.size])
+    dim, n = fields[2], fields[3]
+    rest = fields[4:]
+    names = SECTIONS_BY_VERSION[version]
+    sections = {name: (int(rest[2 * i]), int(rest[2 * i + 1])) for i, name in enumerate(names)}
+    return {"version": int(version), "dim": int(dim), "n": int(n), "sections": sections}
+
+
+class _PackedMap(MutableMapping):
+    """
+    id -> 记录 的惰性映射：底层为 mmap 的有序 id 数组 + 元数据表 + text_blob，访问时才解码单条记录；
+    增删写入内存覆盖层，不修改底层文件（打包文件对所有读者只读）。
+    """
+
+    def __init__(self, ids: np.ndarray, meta: np.ndarray, blob: np.ndarray,
+                 doc_ids: List[str], source_paths: List[str]) -> None:
+        self._ids = ids
+        self._meta = meta
+        self._blob = blob
+        self._doc_ids = doc_ids
+        self._source_paths = source_paths
+        self._hidden: set = set()
+        self._extra: Dict[int, Any] = {}
+
+    def _text(self, off: int, length: int) -> str:
+        return self._blob[off:off + length].tobytes().decode("utf-8")
+
+    def _decode(self, pos: int) -> Any:
+        raise NotImplementedError
+
+    def _base_pos(self, vid: int) -> Optional[int]:
+        pos = int(np.searchsorted(self._ids, vid))
+        if pos < self._ids.shape[0] and int(self._ids[pos]) == vid:
+            return pos
+        return None
+
+    def __getitem__(self, vid: int) -> Any:
+        vid = int(vid)
+        if vid in self._extra:
+            return self._extra[vid]
+        if vid in self._hidden:
+            raise KeyError(vid)
+        pos = self._base_pos(vid)
+        if pos is None:
+            raise KeyError(vid)
+        return self._decode(pos)
+
+    def __setitem__(self, vid: int, c: Any) -> None:
+        vid = int(vid)
+        if self._base_pos(vid) is not None:
+            self._hidden.add(vid)
+        self._extra[vid] = c
+
+    def __delitem__(self, vid: int) -> None:
+        vid = int(vid)
+        if vid in self._extra:
+            del self._extra[vid]
+            return
+        if vid in self._hidden or self._base_pos(vid) is None:
+            raise KeyError(vid)
+        self._hidden.add(vid)
+
+    def __iter__(self) -> Iterator[int]:
+        for vid in self._ids.tolist():
+            if vid not in self._hidden:
+                yield int(vid)
+        yield from list(self._extra.keys())
+
+    def __len__(self) -> int:
+        return int(self._ids.shape[0]) - len(self._hidden) + len(self._extra)
+
+
+class PackedChunkMap(_PackedMap):
+    """
+    vector_id -> Chunk（chunk_meta 行按 vector_id 升序，与 ids 一一对应）。
+    """
+
+    def _decode(self, pos: int) -> Chunk:
+        m = self._meta[pos]
+        di = int(m["doc_idx"])
+        pid = int(m["parent_id"]) if "parent_id" in m.dtype.names else -1
+        return Chunk(
+            vector_id=int(m["vector_id"]),
+            chunk_id=self._text(int(m["id_off"]), int(m["id_len"])),
+            doc_id=self._doc_ids[di],
+            text=self._text(int(m["text_off"]), int(m["text_len"])),
+            source_path=self._source_paths[di],
+            start=int(m["start"]),
+            end=int(m["end"]),
+            parent_id=None if pid < 0 else pid,
+        )
+
+
+class PackedParentMap(_PackedMap):
+    """
+    parent_id -> ParentChunk（parent_meta 行按 parent_id 升序）。
+    """
+
+    def _decode(self, pos: int) -> ParentChunk:
+        m = self._meta[pos]
+        return ParentChunk(
+            parent_id=int(self._ids[pos]),
+            doc_id=self._doc_ids[int(m["doc_idx"])],
+            text=self._text(int(m["text_off"]), int(m["text_len"])),
+            start=int(m["start"]),
+            end=int(m["end"]),
+        )
+
+
+def load_packed(path: str, cls: type = FaissRAG) -> FaissRAG:
+    """
+    mmap 打包文件并构造 FaissRAG：切片文本按需解码（不解析 JSONL），
+    向量从 mmap 一次性批量拷入 IndexFlatIP（faiss Flat 索引不支持直接在映射内存上检索）。
+    """
+    h = read_header(path)
+    n, dim, sec = h["n"], h["dim"], h["sections"]
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+
+    def _view(name: str, dtype: Any) -> np.ndarray:
+        off, length = sec[name]
+        return mm[off:off + length].view(dtype)
+
+    m = json.loads(_view("meta_json", np.uint8).tobytes().decode("utf-8"))
+    ids = _view("ids", np.int64)
+    meta = _view("chunk_meta", CHUNK_META_DTYPES[h["version"]])
+    blob = _view("text_blob", np.uint8)
+
+    rag = cls(dim=None)
+    rag.dim = m.get("dim")
+    rag.chunk_size = int(m.get("chunk_size", rag.chunk_size))
+    rag.overlap = int(m.get("overlap", rag.overlap))
+    rag.parent_chunk_size = int(m.get("parent_chunk_size", rag.parent_chunk_size))
+    rag.pca_dim = int(m.get("pca_dim", rag.pca_dim))  # 打包文件只存全精度向量；PCA 在下次 save 时重新训练
+    rag.next_vector_id = int(m.get("next_vector_id", 1))
+    rag.next_parent_id = int(m.get("next_parent_id", 1))
+    rag.base_generation = int(m.get("generation", 0))
+    rag.file_table = dict(m.get("files") or {})
+
+    doc_ids: List[str] = list(m.get("doc_ids") or [])
+    docs: Dict[str, dict] = {d: dict(e) for d, e in (m.get("docs") or {}).items()}
+    source_paths = [docs.get(d, {}).get("source_path", "") for d in doc_ids]
+
+    # 还原每篇文档的 vector_ids（按 doc_idx 分组）
+    if n:
+        doc_idx = np.asarray(meta["doc_idx"], dtype=np.int64)
+        order = np.argsort(doc_idx, kind="stable")
+        bounds = np.searchsorted(doc_idx[order], np.arange(len(doc_ids) + 1))
+        sorted_ids = np.asarray(ids)[order]
+        for i, d in enumerate(doc_ids):
+            docs.setdefault(d, {"doc_id": d})["vector_ids"] = sorted_ids[bounds[i]:bounds[i + 1]].tolist()
+    rag.docs = docs
+    rag.chunks_by_vid = PackedChunkMap(ids, meta, blob, doc_ids, source_paths)
+    if "parent_ids" in sec:
+        rag.parents_by_id = PackedParentMap(
+            _view("parent_ids", np.int64), _view("parent_meta", PARENT_META_DTYPE), blob, doc_ids, source_paths)
+
+    if n:
+        vecs = _view("vectors", np.float32).reshape(n, dim)
+        rag._ensure_index(dim)
+        rag.index.add_with_ids(vecs, np.asarray(ids))
+    return rag
+
+
+# -----------------------------
+# 导入：打包文件作为新快照发布
+# -----------------------------
+def import_packed(store_dir: str, pack_path: str) -> int:
+    """
+    校验后把打包文件复制为 store_dir 的新快照并原子发布（替换原有库内容），返回新快照代数。
+    """
+    read_header(pack_path)
+    with StoreLock(store_dir):
+        generation = FaissRAG.committed_generation(store_dir) + 1
+        staged = staging_dir(store_dir, generation)
+        try:
+            shutil.copyfile(pack_path, os.path.join(staged, FaissRAG.PACK_FNAME))
+        except Exception:
+            shutil.rmtree(staged, ignore_errors=True)
+            raise
+        publish_snapshot(store_dir, staged, generation)
+        p = FaissRAG.store_paths(store_dir)
+        for k in ["index", "chunks", "manifest"]:
+            if os.path.exists(p[k]):
+                os.remove(p[k])
+        gc_snapshots(store_dir)
+    return generation
@@ -0,0 +1,142 @@
+# pca_rerank.py
+# 降维检索：faiss PCAMatrix 把向量降到 128–256 维做第一阶段检索，
+# 候选再用 mmap 侧文件中的全精度向量精排（FaissRAG(pca_dim=...) 使用）
+from __future__ import annotations
+
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import faiss
+
+
+class PCAProjector:
+    """
+    PCA 投影（由 faiss.PCAMatrix 训练）：
+    - 文档向量：y = A (x - mean)
+    - 查询向量：z = A q（不减均值）
+    z·y = q·x̂ - q·mean，对同一查询而言与 q·x̂ 只差常数，排序等价于在 PCA 重构向量上的内积排序。
+    """
+
+    def __init__(self, pca: faiss.PCAMatrix) -> None:
+        self.pca = pca
+        self.d_in = int(pca.d_in)
+        self.d_out = int(pca.d_out)
+        self.A = faiss.vector_to_array(pca.A).astype(np.float32).reshape(self.d_out, self.d_in)
+        self.mean = faiss.vector_to_array(pca.mean).astype(np.float32)
+
+    @classmethod
+    def train(cls, vecs: np.ndarray, d_out: int, *, max_train: int = 100_000, seed: int = 0) -> "PCAProjector":
+        x = np.ascontiguousarray(vecs, dtype=np.float32)
+        if x.shape[0] > max_train:
+            sel = np.random.default_rng(seed).choice(x.shape[0], size=max_train, replace=False)
+            x = np.ascontiguousarray(x[np.sort(sel)])
+        pca = faiss.PCAMatrix(int(x.shape[1]), int(d_out))
+        pca.train(x)
+        return cls(pca)
+
+    def project_docs(self, x: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray((np.asarray(x, dtype=np.float32) - self.mean) @ self.A.T, dtype=np.float32)
+
+    def project_query(self, q: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(np.asarray(q, dtype=np.float32) @ self.A.T, dtype=np.float32)
+
+    def save(self, path: str) -> None:
+        faiss.write_VectorTransform(self.pca, path)
+
+    @classmethod
+    def load(cls, path: str) -> "PCAProjector":
+        vt = faiss.read_VectorTransform(path)
+        proj = cls(faiss.downcast_VectorTransform(vt))
+        proj._owner = vt  # downcast 得到的对象不持有底层内存，保留原引用防止被回收
+        return proj
+
+
+class FullVectorStore:
+    """
+    全精度向量侧存储：已提交部分为 mmap 的 .npy（ids 升序 + 对应行向量，只读、按需分页），
+    本实例新增/删除的向量记在内存覆盖层，save 时合并写出新文件。
+    常驻内存只有覆盖层与精排时实际访问到的页。
+    """
+
+    def __init__(self, dim: int, ids: Optional[np.ndarray] = None, vecs: Optional[np.ndarray] = None) -> None:
+        self.dim = int(dim)
+        self._ids = ids if ids is not None else np.zeros(0, dtype=np.int64)
+        self._vecs = vecs if vecs is not None else np.zeros((0, self.dim), dtype=np.float32)
+        self._removed: set = set()
+        self._extra: Dict[int, np.ndarray] = {}
+
+    @classmethod
+    def open(cls, ids_path: str, vecs_path: str) -> "FullVectorStore":
+        ids = np.load(ids_path, mmap_mode="r")
+        vecs = np.load(vecs_path, mmap_mode="r")
+        return cls(int(vecs.shape[1]), ids, vecs)
+
+    def __len__(self) -> int:
+        return int(self._ids.shape[0]) - len(self._removed) + len(self._extra)
+
+    def add(self, ids: Iterable[int], vecs: np.ndarray) -> None:
+        for vid, v in zip(ids, np.asarray(vecs, dtype=np.float32)):
+            self._extra[int(vid)] = np.array(v, dtype=np.float32)
+
+    def remove(self, ids: Iterable[int]) -> None:
+        for vid in ids:
+            vid = int(vid)
+            if self._extra.pop(vid, None) is None:
+                self._removed.add(vid)
+
+    def get(self, ids: Iterable[int]) -> np.ndarray:
+        """
+        按 id 取全精度向量 [n, dim]（找不到的 id 返回零向量）。
+        """
+        ids = [int(v) for v in ids]
+        out = np.zeros((len(ids), self.dim), dtype=np.float32)
+        base_rows = []
+        base_pos = []
+        for i, vid in enumerate(ids):
+            v = self._extra.get(vid)
+            if v is not None:
+                out[i] = v
+            elif vid not in self._removed:
+                base_rows.append(i)
+                base_pos.append(vid)
+        if base_rows and self._ids.shape[0]:
+            q = np.array(base_pos, dtype=np.int64)
+            pos = np.minimum(np.searchsorted(self._ids, q), self._ids.shape[0] - 1)
+            ok = np.asarray(self._ids[pos]) == q
+            rows = np.array(base_rows)[ok]
+            order = np.argsort(pos[ok])  # 顺序读取 mmap 页
+            out[rows[order]] = self._vecs[pos[ok][order]]
+        return out
+
+    def all_ids(self) -> np.ndarray:
+        base = np.asarray(self._ids)
+        if self._removed:
+            base = base[~np.isin(base, np.fromiter(self._removed, dtype=np.int64))]
+        extra = np.fromiter(self._extra.keys(), dtype=np.int64, count=len(self._extra))
+        return np.sort(np.concatenate([base, extra]))
+
+    def write(self, ids_path: str, vecs_path: str, *, block: int = 65536) -> None:
+        """
+        合并已提交部分与覆盖层，按 id 升序分块写出（不需要一次性把全部向量读入内存）。
+        """
+        ids = self.all_ids()
+        np.save(ids_path, ids)
+        out = np.lib.format.open_memmap(vecs_path, mode="w+", dtype=np.float32, shape=(int(ids.shape[0]), self.dim))
+        for i in range(0, int(ids.shape[0]), block):
+            out[i:i + block] = self.get(ids[i:i + block].tolist())
+        out.flush()
+        del out
+
+
+def exact_rerank(q: np.ndarray, cand_ids: np.ndarray, full: FullVectorStore) -> "tuple[np.ndarray, np.ndarray]":
+    """
+    用全精度向量对候选精排：返回 (scores 降序, ids)。q 为已归一化的 [dim] 查询向量。
+    """
+    cand_ids = np.asarray(cand_ids, dtype=np.int64)
+    cand_ids = cand_ids[cand_ids >= 0]
+    if cand_ids.shape[0] == 0:
+        return np.zeros(0, dtype=np.float32), cand_ids
+    scores = full.get(cand_ids.tolist()) @ np.asarray(q, dtype=np.float32).reshape(-1)
+    order = np.argsort(-scores, kind="stable")
+    return scores[order], cand_ids[order]
+
@@ -5,15 +5,35 @@ from __future__ import annotations
 import os
 import json
 import time
+import shutil
 import hashlib
-from dataclasses import dataclass, asdict
-from typing import Dict, List, Optional, Tuple, Iterable
+import weakref
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from typing import Dict, Iterator, List, Optional, Tuple, Iterable
 
 import numpy as np
 import faiss
 
 from utils import settings
 from utils.llm import embed_texts, embed_query
+from rag.store_lock import StoreLock
+from rag.xlsx_reader import normalize_headers as _normalize_headers, read_xlsx_file
+from rag.pca_rerank import FullVectorStore, PCAProjector, exact_rerank
+from rag.snapshots import (
+    CURRENT_FNAME,
+    SNAPSHOTS_DIRNAME,
+    SnapshotPin,
+    current_generation,
+    current_snapshot,
+    current_token,
+    gc_snapshots,
+    publish_snapshot,
+    staging_dir,
+)
+
+_log = logging.getLogger(__name__)
 
 
 # -----------------------------
@@ -28,6 +48,34 @@ class Chunk:
     source_path: str
     start: int
     end: int
+    parent_id: Optional[int] = None  # 父子切分时所属父段（见 ParentChunk）
+
+
+@dataclass
+class ParentChunk:
+    """
+    父段（small-to-big）：不向量化，只在子块命中后按 parent_id 取回，作为给 LLM 的完整上下文。
+    """
+    parent_id: int
+    doc_id: str
+    text: str
+    start: int
+    end: int
+
+
+@dataclass
+class PreparedDoc:
+    """
+    已读取、已切分但尚未向量化的文档（入库流水线中 parse/chunk 阶段的产物）。
+    """
+    doc_id: str
+    source_path: str
+    sha256: str
+    pieces: List[Tuple[int, int, str]]
+    chunk_ids: List[str]
+    parents: List[Tuple[int, int, str]] = field(default_factory=list)  # 父段 (start, end, text)
+    parent_idx: List[int] = field(default_factory=list)                 # 每个 piece 所属父段在 parents 中的下标
+    meta: Dict[str, object] = field(default_factory=dict)               # 并入 manifest entry 的附加字段（如 truncated）
 
 
 # -----------------------------
@@ -98,6 +146,25 @@ def _write_json_file(path: str, obj: dict) -> None:
     _write_text_file(path, json.dumps(obj, ensure_ascii=False, indent=2))
 
 
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_manifest_generation(path: str) -> int:
+    """
+    读取 manifest 的写入代数（generation）；文件不存在/损坏/旧版本均视为 0。
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return int(json.load(f).get("generation", 0))
+    except Exception:
+        return 0
+
+
 def _write_jsonl_chunks(path: str, chunks_by_vid: Dict[int, "Chunk"]) -> None:
     lines = []
     for vid in sorted(chunks_by_vid.keys()):
@@ -105,13 +172,189 @@ def _write_jsonl_chunks(path: str, chunks_by_vid: Dict[int, "Chunk"]) -> None:
     _write_text_file(path, "\n".join(lines) + ("\n" if lines else ""))
 
 
+def _write_jsonl_parents(path: str, parents_by_id: Dict[int, "ParentChunk"]) -> None:
+    lines = []
+    for pid in sorted(parents_by_id.keys()):
+        lines.append(json.dumps(asdict(parents_by_id[pid]), ensure_ascii=False))
+    _write_text_file(path, "\n".join(lines) + ("\n" if lines else ""))
+
+
 def read_txt_file(path: str) -> str:
     with open(path, "r", encoding="utf-8", errors="ignore") as f:
         return f.read()
 
 
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def _table_row_line(cells: List[str], headers: Optional[List[str]]) -> str:
+    """
+    表格行 -> 一行文本：有表头时输出  表头: 值  键值对（\t 分隔，与 XLSX 行格式一致），否则用 | 连接。
+    """
+    if headers is None:
+        return " | ".join(c for c in cells if c)
+    pairs = []
+    for i, v in enumerate(cells):
+        if not v:
+            continue
+        h = headers[i] if i < len(headers) and headers[i] else f"col_{i + 1}"
+        pairs.append(f"{h}: {v}")
+    return "\t".join(pairs)
+
+
+def _docx_cell_layout(tc) -> Tuple[int, Optional[str]]:
+    """
+    单元格的 (横向合并列数 gridSpan, 纵向合并 vMerge："restart" / "continue" / None)。
+    """
+    pr = tc.find(_W_NS + "tcPr")
+    if pr is None:
+        return 1, None
+    span = 1
+    gs = pr.find(_W_NS + "gridSpan")
+    if gs is not None:
+        try:
+            span = max(1, int(gs.get(_W_NS + "val", "1")))
+        except ValueError:
+            span = 1
+    vm = pr.find(_W_NS + "vMerge")
+    vmerge = None if vm is None else (vm.get(_W_NS + "val") or "continue")
+    return span, vmerge
+
+
+def _docx_grid_before(tr) -> int:
+    gb = tr.find(f"{_W_NS}trPr/{_W_NS}gridBefore")
+    try:
+        return max(0, int(gb.get(_W_NS + "val", "0"))) if gb is not None else 0
+    except ValueError:
+        return 0
+
+
+def _expand_docx_row(
+    raw: List[Tuple[str, int, Optional[str]]],
+    above: List[str],
+    before: int,
+    *,
+    is_header: bool,
+) -> Tuple[List[str], List[str]]:
+    """
+    按表格网格展开一行，返回 (输出用单元格, 供下一行纵向合并沿用的各列文本)：
+    - gridBefore 跳过的列补空
+    - vMerge 续接的单元格取上一行同列文本
+    - gridSpan 合并的单元格：表头行在每列重复（再按重名规则编号），数据行只放在首列、其余列留空
+    """
+    cells: List[str] = [""] * before
+    grid: List[str] = [""] * before
+    col = before
+    for txt, span, vmerge in raw:
+        if vmerge == "continue":
+            txt = above[col] if col < len(above) else ""
+        for k in range(span):
+            grid.append(txt)
+            cells.append(txt if (k == 0 or is_header) else "")
+        col += span
+    return cells, grid
+
+
+def iter_docx_blocks(path: str) -> Iterator[str]:
+    """
+    流式解析 word/document.xml（zip 内增量 iterparse，不构建 python-docx 对象模型），按文档顺序产出：
+    - 正文段落文本
+    - 表格行：首行作为表头，其余每行输出为  表头: 值  键值对；嵌套表格的内容并入所在单元格；
+      合并单元格按网格展开（gridSpan 横向、vMerge 纵向沿用上一行），值与表头列对齐
+    解析完的元素立即 clear，峰值内存与单个段落/表格行相当而非与整篇文档相当。
+    """
+    import zipfile
+    import xml.etree.ElementTree as ET
+
+    P, T, TAB, BR, CR = _W_NS + "p", _W_NS + "t", _W_NS + "tab", _W_NS + "br", _W_NS + "cr"
+    TBL, TR, TC, BODY = _W_NS + "tbl", _W_NS + "tr", _W_NS + "tc", _W_NS + "body"
+
+    body = None
+    para: List[str] = []
+    # 每层表格：{"headers", "row", "cell"}；cell 收集该单元格内的段落
+    tables: List[dict] = []
+
+    with zipfile.ZipFile(path) as zf, zf.open("word/document.xml") as fp:
+        for event, el in ET.iterparse(fp, events=("start", "end")):
+            tag = el.tag
+            if event == "start":
+                if tag == BODY:
+                    body = el
+                elif tag == TBL:
+                    tables.append({"headers": None, "row": [], "cell": [], "n_rows": 0, "above": []})
+                elif tag == TR and tables:
+                    tables[-1]["row"] = []
+                elif tag == TC and tables:
+                    tables[-1]["cell"] = []
+                elif tag == P:
+                    para = []
+                continue
+
+            if tag == T:
+                if el.text:
+                    para.append(el.text)
+            elif tag == TAB:
+                para.append("\t")
+            elif tag in (BR, CR):
+                para.append("\n")
+            elif tag == P:
+                txt = "".join(para).strip()
+                para = []
+                if tables:
+                    if txt:
+                        tables[-1]["cell"].append(txt)
+                elif txt:
+                    yield txt
+                el.clear()
+                if not tables and body is not None:
+                    body.clear()  # 释放已处理的顶层元素
+            elif tag == TC and tables:
+                span, vmerge = _docx_cell_layout(el)
+                text = " ".join(tables[-1]["cell"]).replace("\n", " ").strip()
+                tables[-1]["row"].append((text, span, vmerge))
+                tables[-1]["cell"] = []
+            elif tag == TR and tables:
+                t = tables[-1]
+                raw = t["row"]
+                t["row"] = []
+                before = _docx_grid_before(el)
+                el.clear()
+                if not any(txt for txt, _, vmerge in raw if vmerge != "continue"):
+                    continue
+                is_header = t["headers"] is None and t["n_rows"] == 0
+                cells, t["above"] = _expand_docx_row(raw, t["above"], before, is_header=is_header)
+                t["n_rows"] += 1
+                if is_header:
+                    t["headers"] = _normalize_headers(cells)
+                    t["header_line"] = " | ".join(txt for txt, _, _ in raw if txt)
+                    continue
+                line = _table_row_line(cells, t["headers"])
+                if len(tables) > 1:
+                    tables[-2]["cell"].append(line)
+                elif line:
+                    yield line
+            elif tag == TBL and tables:
+                t = tables.pop()
+                if t["n_rows"] == 1 and t.get("header_line"):
+                    # 只有一行的表格：首行不是表头，按普通行输出
+                    if tables:
+                        tables[-1]["cell"].append(t["header_line"])
+                    else:
+                        yield t["header_line"]
+                el.clear()
+                if not tables and body is not None:
+                    body.clear()
+
+
 def read_docx_file(path: str) -> str:
-    # 可选依赖：python-docx
+    """
+    DOCX -> 文本（段落 + 表格行，按文档顺序）。默认使用流式 XML 解析；
+    文件结构异常时回退到 python-docx（可选依赖，只取段落）。
+    """
+    try:
+        return "\n".join(iter_docx_blocks(path))
+    except Exception:
+        pass  # 非标准 zip / 缺少 word/document.xml / XML 解析错误
     from docx import Document  # type: ignore
     d = Document(path)
     return "\n".join([p.text for p in d.paragraphs if p.text and p.text.strip()])
@@ -136,116 +379,238 @@ def read_pdf_file(path: str) -> str:
     return "\n".join([t for t in pages if t.strip()])
 
 
-def read_xlsx_file(path: str) -> str:
+def _one_line(v: str) -> str:
+    return " ".join(str(v).split())
+
+
+def _open_text(path: str):
     """
-    读取 .xlsx/.xlsm/.xltx/.xltm 为“可检索文本”：
-    - 每个 Sheet：找到第一条非空行作为表头
-    - 后续每一行：输出为  表头:值  的键值对（用 \\t 分隔）
-    - 默认跳过全空行/全空值行
+    以 utf-8（含 BOM）打开文本；解码失败时按 gb18030 重新打开（国内导出的 CSV 常见）。
     """
     try:
-        from openpyxl import load_workbook  # type: ignore
-    except Exception as e:
-        raise ImportError("读取 XLSX 需要安装 openpyxl：pip install openpyxl") from e
+        with open(path, "r", encoding="utf-8-sig") as f:
+            f.read(1 << 16)
+        return open(path, "r", encoding="utf-8-sig", newline="")
+    except UnicodeDecodeError:
+        return open(path, "r", encoding="gb18030", errors="replace", newline="")
+
+
+def _note_truncated(stats: Optional[dict], path: str, *, rows: int, limit: int, setting: str) -> None:
+    """
+    记录表格读取被行数上限截断：写日志，并把截断信息填入调用方传入的 stats（供写入 manifest）。
+    """
+    _log.warning("%s: 已达 %s=%d，之后的行未读取", path, setting, limit)
+    if stats is not None:
+        stats["truncated"] = {"rows": rows, "limit": limit, "setting": setting}
 
-    import datetime as _dt
 
-    max_sheets = int(getattr(settings, "XLSX_MAX_SHEETS", 20))
-    max_rows = int(getattr(settings, "XLSX_MAX_ROWS_PER_SHEET", 5000))
+def iter_csv_rows(
+    path: str, *, batch_size: Optional[int] = None, stats: Optional[dict] = None
+) -> Iterator[List[str]]:
+    """
+    流式读取 CSV：首个非空行为表头，之后每行输出为  表头: 值  键值对（\t 分隔，与 XLSX 行格式一致），
+    按 batch_size 行一批产出（内存只与批大小有关）。分隔符由 csv.Sniffer 从文件开头推断。
+    超过 CSV_MAX_ROWS 的行不读取：记录日志，并在 stats["truncated"] 中注明。
+    """
+    import csv
+
+    bs = max(1, int(batch_size or getattr(settings, "TABLE_READ_BATCH", 1000)))
+    max_rows = int(getattr(settings, "CSV_MAX_ROWS", 50000))
     max_cols = int(getattr(settings, "XLSX_MAX_COLS_PER_SHEET", 50))
 
-    # 可选：是否把空值也输出为“表头:”
-    include_empty = bool(getattr(settings, "XLSX_INCLUDE_EMPTY_VALUES", False))
+    with _open_text(path) as f:
+        sample = f.read(1 << 16)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+        except csv.Error:
+            dialect = csv.excel
+        headers: Optional[List[str]] = None
+        batch: List[str] = []
+        n = 0
+        for row in csv.reader(f, dialect):
+            vals = [_one_line(v) for v in row[:max_cols]]
+            if not any(vals):
+                continue
+            if headers is None:
+                headers = _normalize_headers(vals)
+                continue
+            line = _table_row_line(vals, headers)
+            if not line:
+                continue
+            if n >= max_rows:
+                _note_truncated(stats, path, rows=n, limit=max_rows, setting="CSV_MAX_ROWS")
+                break
+            batch.append(line)
+            n += 1
+            if len(batch) >= bs:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def _iter_json_values(f, *, block: int = 1 << 20) -> Iterator[object]:
+    """
+    增量解码 JSON 流：支持 顶层数组 [...]、JSONL / 拼接的多个 JSON 值；不会一次性读入整个文件。
+    """
+    dec = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    in_array: Optional[bool] = None
+
+    def _more() -> bool:
+        nonlocal buf, pos, eof
+        chunk = f.read(block)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
 
-    def _cell_to_str(v) -> str:
-        if v is None:
-            return ""
-        if isinstance(v, (_dt.datetime, _dt.date)):
-            return v.isoformat()
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or (in_array and buf[pos] == ",")):
+            pos += 1
+        if pos >= len(buf):
+            if eof or not _more():
+                return
+            continue
+        if in_array is None:
+            in_array = buf[pos] == "["
+            if in_array:
+                pos += 1
+                continue
+        if in_array and buf[pos] == "]":
+            return
         try:
-            return str(v)
-        except Exception:
-            return ""
+            obj, end = dec.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof or not _more():
+                raise
+            continue
+        if end >= len(buf) and not eof:
+            # 值恰好止于缓冲区末尾（例如被截断的数字）：读入更多后重新解码
+            if _more():
+                continue
+        yield obj
+        pos = end
 
-    def _normalize_headers(raw_headers: List[str]) -> List[str]:
-        """
-        - 空表头 -> col_1/col_2...
-        - 重复表头 -> name_2/name_3...
-        """
-        headers: List[str] = []
-        seen: Dict[str, int] = {}
-        for i, h in enumerate(raw_headers):
-            h = (h or "").strip()
-            if not h:
-                h = f"col_{i+1}"
-            cnt = seen.get(h, 0) + 1
-            seen[h] = cnt
-            if cnt > 1:
-                h = f"{h}_{cnt}"
-            headers.append(h)
-        return headers
-
-    def _extract(data_only: bool) -> str:
-        wb = load_workbook(path, read_only=True, data_only=data_only)
-        lines: List[str] = []
-        sheetnames = list(wb.sheetnames)[:max_sheets]
-
-        for sname in sheetnames:
-            ws = wb[sname]
-            lines.append(f"# sheet: {sname}")
-
-            headers: Optional[List[str]] = None
-            data_rows_written = 0
-
-            for row in ws.iter_rows(values_only=True):
-                row = row[:max_cols] if row else []
-                row_vals = [_cell_to_str(v) for v in row]
-
-                # 跳过全空行
-                if not any(x.strip() for x in row_vals):
-                    continue
 
-                # 第一条非空行作为表头
-                if headers is None:
-                    headers = _normalize_headers(row_vals)
-                    continue
+def _flatten_record(obj: object, prefix: str = "") -> List[Tuple[str, str]]:
+    """
+    嵌套 dict 展开为 a.b 形式的键；标量列表用逗号连接；对象列表保留紧凑 JSON。
+    """
+    if isinstance(obj, dict):
+        out: List[Tuple[str, str]] = []
+        for k, v in obj.items():
+            out.extend(_flatten_record(v, f"{prefix}.{k}" if prefix else str(k)))
+        return out
+    if isinstance(obj, list):
+        if all(not isinstance(x, (dict, list)) for x in obj):
+            return [(prefix or "value", ", ".join("" if x is None else _one_line(x) for x in obj))]
+        return [(prefix or "value", json.dumps(obj, ensure_ascii=False, separators=(",", ":")))]
+    return [(prefix or "value", "" if obj is None else _one_line(obj))]
+
+
+def iter_json_records(
+    path: str, *, batch_size: Optional[int] = None, stats: Optional[dict] = None
+) -> Iterator[List[str]]:
+    """
+    流式读取 JSON / JSONL：每条记录输出为一行  键: 值  （\t 分隔），按 batch_size 条一批产出。
+    - 顶层数组 / JSONL：数组元素 / 每行一个记录
+    - 顶层为单个对象且含“对象列表”字段（如 {"data": [...]}）：展开该列表，每个元素一条记录；
+      对象中其余字段（如 source / year）作为首条“表头记录”保留
+    超过 JSON_MAX_RECORDS 的记录不读取：记录日志，并在 stats["truncated"] 中注明。
+    """
+    bs = max(1, int(batch_size or getattr(settings, "TABLE_READ_BATCH", 1000)))
+    max_records = int(getattr(settings, "JSON_MAX_RECORDS", 50000))
 
-                # 行数上限（只统计数据行，不统计表头）
-                if data_rows_written >= max_rows:
-                    lines.append("... [TRUNCATED: rows limit reached]")
-                    break
+    def _records(values: Iterator[object]) -> Iterator[object]:
+        first = next(values, None)
+        if first is None:
+            return
+        second = next(values, None)
+        if second is None and isinstance(first, dict):
+            lists = {k: v for k, v in first.items()
+                     if isinstance(v, list) and v and all(isinstance(x, dict) for x in v)}
+            if lists:
+                header = {k: v for k, v in first.items() if k not in lists}
+                if header:
+                    yield header
+                for lst in lists.values():
+                    yield from lst
+                return
+        yield first
+        if second is not None:
+            yield second
+            yield from values
+
+    with _open_text(path) as f:
+        batch: List[str] = []
+        n = 0
+        for rec in _records(_iter_json_values(f)):
+            pairs = [f"{k}: {v}" for k, v in _flatten_record(rec) if v]
+            if not pairs:
+                continue
+            if n >= max_records:
+                _note_truncated(stats, path, rows=n, limit=max_records, setting="JSON_MAX_RECORDS")
+                break
+            batch.append("\t".join(pairs))
+            n += 1
+            if len(batch) >= bs:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def read_csv_file(path: str) -> str:
+    """
+    CSV -> 按行文本（首行写入  # table: <文件名>，供 chunk_xlsx_rows 按行切分）。
+    """
+    lines = [f"# table: {os.path.basename(path)}"]
+    for batch in iter_csv_rows(path):
+        lines.extend(batch)
+    return "\n".join(lines) if len(lines) > 1 else ""
 
-                # 表头绑定到每个单元格
-                pairs: List[str] = []
-                non_empty_value_cnt = 0
-                for h, v in zip(headers, row_vals):
-                    v = (v or "").strip()
-                    if v:
-                        non_empty_value_cnt += 1
-                    if include_empty or v:
-                        pairs.append(f"{h}: {v}".rstrip())
-
-                # 默认：整行全空值则跳过
-                if not include_empty and non_empty_value_cnt == 0:
-                    continue
 
-                lines.append("\t".join(pairs))
-                data_rows_written += 1
+def read_json_file(path: str) -> str:
+    """
+    JSON / JSONL -> 按记录文本（格式同 read_csv_file）；无法解析时回退为纯文本（走滑窗切分）。
+    """
+    lines = [f"# table: {os.path.basename(path)}"]
+    try:
+        for batch in iter_json_records(path):
+            lines.extend(batch)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return read_txt_file(path)
+    return "\n".join(lines) if len(lines) > 1 else ""
+
 
-            lines.append("")  # sheet 分隔空行
+# 按批流式切分（不拼接整篇文本）的表格类扩展名
+STREAM_TABLE_EXTENSIONS = (".csv", ".json", ".jsonl")
 
-        try:
-            wb.close()
-        except Exception:
-            pass
 
-        return "\n".join(lines).strip()
+def iter_table_pieces(path: str, stats: dict) -> Iterator[Tuple[int, int, str]]:
+    """
+    CSV / JSON 按批读取并直接产出行 pieces（格式同 chunk_xlsx_rows），不拼接整篇文本。
+    迭代结束后 stats["sha256"] 为内容 hash（与 read_csv_file / read_json_file 文本的 sha256 一致），
+    截断时 stats["truncated"] 注明行数与上限。JSON 无法解析时抛出 JSONDecodeError，由调用方回退为纯文本。
+    """
+    name = os.path.basename(path)
+    ext = os.path.splitext(path)[1].lower()
+    batches = iter_csv_rows(path, stats=stats) if ext == ".csv" else iter_json_records(path, stats=stats)
+    hasher = hashlib.sha256(f"# table: {name}".encode("utf-8"))
+    row_no = 0
+    for batch in batches:
+        for line in batch:
+            hasher.update(("\n" + line).encode("utf-8"))
+            yield (row_no, row_no, f"table: {name}\t{line}")
+            row_no += 1
+    stats["sha256"] = hasher.hexdigest()
 
-    # 优先取“值”；若几乎读不到内容（例如只有公式但无缓存结果），再读“公式文本”
-    text = _extract(data_only=True)
-    if not text.strip():
-        text = _extract(data_only=False)
-    return text
 
 def load_document(path: str) -> Tuple[str, str, str]:
     """
@@ -255,8 +620,12 @@ def load_document(path: str) -> Tuple[str, str, str]:
     source_path = _norm_path(path)
     ext = os.path.splitext(path)[1].lower()
 
-    if ext in [".txt", ".md", ".log", ".csv", ".json"]:
+    if ext in [".txt", ".md", ".log"]:
         text = read_txt_file(path)
+    elif ext in [".csv"]:
+        text = read_csv_file(path)
+    elif ext in [".json", ".jsonl"]:
+        text = read_json_file(path)
     elif ext in [".docx"]:
         text = read_docx_file(path)
     elif ext in [".pdf"]:
@@ -303,11 +672,29 @@ def chunk_text(text: str, *, chunk_size: int, overlap: int) -> List[Tuple[int, i
     return chunks
 
 
+def chunk_text_hierarchical(
+    text: str, *, parent_size: int, child_size: int
+) -> Tuple[List[Tuple[int, int, str]], List[Tuple[int, int, str]], List[int]]:
+    """
+    父子两级切分（small-to-big）：先按 parent_size 无重叠切出父段，再在每个父段内按 child_size 无重叠切子块。
+    子块之间不需要 overlap —— 跨边界的上下文由父段提供。
+    返回 (parents, children, parent_idx)，children 偏移为全文偏移，parent_idx[i] 为 children[i] 所属父段下标。
+    """
+    parents = chunk_text(text, chunk_size=parent_size, overlap=0)
+    children: List[Tuple[int, int, str]] = []
+    parent_idx: List[int] = []
+    for pi, (ps, _, ptxt) in enumerate(parents):
+        for cs, ce, ctxt in chunk_text(ptxt, chunk_size=child_size, overlap=0):
+            children.append((ps + cs, ps + ce, ctxt))
+            parent_idx.append(pi)
+    return parents, children, parent_idx
+
+
 def chunk_xlsx_rows(text: str) -> List[Tuple[int, int, str]]:
     """
-    将 read_xlsx_file 生成的文本按“行”切分为 chunks（每行一个向量）。
+    将 read_xlsx_file / read_csv_file / read_json_file 生成的文本按“行”切分为 chunks（每行一个向量）。
     约定：
-    - read_xlsx_file 会在每个 sheet 前写入一行：# sheet: <name>
+    - read_xlsx_file 会在每个 sheet 前写入一行：# sheet: <name>；CSV/JSON 在开头写入：# table: <文件名>
     - 数据行本身是“表头:值\t表头:值...”的键值对形式
     返回：
     - start/end 使用“行号”（从 0 开始）表示，便于追踪；不再代表字符偏移
@@ -318,6 +705,7 @@ def chunk_xlsx_rows(text: str) -> List[Tuple[int, int, str]]:
 
     pieces: List[Tuple[int, int, str]] = []
     current_sheet = ""
+    label = "sheet"
     row_no = 0
 
     for raw in text.splitlines():
@@ -327,11 +715,16 @@ def chunk_xlsx_rows(text: str) -> List[Tuple[int, int, str]]:
 
         if line.startswith("# sheet:"):
             current_sheet = line[len("# sheet:"):].strip()
+            label = "sheet"
+            continue
+        if line.startswith("# table:"):
+            current_sheet = line[len("# table:"):].strip()
+            label = "table"
             continue
 
-        # 给每行补充 sheet 上下文，避免跨 sheet 检索时丢失来源
+        # 给每行补充 sheet/表名 上下文，避免跨 sheet 检索时丢失来源
         if current_sheet:
-            line_out = f"sheet: {current_sheet}\t{line}"
+            line_out = f"{label}: {current_sheet}\t{line}"
         else:
             line_out = line
 
@@ -351,20 +744,48 @@ def _normalize_rows(x: np.ndarray) -> np.ndarray:
     return x / norms
 
 
+def embed_query_vector(query: str) -> np.ndarray:
+    """
+    查询向量化并归一化，返回 [1, dim]。
+    """
+    q = np.array([embed_query(query)], dtype=np.float32)
+    if q.ndim != 2:
+        raise ValueError("embed_query must return a 1D array-like [dim]")
+    return _normalize_rows(q)
+
+
 # -----------------------------
 # Faiss RAG store (persistent)
 # -----------------------------
+# sync_dir 默认纳入的文件类型（与 load_document 支持的格式一致）
+SYNC_EXTENSIONS = (".txt", ".md", ".log", ".csv", ".json", ".jsonl", ".docx", ".pdf", ".xlsx", ".xlsm", ".xltx", ".xltm")
+# 按“行/记录”切分（每行一个向量）的表格类扩展名
+ROW_EXTENSIONS = (".xlsx", ".xlsm", ".xltx", ".xltm", ".csv", ".json", ".jsonl")
+
+
 class FaissRAG:
     """
     一个可持久化、可增删的轻量 RAG 底座：
     - 使用 IndexIDMap2 + IndexFlatIP（cosine via normalized vectors）
+    - 可选父子切分（parent_chunk_size>0）：只对小子块向量化，命中后按 parent_id O(1) 取回父段作为证据
+    - 可选 PCA 降维（pca_dim>0）：内存中的 faiss 索引只存降维向量做第一阶段检索，
+      全精度向量放在 mmap 侧文件（full_vectors.npy）里，仅对候选读取并精排
     - 支持 save/load
     - 支持 add_files / remove_doc
+    - 并发写：save 持 store_dir 写锁提交；manifest.generation 做乐观版本校验，
+      若 load 之后库已被其他写者更新，则把本实例的增删“重放”到最新库上再提交（合并而非覆盖）
+    - 快照布局：每次提交写入不可变目录 snapshots/<generation>/，再原子替换 CURRENT 指针；
+      读者钉住（pin）一个快照读取，永远看不到“半替换”的库；旧快照无人引用后回收
     """
 
     INDEX_FNAME = "index.faiss"
     CHUNKS_FNAME = "chunks.jsonl"
+    PARENTS_FNAME = "parents.jsonl"
+    PCA_FNAME = "pca.vt"
+    FULL_VECTORS_FNAME = "full_vectors.npy"
+    FULL_IDS_FNAME = "full_vector_ids.npy"
     MANIFEST_FNAME = "manifest.json"
+    PACK_FNAME = "store.pack"  # 单文件打包快照（rag_store_manager import，见 rag/packed_store.py）
 
     def __init__(
         self,
@@ -372,19 +793,48 @@ class FaissRAG:
         dim: Optional[int] = None,
         chunk_size: Optional[int] = None,
         overlap: Optional[int] = None,
+        parent_chunk_size: Optional[int] = None,
+        pca_dim: Optional[int] = None,
     ) -> None:
         self.dim: Optional[int] = dim
         self.chunk_size = int(chunk_size if chunk_size is not None else getattr(
             settings, "CHUNK_SIZE", 900))
         self.overlap = int(overlap if overlap is not None else getattr(settings, "CHUNK_OVERLAP", 150))
+        # >0 启用父子切分：子块长度为 chunk_size（无重叠），父段长度为 parent_chunk_size
+        self.parent_chunk_size = int(parent_chunk_size if parent_chunk_size is not None else getattr(
+            settings, "PARENT_CHUNK_SIZE", 0))
+        # >0 启用 PCA 降维检索（向量数达到 RAG_PCA_MIN_TRAIN 后在 save 时训练）
+        self.pca_dim = int(pca_dim if pca_dim is not None else getattr(settings, "RAG_PCA_DIM", 0))
 
-        # faiss index: created lazily when dim is known
+        # faiss index: created lazily when dim is known（PCA 模式下为降维后的索引）
         self.index: Optional[faiss.Index] = None
+        self.pca: Optional[PCAProjector] = None
+        self.full_vectors: Optional[FullVectorStore] = None
 
         # metadata
         self.chunks_by_vid: Dict[int, Chunk] = {}
         self.docs: Dict[str, dict] = {}  # doc_id -> manifest entry
         self.next_vector_id: int = 1
+        self.parents_by_id: Dict[int, ParentChunk] = {}
+        self.next_parent_id: int = 1
+
+        # 并发写：load 时的 manifest 代数 + 本实例自 load 以来的增删记录（用于冲突合并）
+        self.base_generation: int = 0
+        self._added_doc_ids: List[str] = []
+        self._removed_doc_ids: List[str] = []
+
+        # 读取来源快照名（旧版平铺布局 / 新建实例为 None）
+        self.snapshot: Optional[str] = None
+        # 仍 mmap 快照内文件（PCA 全精度侧文件 / 打包库）时长期持有的 pin，close() 或实例回收时释放
+        self._snapshot_pin: Optional[SnapshotPin] = None
+        self._pin_finalizer: Optional[weakref.finalize] = None
+
+        # 检查点入库进度（随 manifest 持久化；None 表示没有未完成的入库任务）
+        self.ingest_job: Optional[dict] = None
+
+        # 目录同步文件表：abs path -> {size, mtime_ns, sha256, doc_id}（随 manifest 持久化）
+        self.file_table: Dict[str, dict] = {}
+        self._file_table_changes: Dict[str, Optional[dict]] = {}
 
     # --------- state ----------
     def is_empty(self) -> bool:
@@ -397,71 +847,334 @@ class FaissRAG:
         self.index = faiss.IndexIDMap2(base)
         self.dim = dim
 
+    def _index_add(self, vecs: np.ndarray, vids: np.ndarray) -> None:
+        assert self.index is not None
+        if self.pca is not None:
+            assert self.full_vectors is not None
+            self.full_vectors.add(vids.tolist(), vecs)
+            self.index.add_with_ids(self.pca.project_docs(vecs), vids)
+        else:
+            self.index.add_with_ids(vecs, vids)
+
+    def _vectors_for(self, vids: List[int]) -> np.ndarray:
+        """
+        取全精度向量（PCA 模式从侧文件读取，否则从 faiss 索引 reconstruct）。
+        """
+        if self.pca is not None:
+            assert self.full_vectors is not None
+            return self.full_vectors.get(vids)
+        assert self.index is not None
+        return np.vstack([self.index.reconstruct(int(v)) for v in vids]).astype(np.float32)
+
+    def all_vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        全部 (ids, 全精度 vectors)，按 vector_id 升序。
+        """
+        if self.pca is not None:
+            assert self.full_vectors is not None
+            ids = self.full_vectors.all_ids()
+            return ids, self.full_vectors.get(ids.tolist())
+        if self.index is None or self.index.ntotal == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, int(self.dim or 0)), dtype=np.float32)
+        idmap = faiss.downcast_index(self.index)
+        ids = faiss.vector_to_array(idmap.id_map).astype(np.int64)
+        vecs = faiss.downcast_index(idmap.index).reconstruct_n(0, int(self.index.ntotal)).astype(np.float32)
+        order = np.argsort(ids, kind="stable")
+        return ids[order], np.ascontiguousarray(vecs[order])
+
+    def build_pca(self, *, force: bool = False) -> bool:
+        """
+        训练 PCA 并把索引切换为降维索引（全精度向量转入侧存储）。
+        未启用 pca_dim、向量数不足 RAG_PCA_MIN_TRAIN 或已训练（且未 force）时不做任何事，返回是否发生了切换。
+        训练后新增的向量沿用同一投影；数据分布明显变化后可 force=True 重新训练。
+        """
+        if self.pca_dim <= 0 or self.index is None or not self.dim or self.pca_dim >= int(self.dim):
+            return False
+        if self.pca is not None and not force:
+            return False
+        min_train = max(self.pca_dim, int(getattr(settings, "RAG_PCA_MIN_TRAIN", 4096)))
+        if int(self.index.ntotal) < min_train:
+            return False
+
+        ids, vecs = self.all_vectors()
+        proj = PCAProjector.train(vecs, self.pca_dim)
+        if self.full_vectors is None:
+            self.full_vectors = FullVectorStore(int(self.dim))
+            self.full_vectors.add(ids.tolist(), vecs)
+        index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.pca_dim))
+        index.add_with_ids(proj.project_docs(vecs), ids)
+        self.pca = proj
+        self.index = index
+        return True
+
     # --------- persistence ----------
     @classmethod
     def store_paths(cls, store_dir: str) -> Dict[str, str]:
+        """
+        index/chunks/manifest 为旧版平铺布局（或某个快照目录内）的文件路径；
+        current/snapshots 为快照布局的指针文件与快照根目录。
+        """
         d = os.path.abspath(store_dir)
         return {
             "store_dir": d,
             "index": os.path.join(d, cls.INDEX_FNAME),
             "chunks": os.path.join(d, cls.CHUNKS_FNAME),
+            "parents": os.path.join(d, cls.PARENTS_FNAME),
+            "pca": os.path.join(d, cls.PCA_FNAME),
+            "full_vectors": os.path.join(d, cls.FULL_VECTORS_FNAME),
+            "full_ids": os.path.join(d, cls.FULL_IDS_FNAME),
             "manifest": os.path.join(d, cls.MANIFEST_FNAME),
+            "current": os.path.join(d, CURRENT_FNAME),
+            "snapshots": os.path.join(d, SNAPSHOTS_DIRNAME),
         }
 
+    @classmethod
+    def committed_generation(cls, store_dir: str) -> int:
+        """
+        store_dir 已提交的代数：优先取 CURRENT 快照名；旧版平铺布局取 manifest.generation；空库为 0。
+        """
+        g = current_generation(store_dir)
+        if g is not None:
+            return g
+        return _read_manifest_generation(cls.store_paths(store_dir)["manifest"])
+
+    @classmethod
+    def committed_token(cls, store_dir: str) -> str:
+        """
+        store_dir 当前提交的唯一标识（不会重复出现），用于判断缓存的已加载实例是否过期：
+        快照布局取 current_token；旧版平铺布局取 manifest 代数 + mtime；空库为 ""。
+        """
+        t = current_token(store_dir)
+        if t is not None:
+            return t
+        mp = cls.store_paths(store_dir)["manifest"]
+        try:
+            return f"flat:{_read_manifest_generation(mp)}@{os.stat(mp).st_mtime_ns}"
+        except OSError:
+            return ""
+
+    @classmethod
+    def clear_store(cls, store_dir: str) -> int:
+        """
+        持写锁清空整个库：以 代数+1 发布一个空快照（代数只增不减，load 于清空之前的写者提交时会走 rebase，
+        不会把清空前的文档写回或覆盖清空后的提交），再删除旧版平铺文件并回收无人引用的旧快照。
+        返回删除的文件/快照数（仍被读者钉住的旧快照留待之后的提交回收）。
+        """
+        p = cls.store_paths(store_dir)
+        os.makedirs(p["store_dir"], exist_ok=True)
+        removed = 0
+        with StoreLock(p["store_dir"]):
+            current = cls.committed_generation(store_dir)
+            staged = staging_dir(store_dir, current + 1)
+            try:
+                cls(dim=None)._write_store(cls.store_paths(staged), generation=current + 1)
+            except Exception:
+                shutil.rmtree(staged, ignore_errors=True)
+                raise
+            publish_snapshot(store_dir, staged, current + 1)
+            for k in ["index", "chunks", "parents", "manifest"]:
+                if os.path.exists(p[k]):
+                    os.remove(p[k])
+                    removed += 1
+            removed += len(gc_snapshots(store_dir, keep=1))
+        return removed
+
     def save(self, store_dir: str) -> None:
+        """
+        持写锁提交到 store_dir：
+        - 若已提交代数与 load 时一致：直接提交
+        - 否则说明期间有其他写者提交：先加载最新库并重放本实例的增删，再提交（不会丢失他人文档）
+        提交 = 写入新的 staging 快照目录 → 改名发布 → 原子替换 CURRENT → 回收旧快照；
+        任一步失败都不影响已发布的快照。
+        """
         p = self.store_paths(store_dir)
         os.makedirs(p["store_dir"], exist_ok=True)
 
-        # 统一使用 tmp 文件，确保写入全成功后再“提交”
-        index_final = p["index"]
-        chunks_final = p["chunks"]
-        manifest_final = p["manifest"]
+        with StoreLock(p["store_dir"]):
+            current = self.committed_generation(store_dir)
+            if current != self.base_generation:
+                self._rebase_onto(type(self).load(store_dir))
+            self.build_pca()
+
+            staged = staging_dir(store_dir, current + 1)
+            try:
+                self._write_store(self.store_paths(staged), generation=current + 1)
+            except Exception:
+                shutil.rmtree(staged, ignore_errors=True)
+                raise
+            publish_snapshot(store_dir, staged, current + 1)
+
+            # 旧版平铺布局在首次快照提交后即失效，删除避免混淆
+            for k in ["index", "chunks", "manifest"]:
+                if os.path.exists(p[k]):
+                    os.remove(p[k])
+            gc_snapshots(store_dir)
+
+        self.base_generation = current + 1
+        self._added_doc_ids = []
+        self._removed_doc_ids = []
+        self._file_table_changes = {}
+
+    @classmethod
+    @contextmanager
+    def write_session(cls, store_dir: str) -> Iterator["FaissRAG"]:
+        """
+        串行写会话：持锁期间 load → 修改 → save，多个写者排队执行（读者不受影响）。
+            with FaissRAG.write_session(d) as rag:
+                rag.add_files(paths)
+        """
+        with StoreLock(store_dir):
+            rag = cls.load(store_dir)
+            yield rag
+            rag.save(store_dir)
+
+    def _rebase_onto(self, latest: "FaissRAG") -> None:
+        """
+        把本实例自 load 以来的增删重放到 latest 上，并以合并结果替换本实例状态。
+        新增文档的向量直接从本实例 index 中 reconstruct，无需重新 embedding。
+        """
+        for did in self._removed_doc_ids:
+            latest.remove_doc(doc_id=did)
+
+        for did in self._added_doc_ids:
+            entry = self.docs.get(did)
+            if entry is None or did in latest.docs:
+                continue
+            vids = [int(v) for v in entry.get("vector_ids", [])]
+            if not vids or self.index is None:
+                continue
+            vecs = self._vectors_for(vids)
+            chunks = [self.chunks_by_vid[v] for v in vids]
+            pids = [int(x) for x in entry.get("parent_ids", [])]
+            pos = {pid: i for i, pid in enumerate(pids)}
+            parents = [self.parents_by_id[pid] for pid in pids]
+            latest._insert_doc(
+                doc_id=did,
+                source_path=entry.get("source_path", ""),
+                sha256=entry.get("sha256", ""),
+                pieces=[(c.start, c.end, c.text) for c in chunks],
+                chunk_ids=[c.chunk_id for c in chunks],
+                vecs=vecs,
+                created_at=entry.get("created_at"),
+                parents=[(pc.start, pc.end, pc.text) for pc in parents],
+                parent_idx=[pos[c.parent_id] for c in chunks] if pids else None,
+                meta={k: entry[k] for k in ("truncated",) if k in entry},
+            )
 
-        index_tmp = index_final + ".tmp"
-        chunks_tmp = chunks_final + ".tmp"
-        manifest_tmp = manifest_final + ".tmp"
+        for path, fentry in self._file_table_changes.items():
+            if fentry is None:
+                latest.file_table.pop(path, None)
+            else:
+                latest.file_table[path] = fentry
+
+        self.dim = latest.dim
+        self.file_table = latest.file_table
+        self.index = latest.index
+        self.pca = latest.pca
+        self.full_vectors = latest.full_vectors
+        self.chunks_by_vid = latest.chunks_by_vid
+        self.docs = latest.docs
+        self.next_vector_id = latest.next_vector_id
+        self.parents_by_id = latest.parents_by_id
+        self.next_parent_id = latest.next_parent_id
+        # 接管 latest 的 mmap 后也接管它的快照 pin
+        if latest._pin_finalizer is not None:
+            pin = latest._snapshot_pin
+            latest._pin_finalizer.detach()
+            latest._snapshot_pin = latest._pin_finalizer = None
+            self._hold_pin(pin)
+        else:
+            self._hold_pin(None)
 
-        # 先准备 manifest（但先不落最终文件）
+    def _write_store(self, p: Dict[str, str], *, generation: int) -> None:
+        """
+        把完整状态写入 p 指向的目录（staging 快照目录，发布前对读者不可见，因此直接写最终文件名）。
+        """
         manifest = {
             "version": 1,
+            "generation": int(generation),
             "saved_at": _now_iso(),
             "dim": self.dim,
             "metric": "cosine_ip",
             "chunk_size": self.chunk_size,
             "overlap": self.overlap,
+            "parent_chunk_size": self.parent_chunk_size,
+            "pca_dim": self.pca_dim,
+            "pca_trained": self.pca is not None,
             "next_vector_id": self.next_vector_id,
+            "next_parent_id": self.next_parent_id,
             "docs": self.docs,
             "ntotal": int(self.index.ntotal) if self.index is not None else 0,
+            "ingest_job": self.ingest_job,
+            "files": self.file_table,
         }
 
-        # 1) 写 tmp index（最容易失败的步骤先做；失败就直接抛异常，不污染已有库）
+        # 1) index（最容易失败的步骤先做；空库不需要 index 文件）
         if self.index is not None and getattr(self.index, "ntotal", 0) > 0:
-            safe_index_tmp = _faiss_safe_path(index_tmp)
-            faiss.write_index(self.index, safe_index_tmp)
-        else:
-            # 空库：不需要 index 文件
-            if os.path.exists(index_tmp):
-                os.remove(index_tmp)
+            faiss.write_index(self.index, _faiss_safe_path(p["index"]))
+        if self.pca is not None and self.full_vectors is not None:
+            self.pca.save(_faiss_safe_path(p["pca"]))
+            self.full_vectors.write(p["full_ids"], p["full_vectors"])
 
-        # 2) 写 tmp chunks / tmp manifest（Python 对 Unicode 路径没问题）
-        _write_jsonl_chunks(chunks_tmp, self.chunks_by_vid)
-        _write_json_file(manifest_tmp, manifest)
+        # 2) chunks / manifest（Python 对 Unicode 路径没问题）
+        _write_jsonl_chunks(p["chunks"], self.chunks_by_vid)
+        if self.parents_by_id:
+            _write_jsonl_parents(p["parents"], self.parents_by_id)
+        _write_json_file(p["manifest"], manifest)
 
-        # 3) 提交（原子替换）
-        # 3.1 index
-        if self.index is not None and getattr(self.index, "ntotal", 0) > 0:
-            os.replace(index_tmp, index_final)
-        else:
-            if os.path.exists(index_final):
-                os.remove(index_final)
+    @classmethod
+    def load(cls, store_dir: str) -> "FaissRAG":
+        """
+        读取 CURRENT 指向的快照（读取期间钉住该快照，写者并发提交/回收不影响本次读取）；
+        无快照时按旧版平铺布局读取。读者从不加写锁。
+        """
+        with SnapshotPin(store_dir) as pin:
+            if pin.path is not None:
+                rag = cls._load_dir(pin.path)
+                rag.snapshot = pin.name
+                # 导入的打包快照内记录的是源库代数，以快照名为准
+                rag.base_generation = int(pin.name)
+                if rag._holds_snapshot_mmaps():
+                    # mmap 的文件仍在该快照目录内：pin 随实例存活，避免被 gc_snapshots 删除（Windows 下删除会失败、留下残缺快照）
+                    pin.hold()
+                    rag._hold_pin(pin)
+                return rag
+
+        rag = cls._load_dir(store_dir)
+        if rag.base_generation == 0 and not rag.docs and current_snapshot(store_dir) is not None:
+            # 恰好遇到旧版布局迁移为首个快照：改读快照
+            return cls.load(store_dir)
+        return rag
 
-        # 3.2 chunks / manifest
-        os.replace(chunks_tmp, chunks_final)
-        os.replace(manifest_tmp, manifest_final)
+    def _holds_snapshot_mmaps(self) -> bool:
+        return self.full_vectors is not None or not isinstance(self.chunks_by_vid, dict)
+
+    def _hold_pin(self, pin: Optional[SnapshotPin]) -> None:
+        if self._pin_finalizer is not None:
+            self._pin_finalizer()
+        self._snapshot_pin = pin
+        self._pin_finalizer = weakref.finalize(self, pin.release) if pin is not None else None
+
+    def close(self) -> None:
+        """
+        释放长期持有的快照 pin 并丢弃 mmap 引用；之后本实例不可再用于检索。
+        注意 get_store 返回的是注册表共享实例，不要对其调用 close。
+        """
+        self.full_vectors = None
+        self.pca = None
+        self.index = None
+        self.chunks_by_vid = {}
+        self.parents_by_id = {}
+        self._hold_pin(None)
 
     @classmethod
-    def load(cls, store_dir: str) -> "FaissRAG":
-        p = cls.store_paths(store_dir)
+    def _load_dir(cls, d: str) -> "FaissRAG":
+        pack = os.path.join(d, cls.PACK_FNAME)
+        if os.path.exists(pack):
+            from rag.packed_store import load_packed  # noqa
+            return load_packed(pack, cls)
+
+        p = cls.store_paths(d)
         rag = cls(dim=None)
 
         # no manifest => treat as empty store
@@ -474,8 +1187,14 @@ class FaissRAG:
         rag.dim = m.get("dim")
         rag.chunk_size = int(m.get("chunk_size", rag.chunk_size))
         rag.overlap = int(m.get("overlap", rag.overlap))
+        rag.parent_chunk_size = int(m.get("parent_chunk_size", rag.parent_chunk_size))
+        rag.pca_dim = int(m.get("pca_dim", rag.pca_dim))
         rag.next_vector_id = int(m.get("next_vector_id", 1))
+        rag.next_parent_id = int(m.get("next_parent_id", 1))
         rag.docs = dict(m.get("docs", {}))
+        rag.base_generation = int(m.get("generation", 0))
+        rag.ingest_job = m.get("ingest_job") or None
+        rag.file_table = dict(m.get("files") or {})
 
         # load chunks
         rag.chunks_by_vid = {}
@@ -489,15 +1208,31 @@ class FaissRAG:
                     c = Chunk(**obj)
                     rag.chunks_by_vid[c.vector_id] = c
 
+        # load parents（仅父子切分的库存在）
+        rag.parents_by_id = {}
+        if os.path.exists(p["parents"]):
+            with open(p["parents"], "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    pc = ParentChunk(**json.loads(line))
+                    rag.parents_by_id[pc.parent_id] = pc
+
         # load index (optional)
         if os.path.exists(p["index"]):
             rag.index = faiss.read_index(_faiss_safe_path(p["index"]))
+            if m.get("pca_trained") and os.path.exists(p["pca"]):
+                # 降维索引 + 全精度侧文件（mmap，只读，按需分页）
+                rag.pca = PCAProjector.load(_faiss_safe_path(p["pca"]))
+                rag.full_vectors = FullVectorStore.open(p["full_ids"], p["full_vectors"])
         else:
             # 若 index 不存在，说明库不可检索（通常是写入失败导致的不一致状态）
             # 为避免出现“docs 有但 empty=True”的假象，这里把元信息也视为无效
             rag.index = None
             rag.docs = {}
             rag.chunks_by_vid = {}
+            rag.parents_by_id = {}
             rag.next_vector_id = 1
             return rag
 
@@ -512,69 +1247,339 @@ class FaissRAG:
         arr = _normalize_rows(arr)
         return arr
 
-    def add_files(self, file_paths: Iterable[str]) -> Dict[str, dict]:
+    def add_files(
+        self,
+        file_paths: Iterable[str],
+        *,
+        store_dir: Optional[str] = None,
+        checkpoint_docs: Optional[int] = None,
+        checkpoint_chunks: Optional[int] = None,
+    ) -> Dict[str, dict]:
         """
         增量入库：返回新增 doc_id -> entry
         说明：同一 doc_id（内容相同）默认跳过；如要强制重建，请先 remove_doc。
+
+        传入 store_dir 时启用检查点：每新增 checkpoint_docs 篇文档或 checkpoint_chunks 个切片就提交一次 save，
+        并在 manifest.ingest_job 中记录进度；中途失败时已提交的 embedding 不会丢失，
+        之后可用 pending_ingest_paths() 取出剩余文件继续入库。全部完成后自动提交并清除进度。
         """
+        paths = [_norm_path(p) for p in file_paths]
         added: Dict[str, dict] = {}
-        for path in file_paths:
-            doc_id, source_path, text = load_document(path)
-            if not text:
-                continue
 
-            # Skip if already present (same content hash)
-            if doc_id in self.docs:
+        if store_dir is None:
+            for path in paths:
+                _, entry = self._ingest_path(path)
+                if entry is not None:
+                    added[entry["doc_id"]] = entry
+            return added
+
+        every_docs = max(1, int(checkpoint_docs or getattr(settings, "INGEST_CHECKPOINT_DOCS", 20)))
+        every_chunks = max(1, int(checkpoint_chunks or getattr(settings, "INGEST_CHECKPOINT_CHUNKS", 2000)))
+        self.ingest_job = {
+            "paths": paths,
+            "next": 0,
+            "started_at": _now_iso(),
+            "updated_at": _now_iso(),
+        }
+
+        pending_docs = 0
+        pending_chunks = 0
+        for i, path in enumerate(paths):
+            _, entry = self._ingest_path(path)
+            if entry is not None:
+                added[entry["doc_id"]] = entry
+                pending_docs += 1
+                pending_chunks += int(entry["n_chunks"])
+
+            if pending_docs >= every_docs or pending_chunks >= every_chunks:
+                self.ingest_job["next"] = i + 1
+                self.ingest_job["updated_at"] = _now_iso()
+                self.save(store_dir)
+                pending_docs = 0
+                pending_chunks = 0
+
+        self.ingest_job = None
+        self.save(store_dir)
+        return added
+
+    def pending_ingest_paths(self) -> List[str]:
+        """
+        返回上次检查点入库中尚未提交的文件路径（无未完成任务时返回空列表）。
+        """
+        job = self.ingest_job or {}
+        paths = list(job.get("paths") or [])
+        return paths[int(job.get("next", 0)):]
+
+    def _ingest_path(self, path: str) -> Tuple[Optional[str], Optional[dict]]:
+        """
+        读取 + 切分 + 向量化单个文件并写入索引，返回 (doc_id, 新增 entry)。
+        空文件返回 (None, None)；已存在（同内容 hash）时返回 (doc_id, None)。
+        """
+        doc_id, prepared = self._prepare_doc(path)
+        if prepared is None:
+            return doc_id, None
+
+        # Embed first to infer dim if needed
+        vecs = self._embed_chunks([t for (_, _, t) in prepared.pieces])
+        return doc_id, self._insert_prepared(prepared, vecs)
+
+    def _prepare_doc(
+        self, path: str, *, skip_existing: bool = True
+    ) -> Tuple[Optional[str], Optional[PreparedDoc]]:
+        """
+        读取 + 切分（不调用 embedding）。返回 (doc_id, PreparedDoc)；
+        空文件返回 (None, None)；已存在（同内容 hash）时返回 (doc_id, None)。
+        skip_existing=False 时不读取 self.docs（供其它线程并发解析，去重由写入方负责）。
+        """
+        if os.path.splitext(path)[1].lower() in STREAM_TABLE_EXTENSIONS:
+            stats: dict = {}
+            try:
+                pieces = list(iter_table_pieces(path, stats))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                pieces = None  # 不是合法 JSON：下面按纯文本滑窗切分
+            if pieces is not None:
+                return self._prepare_rows(path, pieces, stats, skip_existing=skip_existing)
+
+        doc_id, source_path, text = load_document(path)
+        if not text:
+            return None, None
+
+        # Skip if already present (same content hash)
+        if skip_existing and doc_id in self.docs:
+            return doc_id, None
+        ext = os.path.splitext(source_path)[1].lower()
+        parents: List[Tuple[int, int, str]] = []
+        parent_idx: List[int] = []
+        row_mode = ext in [".xlsx", ".xlsm", ".xltx", ".xltm"] or (
+            ext in ROW_EXTENSIONS and text.startswith("# table:"))
+        if row_mode:
+            # Excel / CSV / JSON：逐行（逐记录）向量化，每行带表头，不使用滑窗 overlap
+            pieces = chunk_xlsx_rows(text)
+        elif self.parent_chunk_size > 0:
+            parents, pieces, parent_idx = chunk_text_hierarchical(
+                text, parent_size=self.parent_chunk_size, child_size=self.chunk_size)
+        else:
+            pieces = chunk_text(text, chunk_size=self.chunk_size, overlap=self.overlap)
+        if not pieces:
+            return None, None
+
+        kind = "row" if row_mode else "chunk"
+        return doc_id, PreparedDoc(
+            doc_id=doc_id,
+            source_path=source_path,
+            sha256=_sha256_text(text),
+            pieces=pieces,
+            chunk_ids=[f"{doc_id}::{kind}_{i:06d}" for i in range(len(pieces))],
+            parents=parents,
+            parent_idx=parent_idx,
+        )
+
+    def _prepare_rows(
+        self, path: str, pieces: List[Tuple[int, int, str]], stats: dict, *, skip_existing: bool = True
+    ) -> Tuple[Optional[str], Optional[PreparedDoc]]:
+        """
+        CSV / JSON 流式切分结果 -> PreparedDoc；doc_id 与 load_document 对同一文件的结果一致。
+        """
+        if not pieces:
+            return None, None
+        sha256 = stats["sha256"]
+        doc_id = sha256[:16]
+        if skip_existing and doc_id in self.docs:
+            return doc_id, None
+        meta = {"truncated": stats["truncated"]} if stats.get("truncated") else {}
+        return doc_id, PreparedDoc(
+            doc_id=doc_id,
+            source_path=_norm_path(path),
+            sha256=sha256,
+            pieces=pieces,
+            chunk_ids=[f"{doc_id}::row_{i:06d}" for i in range(len(pieces))],
+            meta=meta,
+        )
+
+    def _insert_prepared(self, prepared: PreparedDoc, vecs: np.ndarray) -> dict:
+        return self._insert_doc(
+            doc_id=prepared.doc_id,
+            source_path=prepared.source_path,
+            sha256=prepared.sha256,
+            pieces=prepared.pieces,
+            chunk_ids=prepared.chunk_ids,
+            vecs=vecs,
+            parents=prepared.parents,
+            parent_idx=prepared.parent_idx,
+            meta=prepared.meta,
+        )
+
+    # --------- directory sync ----------
+    def sync_dir(
+        self,
+        root: str,
+        *,
+        store_dir: Optional[str] = None,
+        extensions: Optional[Iterable[str]] = None,
+        checkpoint_docs: Optional[int] = None,
+    ) -> Dict[str, List[str]]:
+        """
+        把目录树增量镜像到知识库：
+        - 扫描 root 下的文件（只做 os.stat），与持久化文件表 (path, size, mtime, sha256) 比对
+        - 仅对 size/mtime 变化的文件计算 hash；hash 也变化的才重新解析 + embedding
+        - root 下已删除的文件：移除其文档
+        解析/embedding 的开销只与变化量成正比（未变化文件仅一次 stat）。
+        传入 store_dir 时每新增 checkpoint_docs 篇文档提交一次，并在结束时提交；
+        文件表随提交一起落盘，中途失败后重新 sync 即可从断点继续。
+        返回 {"added": [...], "updated": [...], "removed": [...], "unchanged": [...]}（均为路径）。
+        """
+        root = _norm_path(root)
+        if not os.path.isdir(root):
+            raise ValueError(f"sync 目录不存在：{root}")
+        exts = {e.lower() for e in (extensions or getattr(settings, "SYNC_EXTENSIONS", SYNC_EXTENSIONS))}
+        store_files = {
+            self.INDEX_FNAME, self.CHUNKS_FNAME, self.PARENTS_FNAME, self.MANIFEST_FNAME,
+            self.PCA_FNAME, self.FULL_VECTORS_FNAME, self.FULL_IDS_FNAME,
+        }
+
+        # 1) 扫描：只 stat
+        seen: Dict[str, Tuple[int, int]] = {}
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for fn in filenames:
+                if fn.startswith(".") or fn in store_files or os.path.splitext(fn)[1].lower() not in exts:
+                    continue
+                fp = _norm_path(os.path.join(dirpath, fn))
+                try:
+                    st = os.stat(fp)
+                except OSError:
+                    continue
+                seen[fp] = (int(st.st_size), int(st.st_mtime_ns))
+
+        prefix = root if root.endswith(os.sep) else root + os.sep
+        report: Dict[str, List[str]] = {"added": [], "updated": [], "removed": [], "unchanged": []}
+
+        # 2) 已删除文件
+        for fp in [p for p in self.file_table if p.startswith(prefix) and p not in seen]:
+            self._drop_file_entry(fp)
+            report["removed"].append(fp)
+
+        # 3) 新增/变化文件
+        every_docs = max(1, int(checkpoint_docs or getattr(settings, "INGEST_CHECKPOINT_DOCS", 20)))
+        pending = 0
+        for fp in sorted(seen):
+            size, mtime_ns = seen[fp]
+            old = self.file_table.get(fp)
+            if (
+                old is not None
+                and old.get("size") == size
+                and old.get("mtime_ns") == mtime_ns
+                and (not old.get("doc_id") or old["doc_id"] in self.docs)  # 文档未被手动 remove
+            ):
+                report["unchanged"].append(fp)
                 continue
-            ext = os.path.splitext(source_path)[1].lower()
-            if ext in [".xlsx", ".xlsm", ".xltx", ".xltm"]:
-                # Excel：逐行向量化（每行一个向量），不使用滑窗 overlap
-                pieces = chunk_xlsx_rows(text)
-            else:
-                pieces = chunk_text(text, chunk_size=self.chunk_size, overlap=self.overlap)
-            if not pieces:
+
+            sha = _sha256_file(fp)
+            if old is not None and old.get("sha256") == sha and (not old.get("doc_id") or old["doc_id"] in self.docs):
+                # 仅 mtime 变化（touch/复制），内容未变
+                self._set_file_entry(fp, dict(old, size=size, mtime_ns=mtime_ns))
+                report["unchanged"].append(fp)
                 continue
 
-            # Embed first to infer dim if needed
-            chunk_texts = [t for (_, _, t) in pieces]
-            vecs = self._embed_chunks(chunk_texts)
-            dim = int(vecs.shape[1])
-            self._ensure_index(dim)
+            if old is not None:
+                self._drop_file_entry(fp)
+            doc_id, entry = self._ingest_path(fp)
+            self._set_file_entry(fp, {"size": size, "mtime_ns": mtime_ns, "sha256": sha, "doc_id": doc_id})
+            report["updated" if old is not None else "added"].append(fp)
 
-            # Allocate vector ids
-            vids = np.arange(self.next_vector_id, self.next_vector_id + vecs.shape[0], dtype=np.int64)
-            self.next_vector_id = int(vids[-1] + 1)
+            if entry is not None:
+                pending += 1
+            if store_dir is not None and pending >= every_docs:
+                self.save(store_dir)
+                pending = 0
 
-            # Add to faiss
-            assert self.index is not None
-            self.index.add_with_ids(vecs, vids)
+        if store_dir is not None:
+            self.save(store_dir)
+        return report
 
-            # Save chunk metadata
-            for i, (start, end, ch_text) in enumerate(pieces):
-                vid = int(vids[i])
-                chunk_id = f"{doc_id}::chunk_{i:06d}" if ext not in [".xlsx", ".xlsm", ".xltx", ".xltm"] else f"{doc_id}::row_{i:06d}"
-                self.chunks_by_vid[vid] = Chunk(
-                    vector_id=vid,
-                    chunk_id=chunk_id,
-                    doc_id=doc_id,
-                    text=ch_text,
-                    source_path=source_path,
-                    start=int(start),
-                    end=int(end),
-                )
+    def _set_file_entry(self, path: str, fentry: dict) -> None:
+        self.file_table[path] = fentry
+        self._file_table_changes[path] = fentry
 
-            entry = {
-                "doc_id": doc_id,
-                "source_path": source_path,
-                "sha256": _sha256_text(text),
-                "n_chunks": int(vecs.shape[0]),
-                "vector_ids": [int(v) for v in vids.tolist()],
-                "created_at": _now_iso(),
-            }
-            self.docs[doc_id] = entry
-            added[doc_id] = entry
+    def _drop_file_entry(self, path: str) -> None:
+        """
+        从文件表移除 path；若没有其他文件引用同一 doc_id（同内容），一并删除该文档。
+        """
+        fentry = self.file_table.pop(path, None)
+        self._file_table_changes[path] = None
+        if not fentry or not fentry.get("doc_id"):
+            return
+        did = fentry["doc_id"]
+        if any(e.get("doc_id") == did for e in self.file_table.values()):
+            return
+        self.remove_doc(doc_id=did)
 
-        return added
+    def _insert_doc(
+        self,
+        *,
+        doc_id: str,
+        source_path: str,
+        sha256: str,
+        pieces: List[Tuple[int, int, str]],
+        chunk_ids: List[str],
+        vecs: np.ndarray,
+        created_at: Optional[str] = None,
+        parents: Optional[List[Tuple[int, int, str]]] = None,
+        parent_idx: Optional[List[int]] = None,
+        meta: Optional[Dict[str, object]] = None,
+    ) -> dict:
+        """
+        把一篇已切分、已向量化的文档写入 index + 元数据，返回 manifest entry。
+        给出 parents/parent_idx 时同时登记父段，子块通过 parent_id 关联；meta 为并入 entry 的附加字段。
+        """
+        dim = int(vecs.shape[1])
+        self._ensure_index(dim)
+
+        # Allocate vector ids
+        vids = np.arange(self.next_vector_id, self.next_vector_id + vecs.shape[0], dtype=np.int64)
+        self.next_vector_id = int(vids[-1] + 1)
+
+        # Add to faiss
+        self._index_add(vecs, vids)
+
+        # Allocate parent ids + save parent spans
+        pids: List[int] = []
+        for start, end, p_text in parents or []:
+            pid = self.next_parent_id
+            self.next_parent_id += 1
+            self.parents_by_id[pid] = ParentChunk(
+                parent_id=pid, doc_id=doc_id, text=p_text, start=int(start), end=int(end))
+            pids.append(pid)
+
+        # Save chunk metadata
+        for i, (start, end, ch_text) in enumerate(pieces):
+            vid = int(vids[i])
+            self.chunks_by_vid[vid] = Chunk(
+                vector_id=vid,
+                chunk_id=chunk_ids[i],
+                doc_id=doc_id,
+                text=ch_text,
+                source_path=source_path,
+                start=int(start),
+                end=int(end),
+                parent_id=pids[parent_idx[i]] if pids and parent_idx else None,
+            )
+
+        entry = {
+            "doc_id": doc_id,
+            "source_path": source_path,
+            "sha256": sha256,
+            "n_chunks": int(vecs.shape[0]),
+            "vector_ids": [int(v) for v in vids.tolist()],
+            "created_at": created_at or _now_iso(),
+        }
+        if pids:
+            entry["parent_ids"] = pids
+        if meta:
+            entry.update(meta)
+        self.docs[doc_id] = entry
+        self._added_doc_ids.append(doc_id)
+        return entry
 
     # --------- deletion ----------
     def remove_doc(self, *, doc_id: Optional[str] = None, source_path: Optional[str] = None) -> bool:
@@ -595,7 +1600,14 @@ class FaissRAG:
         if not doc_id or doc_id not in self.docs:
             return False
 
+        if doc_id in self._added_doc_ids:
+            self._added_doc_ids.remove(doc_id)
+        else:
+            self._removed_doc_ids.append(doc_id)
+
         entry = self.docs[doc_id]
+        for pid in entry.get("parent_ids", []):
+            self.parents_by_id.pop(int(pid), None)
         vids = entry.get("vector_ids", [])
         if not vids:
             self.docs.pop(doc_id, None)
@@ -605,6 +1617,8 @@ class FaissRAG:
         if self.index is not None and getattr(self.index, "ntotal", 0) > 0:
             ids = np.array(vids, dtype=np.int64)
             _ = self.index.remove_ids(ids)
+        if self.full_vectors is not None:
+            self.full_vectors.remove(vids)
 
         # Remove metadata
         for vid in vids:
@@ -614,40 +1628,83 @@ class FaissRAG:
         return True
 
     # --------- retrieval ----------
-    def search(self, query: str, *, top_k: int = 8) -> List[dict]:
+    def get_parent(self, parent_id: Optional[int]) -> Optional[ParentChunk]:
+        """
+        按 id 取父段（dict 查找，O(1)）；parent_id 为 None 或不存在时返回 None。
+        """
+        if parent_id is None:
+            return None
+        return self.parents_by_id.get(int(parent_id))
+
+    def search(self, query: str, *, top_k: int = 8, expand_parents: bool = True) -> List[dict]:
+        """
+        向量检索 top_k 条证据。
+        父子切分的库（expand_parents=True 时）：命中子块后返回其父段，text/start/end 为父段内容，
+        child_text 为命中的子块；同一父段的多个子块只保留得分最高的一条，结果仍为 top_k 个不同父段。
+        """
         if self.is_empty():
             return []
+        return self.search_by_vector(embed_query_vector(query), top_k=top_k, expand_parents=expand_parents)
 
-        qv = embed_query(query)
-        q = np.array([qv], dtype=np.float32)
-        if q.ndim != 2:
-            raise ValueError("embed_query must return a 1D array-like [dim]")
-        q = _normalize_rows(q)
-
+    def search_by_vector(self, q: np.ndarray, *, top_k: int = 8, expand_parents: bool = True) -> List[dict]:
+        """
+        用已向量化（已归一化）的查询 [1, dim] 检索；多库联合检索时查询只需 embedding 一次。
+        """
+        if self.is_empty():
+            return []
         assert self.index is not None
-        scores, ids = self.index.search(q, top_k)
-        scores = scores[0].tolist()
-        ids = ids[0].tolist()
+        expand = expand_parents and bool(self.parents_by_id)
+        # 父段去重会合并同一父段下的多个子块：多取一些候选以凑满 top_k 个父段
+        k = min(int(self.index.ntotal), top_k * 4) if expand else top_k
+        if self.pca is not None:
+            # 第一阶段：降维索引取 k*factor 个候选；第二阶段：全精度向量精排
+            assert self.full_vectors is not None
+            factor = max(1, int(getattr(settings, "RAG_PCA_RERANK_FACTOR", 8)))
+            k1 = max(1, min(int(self.index.ntotal), k * factor))
+            _, cand = self.index.search(self.pca.project_query(q), k1)
+            sc, ids_ = exact_rerank(q[0], cand[0], self.full_vectors)
+            scores = sc[:k].tolist()
+            ids = ids_[:k].tolist()
+        else:
+            scores, ids = self.index.search(q, k)
+            scores = scores[0].tolist()
+            ids = ids[0].tolist()
 
         hits: List[dict] = []
+        seen_parents = set()
         for score, vid in zip(scores, ids):
             if vid == -1:
                 continue
             c = self.chunks_by_vid.get(int(vid))
             if not c:
                 continue
-            hits.append(
-                {
-                    "score": float(score),
-                    "vector_id": int(vid),
-                    "chunk_id": c.chunk_id,
-                    "doc_id": c.doc_id,
-                    "source_path": c.source_path,
-                    "start": c.start,
-                    "end": c.end,
-                    "text": c.text,
-                }
-            )
+            hit = {
+                "score": float(score),
+                "vector_id": int(vid),
+                "chunk_id": c.chunk_id,
+                "doc_id": c.doc_id,
+                "source_path": c.source_path,
+                "start": c.start,
+                "end": c.end,
+                "text": c.text,
+            }
+            parent = self.get_parent(c.parent_id) if expand else None
+            if parent is not None:
+                if parent.parent_id in seen_parents:
+                    continue
+                seen_parents.add(parent.parent_id)
+                hit.update(
+                    {
+                        "parent_id": parent.parent_id,
+                        "start": parent.start,
+                        "end": parent.end,
+                        "text": parent.text,
+                        "child_text": c.text,
+                    }
+                )
+            hits.append(hit)
+            if len(hits) >= top_k:
+                break
         return hits
 
     # --------- inspection ----------
@@ -7,7 +7,9 @@ import argparse
 from typing import List, Optional
 
 from utils import settings
-from rag import FaissRAG
+from rag.rag import FaissRAG
+from rag.bulk_ingest import bulk_ingest, expand_paths, failure_summary, format_progress, write_summary
+from rag.packed_store import export_packed, import_packed
 
 
 def _store_dir(cli_store_dir: Optional[str] = None) -> str:
@@ -21,22 +23,83 @@ def cmd_status(store_dir: str) -> int:
     print(f"dim: {rag.dim}")
     print(f"ntotal: {rag.index.ntotal if rag.index is not None else 0}")
     print(f"docs: {len(rag.docs)}")
+    if rag.parents_by_id:
+        print(f"parents: {len(rag.parents_by_id)} (parent_chunk_size={rag.parent_chunk_size}, child chunk_size={rag.chunk_size})")
     if rag.docs:
         for d in rag.list_docs():
             print(f"- {d['doc_id']} | chunks={d['n_chunks']} | {d['source_path']}")
     return 0
 
 
-def cmd_add(store_dir: str, paths: List[str]) -> int:
+def cmd_add(store_dir: str, paths: List[str], resume: bool = False) -> int:
     rag = FaissRAG.load(store_dir)
-    added = rag.add_files(paths)
-    rag.save(store_dir)
+    if resume:
+        pending = rag.pending_ingest_paths()
+        if not pending:
+            print("no_pending_ingest")
+            return 0 if not paths else cmd_add(store_dir, paths)
+        job = rag.ingest_job or {}
+        print(f"resume: {job.get('next', 0)}/{len(job.get('paths') or [])} committed, {len(pending)} remaining")
+        paths = pending
+    if not paths:
+        print("no paths given (use --resume to continue an interrupted ingest)")
+        return 2
+
+    # 检查点入库：按 settings.INGEST_CHECKPOINT_* 定期提交，失败后可 add --resume 续传
+    added = rag.add_files(paths, store_dir=store_dir)
     print(f"added_docs: {len(added)}")
     for did, entry in added.items():
         print(f"- {did} | chunks={entry.get('n_chunks')} | {entry.get('source_path')}")
     return 0
 
 
+def cmd_bulk(
+    store_dir: str,
+    specs: List[str],
+    *,
+    parse_workers: Optional[int],
+    embed_workers: Optional[int],
+    queue_size: Optional[int],
+    summary_path: Optional[str],
+) -> int:
+    paths = expand_paths(specs)
+    print(f"bulk: {len(paths)} files")
+    if not paths:
+        return 2
+    rag = FaissRAG.load(store_dir)
+    summary_path = summary_path or os.path.join(os.path.abspath(store_dir), "bulk_ingest_summary.json")
+    try:
+        summary = bulk_ingest(
+            rag,
+            paths,
+            store_dir=store_dir,
+            parse_workers=parse_workers,
+            embed_workers=embed_workers,
+            queue_size=queue_size,
+            progress_fn=lambda snap: print(format_progress(snap), flush=True),
+        )
+    except Exception as e:
+        # 流水线本身出错也写汇总，便于排查
+        summary = failure_summary(e, store_dir=store_dir, total_files=len(paths))
+    print(f"summary: {write_summary(summary, summary_path)}")
+    if not summary.get("ok"):
+        print(f"bulk_failed: indexed_docs={summary.get('indexed_docs')} | {summary.get('error')}")
+        return 1
+    return 0
+
+
+def cmd_sync(store_dir: str, root: str) -> int:
+    rag = FaissRAG.load(store_dir)
+    report = rag.sync_dir(root, store_dir=store_dir)
+    print(f"sync_dir: {os.path.abspath(root)}")
+    for k in ["added", "updated", "removed"]:
+        print(f"{k}: {len(report[k])}")
+        for fp in report[k]:
+            print(f"- {fp}")
+    print(f"unchanged: {len(report['unchanged'])}")
+    return 0
+
+
 def cmd_remove(store_dir: str, doc_id: Optional[str], path: Optional[str]) -> int:
     rag = FaissRAG.load(store_dir)
     ok = rag.remove_doc(doc_id=doc_id, source_path=path)
@@ -45,42 +108,75 @@ def cmd_remove(store_dir: str, doc_id: Optional[str], path: Optional[str]) -> in
     return 0 if ok else 2
 
 
+def cmd_export(store_dir: str, out_path: str) -> int:
+    rag = FaissRAG.load(store_dir)
+    info = export_packed(rag, out_path)
+    print(f"exported: {info['path']}")
+    print(f"chunks: {info['n']}  dim: {info['dim']}  bytes: {info['bytes']}")
+    return 0
+
+
+def cmd_import(store_dir: str, pack_path: str) -> int:
+    # 打包文件直接作为新快照发布，加载时 mmap 读取，无需重建索引或解析 chunks
+    generation = import_packed(store_dir, pack_path)
+    rag = FaissRAG.load(store_dir)
+    print(f"imported: {os.path.abspath(pack_path)} -> {os.path.abspath(store_dir)} (generation {generation})")
+    print(f"docs: {len(rag.docs)}  chunks: {int(rag.index.ntotal) if rag.index is not None else 0}")
+    return 0
+
+
 def cmd_clear(store_dir: str) -> int:
-    # 直接清空持久化文件
-    p = FaissRAG.store_paths(store_dir)
-    removed = 0
-    for k in ["index", "chunks", "manifest"]:
-        fp = p[k]
-        if os.path.exists(fp):
-            os.remove(fp)
-            removed += 1
+    # 持写锁清空快照与持久化文件
+    removed = FaissRAG.clear_store(store_dir)
     print(f"cleared_files: {removed}")
     return 0
 
 
 def build_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(
-        description="Manage persistent FAISS RAG store: add/remove/status/clear",
+        description="Manage persistent FAISS RAG store: add/bulk/sync/remove/status/clear/export/import",
     )
     p.add_argument("--store", default=None, help="RAG store directory (default: settings.RAG_STORE_DIR or ./rag_store)")
+    p.add_argument("--embed-backend", default=None, help="Embedding backend: openai | local_hash (default: settings.EMBED_BACKEND)")
     sub = p.add_subparsers(dest="cmd", required=True)
 
     s1 = sub.add_parser("status", help="Show store status")
     s1.set_defaults(_fn="status")
 
     s2 = sub.add_parser("add", help="Add documents into store")
-    s2.add_argument("paths", nargs="+", help="File paths to ingest (txt/pdf/docx/...)")
+    s2.add_argument("paths", nargs="*", help="File paths to ingest (txt/pdf/docx/...)")
+    s2.add_argument("--resume", action="store_true", help="Continue the last interrupted ingest from its last checkpoint")
     s2.set_defaults(_fn="add")
 
+    s6 = sub.add_parser("bulk", help="Bulk ingest dirs/globs with pipelined parse/embed/index stages and live throughput stats")
+    s6.add_argument("specs", nargs="+", help="Files, directories (recursive) or glob patterns, e.g. 'data/**/*.pdf'")
+    s6.add_argument("--parse-workers", type=int, default=None, help="Parse/chunk threads (default: settings.INGEST_PARSE_WORKERS)")
+    s6.add_argument("--embed-workers", type=int, default=None, help="Concurrent embedding threads (default: settings.INGEST_EMBED_WORKERS)")
+    s6.add_argument("--queue-size", type=int, default=None, help="Bound of inter-stage queues (default: settings.INGEST_QUEUE_SIZE)")
+    s6.add_argument("--summary", default=None, help="JSON summary output path (default: <store>/bulk_ingest_summary.json)")
+    s6.set_defaults(_fn="bulk")
+
+    s5 = sub.add_parser("sync", help="Incrementally mirror a directory tree into store (add new/changed, remove deleted)")
+    s5.add_argument("dir", help="Directory to mirror")
+    s5.set_defaults(_fn="sync")
+
     s3 = sub.add_parser("remove", help="Remove a document from store")
     g = s3.add_mutually_exclusive_group(required=True)
     g.add_argument("--doc-id", dest="doc_id", help="Document id to remove")
     g.add_argument("--path", dest="path", help="Source file path to remove (matches stored absolute path)")
     s3.set_defaults(_fn="remove")
 
-    s4 = sub.add_parser("clear", help="Clear the whole store (delete index/manifest/chunks files)")
+    s4 = sub.add_parser("clear", help="Clear the whole store (delete snapshots and index/manifest/chunks files)")
     s4.set_defaults(_fn="clear")
 
+    s7 = sub.add_parser("export", help="Pack the store into one aligned binary file (vectors + metadata + text) for distribution")
+    s7.add_argument("out", help="Output pack file, e.g. store.pack")
+    s7.set_defaults(_fn="export")
+
+    s8 = sub.add_parser("import", help="Publish a packed store file as the new store snapshot (replaces current contents; memory-mapped on load)")
+    s8.add_argument("pack", help="Pack file produced by export")
+    s8.set_defaults(_fn="import")
+
     return p
 
 
@@ -88,15 +184,32 @@ def main() -> int:
     parser = build_parser()
     args = parser.parse_args()
     store_dir = _store_dir(args.store)
+    if args.embed_backend:
+        settings.EMBED_BACKEND = args.embed_backend
 
     if args._fn == "status":
         return cmd_status(store_dir)
     if args._fn == "add":
-        return cmd_add(store_dir, args.paths)
+        return cmd_add(store_dir, args.paths, resume=args.resume)
+    if args._fn == "bulk":
+        return cmd_bulk(
+            store_dir,
+            args.specs,
+            parse_workers=args.parse_workers,
+            embed_workers=args.embed_workers,
+            queue_size=args.queue_size,
+            summary_path=args.summary,
+        )
+    if args._fn == "sync":
+        return cmd_sync(store_dir, args.dir)
     if args._fn == "remove":
         return cmd_remove(store_dir, getattr(args, "doc_id", None), getattr(args, "path", None))
     if args._fn == "clear":
         return cmd_clear(store_dir)
+    if args._fn == "export":
+        return cmd_export(store_dir, args.out)
+    if args._fn == "import":
+        return cmd_import(store_dir, args.pack)
 
     return 1
 
@@ -105,12 +218,24 @@ def main() -> int:
 # ---------------------------
 if __name__ == "__main__":
     raise SystemExit(main())
+    #在项目根目录以模块方式运行：python -m rag.rag_store_manager <cmd>
     #查看库状态
     #python rag_store_manager.py status
 
     #往库里加资料（txt/pdf/docx 都支持）
     #python rag_store_manager.py add ./rag_store/data/data.txt
+    #入库中途失败后，从最后一次检查点继续
+    #python rag_store_manager.py add --resume
+
+    #批量入库（目录/通配符，流水线并行，实时吞吐统计 + JSON 汇总）
+    #python rag_store_manager.py bulk ./rag_store/data "reports/**/*.pdf" --embed-workers 4
+
+    #把整个目录增量同步进库（新增/修改的文件入库，已删除的文件移出库）
+    #python rag_store_manager.py sync ./rag_store/data
 
     #删除资料（两种方式二选一）
     #python rag_store_manager.py remove --doc-id 7d8c...abcd
-    #python rag_store_manager.py remove --path rag_store/data/data.txt
\ No newline at end of file
+    #python rag_store_manager.py remove --path rag_store/data/data.txt
+    #打包导出为单文件（分发到其他分析机器），目标机器导入后直接 mmap 加载
+    #python rag_store_manager.py export ./dist/store.pack
+    #python rag_store_manager.py --store ./rag_store import ./dist/store.pack
@@ -0,0 +1,249 @@
+# snapshots.py
+# 知识库快照目录：每次提交写入一个新的不可变快照 snapshots/<generation>/，再原子替换 CURRENT 指针；
+# 读者先“钉住”（pin）当前快照再读取，写者提交后回收无人引用的旧快照
+from __future__ import annotations
+
+import os
+import time
+import uuid
+import shutil
+import threading
+from typing import List, Optional, Set
+
+from utils import settings
+
+CURRENT_FNAME = "CURRENT"
+SNAPSHOTS_DIRNAME = "snapshots"
+PINS_DIRNAME = ".pins"
+
+
+def snapshot_name(generation: int) -> str:
+    return f"{int(generation):010d}"
+
+
+def snapshots_root(store_dir: str) -> str:
+    return os.path.join(os.path.abspath(store_dir), SNAPSHOTS_DIRNAME)
+
+
+def snapshot_dir(store_dir: str, name: str) -> str:
+    return os.path.join(snapshots_root(store_dir), name)
+
+
+def _read_current(store_dir: str) -> Optional[List[str]]:
+    fp = os.path.join(os.path.abspath(store_dir), CURRENT_FNAME)
+    try:
+        with open(fp, "r", encoding="utf-8") as f:
+            lines = f.read().split()
+    except OSError:
+        return None
+    return lines or None
+
+
+def current_snapshot(store_dir: str) -> Optional[str]:
+    """
+    读取 CURRENT 指针（第一行为快照名）；无快照（旧版平铺布局或空库）时返回 None。
+    """
+    lines = _read_current(store_dir)
+    return lines[0] if lines else None
+
+
+def current_token(store_dir: str) -> Optional[str]:
+    """
+    当前提交的唯一标识：快照名 + 发布时写入的随机 id（库被清空或目录被删后重建，代数重复也不会相同）。
+    旧版 CURRENT 没有随机 id 时以文件 mtime 代替；无快照时返回 None。
+    """
+    lines = _read_current(store_dir)
+    if not lines:
+        return None
+    if len(lines) > 1:
+        return f"{lines[0]}:{lines[1]}"
+    try:
+        return f"{lines[0]}@{os.stat(os.path.join(os.path.abspath(store_dir), CURRENT_FNAME)).st_mtime_ns}"
+    except OSError:
+        return lines[0]
+
+
+def current_generation(store_dir: str) -> Optional[int]:
+    name = current_snapshot(store_dir)
+    try:
+        return int(name) if name else None
+    except ValueError:
+        return None
+
+
+def staging_dir(store_dir: str, generation: int) -> str:
+    """
+    新快照的临时写入目录（发布前对读者不可见）。
+    """
+    d = os.path.join(snapshots_root(store_dir), f".staging-{snapshot_name(generation)}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def publish_snapshot(store_dir: str, staged: str, generation: int) -> str:
+    """
+    发布快照：staging 目录改名为正式快照目录，然后原子替换 CURRENT（调用方需持有写锁）。
+    CURRENT 内容为 快照名 + 随机 id 两行，随机 id 供 current_token 区分同名的重复代数。
+    """
+    name = snapshot_name(generation)
+    final = snapshot_dir(store_dir, name)
+    if os.path.exists(final):
+        shutil.rmtree(final, ignore_errors=True)
+    os.replace(staged, final)
+
+    cur = os.path.join(os.path.abspath(store_dir), CURRENT_FNAME)
+    tmp = cur + ".tmp"
+    with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+        f.write(f"{name}\n{uuid.uuid4().hex}\n")
+        f.flush()
+        try:
+            os.fsync(f.fileno())
+        except Exception:
+            pass
+    os.replace(tmp, cur)
+    return final
+
+
+# 长期持有的 pin（加载后仍 mmap 快照内文件的库）：后台线程定期刷新 mtime，
+# 避免超过 RAG_SNAPSHOT_PIN_TTL 被当作崩溃遗留；进程退出后不再刷新，过期后快照即可回收
+_held_pins: Set[str] = set()
+_held_lock = threading.Lock()
+_heartbeat: Optional[threading.Thread] = None
+
+
+def _heartbeat_loop() -> None:
+    while True:
+        time.sleep(max(1.0, float(getattr(settings, "RAG_SNAPSHOT_PIN_TTL", 3600)) / 4))
+        with _held_lock:
+            files = list(_held_pins)
+        now = time.time()
+        for fp in files:
+            try:
+                os.utime(fp, (now, now))
+            except OSError:
+                pass
+
+
+class SnapshotPin:
+    """
+    读者钉住当前快照：在 snapshots/<name>/.pins/ 下创建 pin 文件，期间 gc_snapshots 不会删除该快照。
+    用法：
+        with SnapshotPin(store_dir) as pin:
+            if pin.path: ...  # 从 pin.path 读取 index/chunks/manifest
+    pin.path 为 None 表示库尚未使用快照布局。超过 RAG_SNAPSHOT_PIN_TTL 秒的 pin 视为进程已崩溃遗留，不再生效。
+    在 with 块内调用 hold() 后退出时不释放，由调用方之后 release()（读取结果仍 mmap 快照文件时使用）。
+    """
+
+    def __init__(self, store_dir: str) -> None:
+        self.store_dir = os.path.abspath(store_dir)
+        self.name: Optional[str] = None
+        self.path: Optional[str] = None
+        self._pin_file: Optional[str] = None
+        self._held = False
+
+    def acquire(self) -> None:
+        for _ in range(10):
+            name = current_snapshot(self.store_dir)
+            if name is None:
+                return
+            d = snapshot_dir(self.store_dir, name)
+            pins = os.path.join(d, PINS_DIRNAME)
+            pin_file = os.path.join(pins, f"{os.getpid()}-{threading.get_ident()}-{uuid.uuid4().hex[:8]}")
+            try:
+                # 只建 .pins、不建快照目录本身：快照已被回收时这里失败，不会留下空快照目录
+                try:
+                    os.mkdir(pins)
+                except FileExistsError:
+                    pass
+                with open(pin_file, "w", encoding="utf-8") as f:
+                    f.write(str(time.time()))
+            except OSError:
+                continue  # 快照恰好被回收：重新读取 CURRENT
+            # 写入 pin 后 CURRENT 仍指向该快照：gc 只在之后的提交中运行，一定能看到这个 pin；
+            # 否则快照可能已进入回收，撤销 pin 后按新的 CURRENT 重试
+            if current_snapshot(self.store_dir) == name:
+                self.name, self.path, self._pin_file = name, d, pin_file
+                return
+            try:
+                os.remove(pin_file)
+            except OSError:
+                pass
+        raise RuntimeError(f"无法钉住知识库快照（写入过于频繁？）：{self.store_dir}")
+
+    def hold(self) -> None:
+        """
+        转为长期持有：退出 with 块时不释放，后台定期刷新 pin，直到 release()。
+        """
+        global _heartbeat
+        if not self._pin_file:
+            return
+        self._held = True
+        with _held_lock:
+            _held_pins.add(self._pin_file)
+            if _heartbeat is None:
+                _heartbeat = threading.Thread(target=_heartbeat_loop, name="snapshot-pin-heartbeat", daemon=True)
+                _heartbeat.start()
+
+    def release(self) -> None:
+        if self._pin_file:
+            with _held_lock:
+                _held_pins.discard(self._pin_file)
+            try:
+                os.remove(self._pin_file)
+            except OSError:
+                pass
+        self._pin_file = None
+        self._held = False
+
+    def __enter__(self) -> "SnapshotPin":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if not self._held or exc_type is not None:
+            self.release()
+
+
+def _has_live_pins(d: str, ttl: float) -> bool:
+    pins = os.path.join(d, PINS_DIRNAME)
+    try:
+        names = os.listdir(pins)
+    except OSError:
+        return False
+    now = time.time()
+    for n in names:
+        try:
+            if now - os.path.getmtime(os.path.join(pins, n)) < ttl:
+                return True
+        except OSError:
+            continue
+    return False
+
+
+def gc_snapshots(store_dir: str, *, keep: Optional[int] = None) -> List[str]:
+    """
+    回收旧快照（调用方需持有写锁）：保留 CURRENT 及最近 keep 个快照；更旧的快照若无有效 pin 则删除。
+    同时清理异常中断遗留的 staging 目录。返回被删除的快照名。
+    """
+    keep = max(1, int(keep if keep is not None else getattr(settings, "RAG_KEEP_SNAPSHOTS", 2)))
+    ttl = float(getattr(settings, "RAG_SNAPSHOT_PIN_TTL", 3600))
+    root = snapshots_root(store_dir)
+    cur = current_snapshot(store_dir)
+    try:
+        entries = sorted(os.listdir(root))
+    except OSError:
+        return []
+
+    removed: List[str] = []
+    for e in entries:
+        if e.startswith(".staging-"):
+            shutil.rmtree(os.path.join(root, e), ignore_errors=True)
+
+    names = [e for e in entries if not e.startswith(".") and e != cur]
+    for name in names[:max(0, len(names) - (keep - 1))]:
+        d = os.path.join(root, name)
+        if _has_live_pins(d, ttl):
+            continue
+        shutil.rmtree(d, ignore_errors=True)
+        removed.append(name)
+    return removed
@@ -0,0 +1,106 @@
+# store_lock.py
+# 知识库目录的跨进程写锁（advisory lock），多个 Streamlit 会话 / rag_store_manager 并发写同一 store_dir 时排队
+from __future__ import annotations
+
+import os
+import time
+import threading
+from typing import Optional
+
+from utils import settings
+
+LOCK_FNAME = ".store.lock"
+
+
+def _try_lock(fd: int) -> bool:
+    """
+    非阻塞加锁：成功返回 True，被其他进程占用返回 False。
+    """
+    if os.name == "nt":
+        import msvcrt  # noqa
+        try:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    import fcntl  # noqa
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except (BlockingIOError, PermissionError):
+        return False
+
+
+def _unlock(fd: int) -> None:
+    if os.name == "nt":
+        import msvcrt  # noqa
+        try:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        return
+
+    import fcntl  # noqa
+    fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class StoreLock:
+    """
+    store_dir 级别的独占写锁：
+    - 仅写者（save / clear 等提交动作）需要持锁；读者（FaissRAG.load）从不加锁，因此不会被写者阻塞
+    - 锁文件为 store_dir/.store.lock，进程退出时由操作系统自动释放，不会残留死锁
+    - 同一线程内可重入（嵌套 with 不会自锁）；同进程不同线程（Streamlit 会话）之间同样互斥
+    """
+
+    _local = threading.local()  # 每线程：abs store_dir -> [fd, depth]
+
+    def __init__(self, store_dir: str, *, timeout: Optional[float] = None, poll: float = 0.1) -> None:
+        self.store_dir = os.path.abspath(store_dir)
+        self.path = os.path.join(self.store_dir, LOCK_FNAME)
+        self.timeout = float(timeout if timeout is not None else getattr(settings, "RAG_LOCK_TIMEOUT", 600))
+        self.poll = float(poll)
+
+    @classmethod
+    def _held(cls) -> dict:
+        if not hasattr(cls._local, "held"):
+            cls._local.held = {}
+        return cls._local.held
+
+    def acquire(self) -> None:
+        held = self._held().get(self.store_dir)
+        if held is not None:
+            held[1] += 1
+            return
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = time.monotonic() + self.timeout
+        while not _try_lock(fd):
+            if time.monotonic() >= deadline:
+                os.close(fd)
+                raise TimeoutError(f"等待知识库写锁超时（{self.timeout:.0f}s）：{self.path}")
+            time.sleep(self.poll)
+        self._held()[self.store_dir] = [fd, 1]
+
+    def release(self) -> None:
+        held = self._held().get(self.store_dir)
+        if held is None:
+            return
+        held[1] -= 1
+        if held[1] > 0:
+            return
+        self._held().pop(self.store_dir, None)
+        try:
+            _unlock(held[0])
+        finally:
+            os.close(held[0])
+
+    def __enter__(self) -> "StoreLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release()
@@ -0,0 +1,205 @@
+# store_registry.py
+# 多知识库注册表：同一进程内缓存多个已加载的 FaissRAG（按 store_dir），在内存预算内按 LRU 淘汰，
+# 切换 store_dir（各 tab / 行业库 / 客户库）时命中缓存即可立即使用，无需重新 load
+from __future__ import annotations
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from utils import settings
+from rag.rag import FaissRAG
+
+_CHUNK_OVERHEAD = 360  # 每个 Chunk 对象（dataclass + dict 槽位 + 短字符串）的大致开销，字节
+
+
+def estimate_rag_bytes(rag: FaissRAG) -> int:
+    """
+    估算一个已加载 FaissRAG 的常驻内存（字节）：faiss 索引 + 切片/父段文本与对象开销。
+    mmap 部分（打包库的切片、PCA 全精度侧文件）不计入，它们由操作系统按需分页。
+    """
+    total = 0
+    if rag.index is not None:
+        n = int(rag.index.ntotal)
+        total += n * int(rag.index.d) * 4 + n * 16  # Flat 向量 + IDMap2 的 id 与反查表
+    if rag.full_vectors is not None:
+        total += len(rag.full_vectors._extra) * int(rag.full_vectors.dim) * 4
+
+    def _texts(m: Any) -> int:
+        if isinstance(m, dict):
+            return sum(len(x.text.encode("utf-8")) + _CHUNK_OVERHEAD for x in m.values())
+        extra = getattr(m, "_extra", {})  # 打包库的惰性映射：只有内存覆盖层常驻
+        return sum(len(x.text.encode("utf-8")) + _CHUNK_OVERHEAD for x in extra.values())
+
+    total += _texts(rag.chunks_by_vid)
+    total += _texts(rag.parents_by_id)
+    total += sum(len(e.get("vector_ids", [])) * 36 + 512 for e in rag.docs.values())
+    return int(total)
+
+
+@dataclass
+class _Entry:
+    store_dir: str
+    rag: FaissRAG
+    generation: int
+    token: str  # 加载前读取的提交标识（FaissRAG.committed_token），与当前不同即过期
+    nbytes: int
+    load_sec: float
+    loaded_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    hits: int = 0
+    loads: int = 1
+
+
+class StoreRegistry:
+    """
+    已加载知识库的 LRU 缓存（线程安全，Streamlit 多会话共享同一进程内的实例）：
+    - get(store_dir)：命中且库未被提交过新版本时直接返回缓存实例；否则重新 load
+      （是否过期只需读取 CURRENT 指针中的快照名 + 随机 id，开销可忽略；不用代数比较，清空 / 重建后代数可能重复）
+    - 总估算内存超过 budget_mb 时淘汰最久未使用的库（至少保留刚访问的那个）
+    返回的实例由多个调用方共享，只能用于检索；需要增删文档的写者请用 FaissRAG.load 取独立实例。
+    """
+
+    def __init__(self, budget_mb: Optional[float] = None) -> None:
+        self.budget_bytes = int(float(budget_mb if budget_mb is not None else getattr(
+            settings, "RAG_REGISTRY_BUDGET_MB", 2048)) * 1024 * 1024)
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(key, threading.Lock())
+
+    def _lookup(self, key: str, token: str) -> Optional[FaissRAG]:
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None or e.token != token:
+                return None
+            e.hits += 1
+            e.last_used = time.time()
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return e.rag
+
+    def get(self, store_dir: str) -> FaissRAG:
+        key = os.path.abspath(store_dir)
+        token = FaissRAG.committed_token(key)
+        rag = self._lookup(key, token)
+        if rag is not None:
+            return rag
+
+        # 同一个库只让一个线程去 load，其余线程等待后直接命中
+        with self._key_lock(key):
+            # 先读标识再 load：load 期间若有新提交，下次 get 会因标识不同而重新加载
+            token = FaissRAG.committed_token(key)
+            rag = self._lookup(key, token)
+            if rag is not None:
+                return rag
+
+            t0 = time.perf_counter()
+            rag = FaissRAG.load(key)
+            load_sec = time.perf_counter() - t0
+            nbytes = estimate_rag_bytes(rag)
+
+            with self._lock:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self.reloads += 1
+                else:
+                    self.misses += 1
+                self._entries[key] = _Entry(
+                    store_dir=key,
+                    rag=rag,
+                    generation=rag.base_generation,
+                    token=token,
+                    nbytes=nbytes,
+                    load_sec=load_sec,
+                    loads=(old.loads + 1) if old is not None else 1,
+                    hits=old.hits if old is not None else 0,
+                )
+                self._evict_locked(keep=key)
+            return rag
+
+    def _evict_locked(self, *, keep: str) -> None:
+        while self.resident_bytes() > self.budget_bytes and len(self._entries) > 1:
+            victim = next(iter(self._entries))
+            if victim == keep:
+                break
+            self._entries.pop(victim)
+            self.evictions += 1
+
+    def resident_bytes(self) -> int:
+        return sum(e.nbytes for e in self._entries.values())
+
+    def invalidate(self, store_dir: Optional[str] = None) -> None:
+        """
+        丢弃指定库（或全部库）的缓存实例，下次 get 时重新加载。
+        """
+        with self._lock:
+            if store_dir is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(store_dir), None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        驻留统计：预算、当前估算占用、命中/未命中/重载/淘汰次数，以及每个库的占用与访问情况（按最近使用排序）。
+        """
+        with self._lock:
+            stores: List[Dict[str, Any]] = []
+            for e in reversed(self._entries.values()):
+                stores.append(
+                    {
+                        "store_dir": e.store_dir,
+                        "generation": e.generation,
+                        "mb": round(e.nbytes / 1024 / 1024, 2),
+                        "ntotal": int(e.rag.index.ntotal) if e.rag.index is not None else 0,
+                        "docs": len(e.rag.docs),
+                        "hits": e.hits,
+                        "loads": e.loads,
+                        "load_sec": round(e.load_sec, 3),
+                        "idle_sec": round(time.time() - e.last_used, 1),
+                    }
+                )
+            lookups = self.hits + self.misses + self.reloads
+            return {
+                "budget_mb": round(self.budget_bytes / 1024 / 1024, 1),
+                "resident_mb": round(self.resident_bytes() / 1024 / 1024, 2),
+                "n_stores": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "stores": stores,
+            }
+
+
+_registry: Optional[StoreRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> StoreRegistry:
+    """
+    进程级共享的注册表（首次调用时按 settings.RAG_REGISTRY_BUDGET_MB 创建）。
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = StoreRegistry()
+        return _registry
+
+
+def get_store(store_dir: str) -> FaissRAG:
+    """
+    只读检索用：从共享注册表取 store_dir 对应的 FaissRAG（命中缓存时不重新加载）。
+    """
+    return get_registry().get(store_dir)
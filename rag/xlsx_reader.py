@@ -0,0 +1,205 @@
+# xlsx_reader.py
+# Excel 读取：逐 Sheet 抽取为“表头: 值”行文本；多 Sheet 的大文件在子进程中按 Sheet 并行解析，
+# 每个 Sheet 单独探测是否需要读取公式文本（本模块只依赖 openpyxl 与 settings，子进程导入开销小）
+from __future__ import annotations
+
+import os
+import sys
+import datetime as _dt
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils import settings
+
+
+def normalize_headers(raw_headers: List[str]) -> List[str]:
+    """
+    - 空表头 -> col_1/col_2...
+    - 重复表头 -> name_2/name_3...
+    """
+    headers: List[str] = []
+    seen: Dict[str, int] = {}
+    for i, h in enumerate(raw_headers):
+        h = (h or "").strip()
+        if not h:
+            h = f"col_{i+1}"
+        cnt = seen.get(h, 0) + 1
+        seen[h] = cnt
+        if cnt > 1:
+            h = f"{h}_{cnt}"
+        headers.append(h)
+    return headers
+
+
+def _load_workbook(path: str, data_only: bool):
+    try:
+        from openpyxl import load_workbook  # type: ignore
+    except Exception as e:
+        raise ImportError("读取 XLSX 需要安装 openpyxl：pip install openpyxl") from e
+    return load_workbook(path, read_only=True, data_only=data_only)
+
+
+def _cell_to_str(v: Any) -> str:
+    if v is None:
+        return ""
+    if isinstance(v, (_dt.datetime, _dt.date)):
+        return v.isoformat()
+    try:
+        return str(v)
+    except Exception:
+        return ""
+
+
+def _sheet_lines(ws, limits: Tuple[int, int, bool]) -> Tuple[List[str], int]:
+    """
+    单个 Sheet -> (行文本列表, 数据行数)：第一条非空行作为表头，后续每行输出  表头: 值  （\\t 分隔）。
+    """
+    max_rows, max_cols, include_empty = limits
+    lines: List[str] = []
+    headers: Optional[List[str]] = None
+    data_rows_written = 0
+
+    for row in ws.iter_rows(values_only=True):
+        row = row[:max_cols] if row else []
+        row_vals = [_cell_to_str(v) for v in row]
+
+        # 跳过全空行
+        if not any(x.strip() for x in row_vals):
+            continue
+
+        # 第一条非空行作为表头
+        if headers is None:
+            headers = normalize_headers(row_vals)
+            continue
+
+        # 行数上限（只统计数据行，不统计表头）
+        if data_rows_written >= max_rows:
+            lines.append("... [TRUNCATED: rows limit reached]")
+            break
+
+        # 表头绑定到每个单元格
+        pairs: List[str] = []
+        non_empty_value_cnt = 0
+        for h, v in zip(headers, row_vals):
+            v = (v or "").strip()
+            if v:
+                non_empty_value_cnt += 1
+            if include_empty or v:
+                pairs.append(f"{h}: {v}".rstrip())
+
+        # 默认：整行全空值则跳过
+        if not include_empty and non_empty_value_cnt == 0:
+            continue
+
+        lines.append("\t".join(pairs))
+        data_rows_written += 1
+
+    return lines, data_rows_written
+
+
+def _has_formulas(ws, probe_rows: int, max_cols: int) -> bool:
+    """
+    探测 Sheet 前 probe_rows 行是否含公式（以 = 开头的单元格）。只在“值”读取为空时调用。
+    """
+    for i, row in enumerate(ws.iter_rows(values_only=True)):
+        if i >= probe_rows:
+            break
+        for v in (row or ())[:max_cols]:
+            if isinstance(v, str) and v.startswith("="):
+                return True
+    return False
+
+
+def _open_book(books: Dict[Tuple[str, bool], Any], path: str, data_only: bool):
+    key = (path, data_only)
+    wb = books.get(key)
+    if wb is None:
+        wb = books[key] = _load_workbook(path, data_only)
+    return wb
+
+
+def _close_books(books: Dict[Tuple[str, bool], Any]) -> None:
+    while books:
+        try:
+            books.popitem()[1].close()
+        except Exception:
+            pass
+
+
+def _extract_sheet(
+    books: Dict[Tuple[str, bool], Any],
+    path: str,
+    sname: str,
+    limits: Tuple[int, int, bool],
+    probe_rows: int,
+) -> List[str]:
+    """
+    抽取一个 Sheet：
+    优先读“值”（data_only=True）；该 Sheet 读不到数据行时，探测前 probe_rows 行是否有公式，
+    有公式（例如文件由程序生成、没有缓存计算结果）才对这个 Sheet 改读公式文本。
+    books 为调用方持有的已打开工作簿（同一次读取内复用，不跨线程共享）。
+    """
+    lines, n_rows = _sheet_lines(_open_book(books, path, True)[sname], limits)
+    if n_rows == 0 and probe_rows > 0:
+        ws = _open_book(books, path, False)[sname]
+        if _has_formulas(ws, probe_rows, limits[1]):
+            lines, _ = _sheet_lines(ws, limits)
+    return [f"# sheet: {sname}"] + lines + [""]  # sheet 分隔空行
+
+
+# 仅在子进程（每个 read_xlsx_file 调用独占的进程池）中使用：同一进程处理多个 Sheet 时只解析一次 workbook
+_WORKER_BOOKS: Dict[Tuple[str, bool], Any] = {}
+
+
+def _extract_sheet_task(args: Tuple[str, str, Tuple[int, int, bool], int]) -> List[str]:
+    path = args[0]
+    for k in [k for k in _WORKER_BOOKS if k[0] != path]:
+        try:
+            _WORKER_BOOKS.pop(k).close()
+        except Exception:
+            pass
+    return _extract_sheet(_WORKER_BOOKS, *args)
+
+
+def read_xlsx_file(path: str, *, workers: Optional[int] = None) -> str:
+    """
+    读取 .xlsx/.xlsm/.xltx/.xltm 为“可检索文本”：
+    - 每个 Sheet：找到第一条非空行作为表头
+    - 后续每一行：输出为  表头:值  的键值对（用 \\t 分隔）
+    - 默认跳过全空行/全空值行
+    - 文件不小于 XLSX_PARALLEL_MIN_BYTES 且有多个 Sheet 时，按 Sheet 分发到子进程并行解析（输出顺序不变；
+      打包后的 exe 中始终串行）
+    """
+    max_sheets = int(getattr(settings, "XLSX_MAX_SHEETS", 20))
+    limits = (
+        int(getattr(settings, "XLSX_MAX_ROWS_PER_SHEET", 5000)),
+        int(getattr(settings, "XLSX_MAX_COLS_PER_SHEET", 50)),
+        # 可选：是否把空值也输出为“表头:”
+        bool(getattr(settings, "XLSX_INCLUDE_EMPTY_VALUES", False)),
+    )
+    probe_rows = int(getattr(settings, "XLSX_FORMULA_PROBE_ROWS", 50))
+    path = os.path.abspath(path)
+
+    # 已打开的工作簿只属于本次调用（批量入库的解析线程、多个会话可能同时读取不同文件）
+    books: Dict[Tuple[str, bool], Any] = {}
+    try:
+        sheetnames = list(_open_book(books, path, True).sheetnames)[:max_sheets]
+        n_workers = int(workers if workers is not None else getattr(settings, "XLSX_PARALLEL_WORKERS", 4))
+        n_workers = min(n_workers, len(sheetnames), os.cpu_count() or 1)
+        parallel = (
+            n_workers > 1
+            and not getattr(sys, "frozen", False)  # PyInstaller 打包版不启动子进程，避免 exe 被重复拉起
+            and os.path.getsize(path) >= int(getattr(settings, "XLSX_PARALLEL_MIN_BYTES", 2 * 1024 * 1024))
+        )
+
+        tasks = [(path, s, limits, probe_rows) for s in sheetnames]
+        if parallel:
+            _close_books(books)
+            with ProcessPoolExecutor(max_workers=n_workers) as ex:
+                blocks = list(ex.map(_extract_sheet_task, tasks))
+        else:
+            blocks = [_extract_sheet(books, *t) for t in tasks]
+    finally:
+        _close_books(books)
+
+    return "\n".join(line for block in blocks for line in block).strip()
@@ -1,6 +1,7 @@
 import sys
 import os
 import socket
+import multiprocessing
 import streamlit.web.cli as stcli
 from app import *
 def is_port_in_use(port: int) -> bool:
@@ -94,4 +95,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # 打包后的 exe 中子进程（如 Excel 按 Sheet 并行解析）会重新启动本程序，需先交给 multiprocessing 处理
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
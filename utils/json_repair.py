@@ -0,0 +1,141 @@
+# json_repair.py
+# 模型 JSON 输出的本地修复：去掉 ```json 围栏、多余的尾逗号、Python 字面量，
+# 补齐被 max_tokens 截断的字符串与括号；修不好时才需要再请求模型
+from __future__ import annotations
+
+import re
+import json
+from typing import Any, List, Optional
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?[ \t]*\n?")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_JSON_LITERALS = ("true", "false", "null")
+
+
+def strip_fences(text: str) -> str:
+    """
+    去掉 Markdown 代码围栏（```json ... ```），保留其中内容。
+    """
+    return _FENCE_RE.sub("", text or "")
+
+
+def _drop_trailing_comma(out: List[str]) -> None:
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ",":
+        del out[j:]
+
+
+def _last_token(out: List[str]) -> str:
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    return out[j] if j >= 0 else ""
+
+
+def repair_json(text: str) -> Optional[str]:
+    """
+    单遍扫描修复，返回修复后的 JSON 文本（找不到 "{" 时返回 None）：
+    - 从第一个 "{" 开始，顶层对象闭合后的内容丢弃
+    - 删除 } / ] 前的尾逗号；True/False/None -> true/false/null
+    - 括号不匹配时补齐中间缺失的闭合符
+    - 输出被截断：补全未闭合的字符串 / 字面量，去掉悬空的键、逗号，冒号后补 null，再补齐所有闭合括号
+    """
+    text = strip_fences(text)
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    out: List[str] = []         # 逐字符输出
+    stack: List[str] = []       # 期望的闭合符
+    key_pos: List[int] = []     # 对象帧：当前“悬空键”在 out 中的起始位置（-1 表示无）
+    in_string = False
+    esc = False
+    i = start
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if in_string:
+            out.append(ch)
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_string = False
+            i += 1
+            continue
+
+        if ch == '"':
+            if stack and stack[-1] == "}" and _last_token(out) in ("{", ","):
+                key_pos[-1] = len(out)  # 对象中的键，直到遇到冒号为止都算悬空
+            in_string = True
+            out.append(ch)
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            key_pos.append(-1)
+            out.append(ch)
+        elif ch in "}]":
+            if ch not in stack:
+                i += 1
+                continue  # 多余的闭合符
+            while stack:
+                closer = stack.pop()
+                key_pos.pop()
+                _drop_trailing_comma(out)
+                out.append(closer)
+                if closer == ch:
+                    break
+            if not stack:
+                break
+        elif ch == ":":
+            if key_pos:
+                key_pos[-1] = -1
+            out.append(ch)
+        elif ch.isalpha():
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.extend(_PY_LITERALS.get(word, word))
+            i = j
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    if stack:
+        # 截断：补全字符串 / 字面量，清理悬空的键与分隔符
+        if in_string:
+            if esc:
+                out.pop()
+            out.append('"')
+        tail = "".join(out[-6:])
+        m = re.search(r"([A-Za-z]+|-?[0-9.eE+-]*[.eE+-])$", tail)
+        if m and not in_string:
+            frag = m.group(1)
+            done = next((w for w in _JSON_LITERALS if w.startswith(frag)), None)
+            del out[len(out) - len(frag):]
+            out.extend(done if done else frag.rstrip(".eE+-") or "null")
+        if key_pos and key_pos[-1] >= 0:
+            del out[key_pos[-1]:]
+        last = _last_token(out)
+        if last == ":":
+            out.extend(" null")
+        _drop_trailing_comma(out)
+        out.extend(reversed(stack))
+    return "".join(out)
+
+
+def loads_lenient(text: str) -> Any:
+    """
+    先原样解析，失败后用 repair_json 修复再解析；仍失败时抛出 json.JSONDecodeError / ValueError。
+    """
+    try:
+        return json.loads(text, strict=False)
+    except json.JSONDecodeError:
+        fixed = repair_json(text)
+        if fixed is None:
+            raise ValueError("No JSON object found in model output.")
+        return json.loads(fixed, strict=False)
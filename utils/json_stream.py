@@ -0,0 +1,169 @@
+# json_stream.py
+# 增量 JSON 解析：边接收流式输出边解析，字段（如 overall、labels[i]、各章节）一闭合就产出，
+# 结构出错时立即报错，调用方可提前中止生成
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+Path = Tuple[Any, ...]
+
+_SCALAR_START = set("-0123456789tfn")
+
+
+class JSONStreamError(ValueError):
+    """流式输出不是合法 JSON（括号不匹配、出现非法字符或输出不完整）。"""
+
+
+class IncrementalJSONParser:
+    """
+    逐段 feed 模型输出，返回本段内闭合的值 [(path, value), ...]：
+    - path 为键 / 下标组成的元组，例如 ("overall",)、("labels", 0)；只产出 len(path) <= max_depth 的值
+      （子值先于父值产出；顶层对象闭合时 done=True，result 为完整对象）
+    - 第一个 "{" 之前的内容（如 ```json 围栏、说明文字）跳过；顶层对象闭合后的内容忽略
+    """
+
+    def __init__(self, *, max_depth: int = 2) -> None:
+        self.max_depth = int(max_depth)
+        self.buf = ""
+        self.pos = 0
+        self.started = False
+        self.done = False
+        self.result: Optional[Dict[str, Any]] = None
+        # 栈帧：[kind, start, cur, state]；kind 为 "{" / "["，cur 为当前键 / 下标
+        self._stack: List[list] = []
+        self._str_start: Optional[int] = None
+        self._str_is_key = False
+        self._esc = False
+        self._scalar_start: Optional[int] = None
+        self._events: List[Tuple[Path, Any]] = []
+
+    def _path(self) -> Path:
+        return tuple(f[2] for f in self._stack)
+
+    def _error(self, msg: str, i: int) -> JSONStreamError:
+        ctx = self.buf[max(0, i - 40): i + 1]
+        return JSONStreamError(f"{msg}（位置 {i}，附近内容：{ctx!r}）")
+
+    def _end_value(self, start: int, end: int) -> None:
+        path = self._path()
+        if not path or len(path) <= self.max_depth:
+            try:
+                value = json.loads(self.buf[start:end], strict=False)  # 与 chat_json 一致：字符串内允许原样换行等控制字符
+            except json.JSONDecodeError as e:
+                raise self._error(f"非法的 JSON 值：{e.msg}", end - 1) from e
+            if path:
+                self._events.append((path, value))
+            else:
+                self.done = True
+                self.result = value
+                return
+        if self._stack:
+            self._stack[-1][3] = "comma_or_end"
+        else:
+            self.done = True
+
+    def _begin_value(self, ch: str, i: int) -> None:
+        if ch == "{":
+            self._stack.append(["{", i, None, "key_or_end"])
+        elif ch == "[":
+            self._stack.append(["[", i, 0, "value_or_end"])
+        elif ch == '"':
+            self._str_start, self._str_is_key = i, False
+        elif ch in _SCALAR_START:
+            self._scalar_start = i
+        else:
+            raise self._error(f"此处应为 JSON 值，实际为 {ch!r}", i)
+
+    def _close(self, i: int) -> None:
+        frame = self._stack.pop()
+        self._end_value(frame[1], i + 1)
+
+    def feed(self, text: str) -> List[Tuple[Path, Any]]:
+        self.buf += text
+        buf = self.buf
+        i = self.pos
+        n = len(buf)
+        while i < n and not self.done:
+            ch = buf[i]
+
+            if self._str_start is not None:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    s, self._str_start = self._str_start, None
+                    if self._str_is_key:
+                        frame = self._stack[-1]
+                        frame[2] = json.loads(buf[s:i + 1], strict=False)
+                        frame[3] = "colon"
+                    else:
+                        self._end_value(s, i + 1)
+                i += 1
+                continue
+
+            if self._scalar_start is not None:
+                if ch not in ",]}" and not ch.isspace():
+                    i += 1
+                    continue
+                s, self._scalar_start = self._scalar_start, None
+                self._end_value(s, i)
+
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                    self._begin_value(ch, i)
+                i += 1
+                continue
+
+            if ch.isspace():
+                i += 1
+                continue
+
+            frame = self._stack[-1]
+            kind, state = frame[0], frame[3]
+            if kind == "{":
+                if state in ("key_or_end", "key") and ch == '"':
+                    self._str_start, self._str_is_key = i, True
+                elif state == "key_or_end" and ch == "}":
+                    self._close(i)
+                elif state == "colon" and ch == ":":
+                    frame[3] = "value"
+                elif state == "value":
+                    frame[3] = "in_value"
+                    self._begin_value(ch, i)
+                elif state == "comma_or_end" and ch == ",":
+                    frame[3] = "key"
+                elif state == "comma_or_end" and ch == "}":
+                    self._close(i)
+                else:
+                    raise self._error(f"对象中出现意外字符 {ch!r}", i)
+            else:
+                if state == "value_or_end" and ch == "]":
+                    self._close(i)
+                elif state in ("value_or_end", "value"):
+                    frame[3] = "in_value"
+                    self._begin_value(ch, i)
+                elif state == "comma_or_end" and ch == ",":
+                    frame[2] += 1
+                    frame[3] = "value"
+                elif state == "comma_or_end" and ch == "]":
+                    self._close(i)
+                else:
+                    raise self._error(f"数组中出现意外字符 {ch!r}", i)
+            i += 1
+
+        self.pos = i
+        events, self._events = self._events, []
+        return events
+
+    def close(self) -> Dict[str, Any]:
+        """
+        输出结束：返回完整对象；未出现 JSON 对象或对象未闭合时报错。
+        """
+        if not self.done:
+            if not self.started:
+                raise JSONStreamError("No JSON object found in model output.")
+            raise JSONStreamError(f"JSON 输出不完整（未闭合的层级：{len(self._stack)}）")
+        return self.result  # type: ignore[return-value]
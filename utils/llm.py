@@ -3,81 +3,716 @@
 from __future__ import annotations
 import json
 import re
-from openai import OpenAI
+import time
+import random
+import asyncio
+import threading
+import weakref
+from contextlib import contextmanager
+import httpx
+from openai import AsyncOpenAI, OpenAI
 import numpy as np
 from utils import settings
-from typing import Any, Dict, List
+from utils.llm_cache import cache_key, get_cache
+from utils.json_stream import IncrementalJSONParser, JSONStreamError
+from utils.json_repair import repair_json
+from utils.rate_limit import (arate_limited, classify_error, estimate_messages_tokens, estimate_tokens,
+                              rate_limited)
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 
-def _extract_json_object(text: str) -> str:
+# 对象内部的记号：完整的 JSON 字符串（含转义）或括号；字符串整体由正则引擎跳过
+_TOKEN_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}]', re.S)
+
+
+def _object_spans(text: str) -> List[Tuple[int, int]]:
     """
-    从输出中提取json框架数据，便于后续格式化处理。
+    单遍扫描（O(n)，无回溯）找出所有顶层平衡的 {...} 片段 [(start, end), ...]：
+    对象外只查找 "{"，对象内按记号前进（字符串里的括号不影响配对），正文中的引号也不会干扰扫描。
     """
-    text = text.strip()
-    # 直接就是 JSON
-    if text.startswith("{") and text.endswith("}"):
-        return text
+    spans: List[Tuple[int, int]] = []
+    pos = 0
+    while True:
+        start = text.find("{", pos)
+        if start < 0:
+            return spans
+        depth = 0
+        for m in _TOKEN_RE.finditer(text, start):
+            tok = m.group()
+            if tok == "{":
+                depth += 1
+            elif tok == "}":
+                depth -= 1
+                if depth == 0:
+                    spans.append((start, m.end()))
+                    pos = m.end()
+                    break
+        else:
+            return spans  # 未闭合（输出被截断）
+
 
-    # 尝试截取第一个 {...}
-    m = re.search(r"\{.*\}", text, flags=re.S)
-    if not m:
+def _load_json_object(text: str) -> Dict[str, Any]:
+    """
+    从输出中提取json框架数据并直接解析：
+    1) 快速路径：第一个 "{" 到最后一个 "}"（str.find / rfind，线性、无回溯），能解析即返回
+    2) 否则单遍扫描出所有顶层平衡对象，取能解析的最长者（通常就是报告本体；
+       正文里的 {注} 之类片段长度小且无法解析），都无法解析时抛出第一个对象的解析错误
+    """
+    first = text.find("{")
+    if first < 0:
         raise ValueError("No JSON object found in model output.")
-    return m.group(0)
+    last = text.rfind("}")
+    if last > first:
+        try:
+            return json.loads(text[first:last + 1], strict=False)
+        except ValueError:
+            pass
+    spans = _object_spans(text)
+    if not spans:
+        raise ValueError("No JSON object found in model output.")
+    first_err: Exception | None = None
+    for a, b in sorted(spans, key=lambda sp: (sp[0] - sp[1], sp[0])):
+        try:
+            return json.loads(text[a:b], strict=False)
+        except ValueError as e:
+            if first_err is None or a == spans[0][0]:
+                first_err = e
+    raise first_err  # type: ignore[misc]
+
 
-def chat_json(messages: List[Dict[str, Any]], *, model: str | None = None) -> Dict[str, Any]:
+def _cache_lookup(messages: List[Dict[str, Any]], model: str | None, cache: bool | None) -> Tuple[Any, str | None, str | None]:
     """
-    调用 chat_once，然后解析 JSON；解析失败报错
+    返回 (缓存对象, key, 命中的原始输出)；未启用缓存或本次绕过时返回 (None, None, None)。
     """
-    raw = chat_once(messages, model=model)
-    js = _extract_json_object(raw)
-    return json.loads(js)
+    enabled = bool(getattr(settings, "LLM_CACHE_ENABLED", True)) if cache is None else bool(cache)
+    c = get_cache()
+    if not enabled:
+        c.note_bypass()
+        return None, None, None
+    key = cache_key(
+        messages,
+        model=model or settings.MODEL,
+        temperature=settings.TEMPERATURE,
+        top_p=settings.TOP_P,
+        max_tokens=settings.MAX_TOKENS,
+        base_url=str(settings.BASE_URL or ""),
+        api_key=str(settings.DASHSCOPE_API_KEY or ""),
+    )
+    return c, key, c.get(key)
 
-def embed_texts(texts: List[str]) -> np.ndarray:
+
+def _parse_model_json(raw: str) -> Dict[str, Any]:
+    """
+    解析模型输出中的 JSON：先原样解析，失败后本地修复（围栏、尾逗号、截断的括号等）再解析。
+    """
+    try:
+        return _load_json_object(raw)
+    except ValueError:
+        pass
+    fixed = repair_json(raw)
+    if fixed is None:
+        raise ValueError("No JSON object found in model output.")
+    return json.loads(fixed, strict=False)
+
+
+_REPAIR_SYSTEM = (
+    "你是 JSON 修复器。用户给出一段本应是 JSON 对象、但无法解析的模型输出及解析错误。"
+    "请只修正语法（引号、逗号、括号、转义等），不要增删或改写内容，"
+    "只输出修复后的完整 JSON 对象，不要任何解释或代码围栏。"
+)
+
+
+def _repair_messages(raw: str, err: Exception) -> List[Dict[str, Any]]:
+    return [
+        {"role": "system", "content": _REPAIR_SYSTEM},
+        {"role": "user", "content": f"解析错误：{err}\n\n待修复的输出：\n{raw}"},
+    ]
+
+
+def _json_attempts(max_attempts: int | None) -> Tuple[int, int]:
+    attempts = int(max_attempts if max_attempts is not None else getattr(settings, "LLM_JSON_MAX_ATTEMPTS", 2))
+    return max(1, attempts), max(0, int(getattr(settings, "LLM_JSON_REPAIR_CALLS", 1)))
+
+
+def _repair_with_model(raw: str, err: Exception, model: str | None, repair_calls: int) -> Tuple[Dict[str, Any] | None, str, Exception]:
+    """
+    本地修复失败后，用简短的“修复这段 JSON”请求让模型只改语法；返回 (结果或 None, 原始输出, 最后的错误)。
     """
-    返回 shape=(n, dim) 的 float32 numpy 数组
+    for _ in range(repair_calls):
+        try:
+            fixed_raw = chat_once(_repair_messages(raw, err), model=model)
+            return _parse_model_json(fixed_raw), fixed_raw, err
+        except ValueError as e:
+            err = e
+    return None, raw, err
+
+
+async def _arepair_with_model(raw: str, err: Exception, model: str | None, repair_calls: int) -> Tuple[Dict[str, Any] | None, str, Exception]:
+    for _ in range(repair_calls):
+        try:
+            fixed_raw = await achat_once(_repair_messages(raw, err), model=model)
+            return _parse_model_json(fixed_raw), fixed_raw, err
+        except ValueError as e:
+            err = e
+    return None, raw, err
+
+
+def chat_json(
+    messages: List[Dict[str, Any]],
+    *,
+    model: str | None = None,
+    cache: bool | None = None,
+    max_attempts: int | None = None,
+) -> Dict[str, Any]:
+    """
+    调用 chat_once，然后解析 JSON；解析失败时依次：
+    1) 本地修复（围栏、尾逗号、被截断的字符串 / 括号等）
+    2) 至多 LLM_JSON_REPAIR_CALLS 次简短的“修复这段 JSON”请求（只改语法，不重新生成内容）
+    3) 重新生成，总共至多 max_attempts 次（默认 LLM_JSON_MAX_ATTEMPTS），仍失败则抛出最后的解析错误
+    重试只发生在这一层，调用方的检索结果无需重算。
+    cache：None 按 settings.LLM_CACHE_ENABLED；False 本次绕过缓存。只缓存能解析成 JSON 的输出，
+    因此解析失败后的重试不会拿到同一个坏结果。
+    """
+    c, key, raw = _cache_lookup(messages, model, cache)
+    if raw is not None:
+        return _parse_model_json(raw)
+    attempts, repair_calls = _json_attempts(max_attempts)
+    err: Exception = ValueError("No JSON object found in model output.")
+    for _ in range(attempts):
+        raw = chat_once(messages, model=model)
+        try:
+            out = _parse_model_json(raw)
+        except ValueError as e:
+            out, raw, err = _repair_with_model(raw, e, model, repair_calls)
+        if out is not None:
+            if c is not None:
+                c.put(key, raw, meta={"model": model or settings.MODEL})
+            return out
+    raise err
+
+
+def chat_json_stream(
+    messages: List[Dict[str, Any]],
+    *,
+    model: str | None = None,
+    on_field: Callable[[Tuple[Any, ...], Any], None] | None = None,
+    max_depth: int = 2,
+    cache: bool | None = None,
+    max_attempts: int | None = None,
+) -> Dict[str, Any]:
+    """
+    流式版 chat_json：边接收边增量解析，每个闭合的字段（深度 <= max_depth）立即回调 on_field(path, value)，
+    例如 (("overall",), {...})、(("labels", 0), {...})，UI 可提前渲染部分结果。
+    输出结构出错（如尾逗号）时停止回调、读完剩余输出；结构出错或 JSON 不完整（如被 max_tokens 截断）时
+    按 chat_json 的顺序处理：本地修复 -> 请求模型修复 -> 仍失败才重新生成。
+    on_field 抛出异常会直接中止。缓存规则同 chat_json（命中时按同样顺序回放字段）。
+    """
+    c, key, cached = _cache_lookup(messages, model, cache)
+
+    def _consume(pieces: Iterator[str], parser: IncrementalJSONParser, parts: List[str]) -> None:
+        for piece in pieces:
+            parts.append(piece)
+            for path, value in parser.feed(piece):
+                if on_field is not None:
+                    on_field(path, value)
+            if parser.done:
+                break
+
+    if cached is not None:
+        # 缓存的是 chat_json / 本函数修复前的原始输出：增量解析不了时按 chat_json 的方式本地修复后解析
+        parser = IncrementalJSONParser(max_depth=max_depth)
+        try:
+            _consume(iter([cached]), parser, [])
+            return parser.close()
+        except JSONStreamError:
+            return _parse_model_json(cached)
+
+    attempts, repair_calls = _json_attempts(max_attempts)
+    err: Exception = ValueError("No JSON object found in model output.")
+    for _ in range(attempts):
+        parser = IncrementalJSONParser(max_depth=max_depth)
+        parts: List[str] = []
+        stream = chat_stream(messages, model=model)
+        stream_err: JSONStreamError | None = None
+        try:
+            _consume(stream, parser, parts)
+        except JSONStreamError as e:
+            stream_err = e  # 结构错误：不再增量解析，读完整段输出再修复
+            parts.extend(stream)
+        finally:
+            stream.close()  # 提前结束 / 出错时断开连接，停止生成
+        raw = "".join(parts)
+        try:
+            if stream_err is not None:
+                raise stream_err
+            out = parser.close()
+        except JSONStreamError as e:
+            try:
+                out = _parse_model_json(raw)
+            except ValueError:
+                out, raw, err = _repair_with_model(raw, e, model, repair_calls)
+        if out is not None:
+            if c is not None:
+                c.put(key, raw, meta={"model": model or settings.MODEL})
+            return out
+    raise err
+
+
+async def achat_json(
+    messages: List[Dict[str, Any]],
+    *,
+    model: str | None = None,
+    cache: bool | None = None,
+    max_attempts: int | None = None,
+) -> Dict[str, Any]:
+    """
+    chat_json 的异步版本（走 achat_once，受全局并发上限约束；修复 / 重试与缓存规则同 chat_json）
+    """
+    c, key, raw = _cache_lookup(messages, model, cache)
+    if raw is not None:
+        return _parse_model_json(raw)
+    attempts, repair_calls = _json_attempts(max_attempts)
+    err: Exception = ValueError("No JSON object found in model output.")
+    for _ in range(attempts):
+        raw = await achat_once(messages, model=model)
+        try:
+            out = _parse_model_json(raw)
+        except ValueError as e:
+            out, raw, err = await _arepair_with_model(raw, e, model, repair_calls)
+        if out is not None:
+            if c is not None:
+                c.put(key, raw, meta={"model": model or settings.MODEL})
+            return out
+    raise err
+
+# -----------------------------
+# Embedding 后端（可插拔）：默认走 OpenAI 兼容接口；离线/压测可切换为本地确定性后端
+# -----------------------------
+class EmbeddingBackend:
+    """
+    Embedding 后端接口：embed(texts) -> shape=(n, dim) 的 float32 数组。
+    """
+    name = "base"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        """
+        异步接口：默认在线程池中执行 embed（本地后端无网络等待，不占用事件循环）。
+        """
+        return await asyncio.to_thread(self.embed, texts)
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """
+    OpenAI 兼容接口（DashScope text-embedding-v4 等）。
     text-embedding-v4 文档提示最大行数 10，所以这里按批次切分 :contentReference[oaicite:2]{index=2}
     """
-    client = get_client()
+    name = "openai"
 
-    all_vecs: List[List[float]] = []
-    bs = max(1, int(getattr(settings, "EMBED_BATCH", 10)))
+    def embed(self, texts: List[str]) -> np.ndarray:
+        client = get_client()
 
-    for i in range(0, len(texts), bs):
-        batch = texts[i:i + bs]
-        resp = client.embeddings.create(
-            model=settings.EMBED_MODEL,
-            input=batch,
-            dimensions=settings.EMBED_DIM,
-            encoding_format="float"
-        )
-        # OpenAI兼容返回：resp.data[j].embedding
-        for item in resp.data:
-            all_vecs.append(item.embedding)
+        all_vecs: List[List[float]] = []
+        bs = max(1, int(getattr(settings, "EMBED_BATCH", 10)))
+
+        for i in range(0, len(texts), bs):
+            batch = texts[i:i + bs]
+            resp = _call_limited("embed", sum(estimate_tokens(t) for t in batch), lambda: client.embeddings.create(
+                model=settings.EMBED_MODEL,
+                input=batch,
+                dimensions=settings.EMBED_DIM,
+                encoding_format="float"
+            ))
+            # OpenAI兼容返回：resp.data[j].embedding
+            for item in resp.data:
+                all_vecs.append(item.embedding)
+
+        arr = np.array(all_vecs, dtype=np.float32)
+        return arr
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        # 各批次并发请求（受全局并发上限约束），结果按批次顺序拼接
+        client = get_async_client()
+        bs = max(1, int(getattr(settings, "EMBED_BATCH", 10)))
 
-    arr = np.array(all_vecs, dtype=np.float32)
-    return arr
+        async def _batch(batch: List[str]) -> List[List[float]]:
+            async with llm_semaphore():
+                resp = await _acall_limited("embed", sum(estimate_tokens(t) for t in batch), lambda: client.embeddings.create(
+                    model=settings.EMBED_MODEL,
+                    input=batch,
+                    dimensions=settings.EMBED_DIM,
+                    encoding_format="float"
+                ))
+            return [item.embedding for item in resp.data]
+
+        parts = await asyncio.gather(*[_batch(texts[i:i + bs]) for i in range(0, len(texts), bs)])
+        return np.array([v for part in parts for v in part], dtype=np.float32)
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    本地确定性 embedding：字符 n-gram 经 64 位哈希投影到 dim 维（signed feature hashing），
+    词频取 log1p 后 L2 归一化。无网络、无随机性、同一文本在任意机器上结果一致；
+    语义能力远弱于真实模型，只用于基准测试 / CI 驱动 add_files、search 的规模化路径。
+    """
+    name = "local_hash"
+
+    _PRIME = np.uint64(1099511628211)
+    _MIX = np.uint64(0xFF51AFD7ED558CCD)
+
+    def __init__(self, *, dim: int | None = None, ngrams: tuple = (1, 2, 3)) -> None:
+        self.dim = dim
+        self.ngrams = tuple(int(n) for n in ngrams)
+
+    def _embed_one(self, text: str, dim: int) -> np.ndarray:
+        vec = np.zeros(dim, dtype=np.float64)
+        cps = np.frombuffer((text or "").lower().encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        for n in self.ngrams:
+            m = cps.shape[0] - n + 1
+            if m <= 0:
+                continue
+            h = np.full(m, np.uint64(14695981039346656037) + np.uint64(n), dtype=np.uint64)
+            for k in range(n):
+                h = (h ^ cps[k:k + m]) * self._PRIME
+            h ^= h >> np.uint64(33)
+            h *= self._MIX
+            h ^= h >> np.uint64(33)
+            idx = (h % np.uint64(dim)).astype(np.int64)
+            sign = 1.0 - 2.0 * (h >> np.uint64(63)).astype(np.float64)
+            vec += np.bincount(idx, weights=sign, minlength=dim)
+        vec = np.sign(vec) * np.log1p(np.abs(vec))
+        norm = float(np.linalg.norm(vec))
+        return (vec / norm if norm > 0 else vec).astype(np.float32)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        dim = int(self.dim or getattr(settings, "EMBED_DIM", 1024))
+        if not texts:
+            return np.zeros((0, dim), dtype=np.float32)
+        with np.errstate(over="ignore"):
+            return np.vstack([self._embed_one(t, dim) for t in texts])
+
+
+_EMBED_BACKENDS: Dict[str, Callable[[], EmbeddingBackend]] = {
+    "openai": OpenAIEmbeddingBackend,
+    "local_hash": HashingEmbeddingBackend,
+}
+_embed_backend_override: EmbeddingBackend | None = None
+
+
+def register_embedding_backend(name: str, factory: Callable[[], EmbeddingBackend]) -> None:
+    """
+    注册自定义后端，之后可通过 settings.EMBED_BACKEND = name 选用。
+    """
+    _EMBED_BACKENDS[name] = factory
+
+
+def set_embedding_backend(backend: EmbeddingBackend | str | None) -> None:
+    """
+    进程内强制使用某个后端（实例或已注册名称）；传 None 恢复按 settings.EMBED_BACKEND 选择。
+    """
+    global _embed_backend_override
+    if isinstance(backend, str):
+        backend = _EMBED_BACKENDS[backend]()
+    _embed_backend_override = backend
+
+
+def get_embedding_backend() -> EmbeddingBackend:
+    if _embed_backend_override is not None:
+        return _embed_backend_override
+    name = str(getattr(settings, "EMBED_BACKEND", "openai") or "openai")
+    factory = _EMBED_BACKENDS.get(name)
+    if factory is None:
+        raise ValueError(f"未知的 EMBED_BACKEND：{name!r}（可选：{sorted(_EMBED_BACKENDS)}）")
+    return factory()
+
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """
+    返回 shape=(n, dim) 的 float32 numpy 数组（由当前 embedding 后端计算）
+    """
+    return get_embedding_backend().embed(texts)
 
 
 def embed_query(text: str) -> np.ndarray:
     return embed_texts([text])[0]
 
-def get_client() -> OpenAI:
-    #st.markdown(str(settings.DASHSCOPE_API_KEY))
-    # OpenAI 兼容：只需要 api_key + base_url
-    return OpenAI(
-        api_key=settings.DASHSCOPE_API_KEY,
-        base_url=settings.BASE_URL,
+
+async def aembed_texts(texts: List[str]) -> np.ndarray:
+    """
+    embed_texts 的异步版本
+    """
+    return await get_embedding_backend().aembed(texts)
+
+# -----------------------------
+# 客户端池：按 (api_key, base_url) 复用进程级 OpenAI 客户端（连接池 + HTTP keep-alive），
+# 避免每次调用都新建连接池、重新握手 TLS
+# -----------------------------
+_clients: Dict[Tuple[str, str], OpenAI] = {}
+_clients_lock = threading.Lock()
+
+
+def _client_key() -> Tuple[str, str]:
+    return str(settings.DASHSCOPE_API_KEY or ""), str(settings.BASE_URL or "")
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(getattr(settings, "LLM_HTTP_MAX_CONNECTIONS", 32)),
+        max_keepalive_connections=int(getattr(settings, "LLM_HTTP_MAX_KEEPALIVE", 16)),
+        keepalive_expiry=float(getattr(settings, "LLM_HTTP_KEEPALIVE_EXPIRY", 60.0)),
     )
 
 
+def _http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        float(getattr(settings, "LLM_HTTP_TIMEOUT", 120.0)),
+        connect=float(getattr(settings, "LLM_HTTP_CONNECT_TIMEOUT", 10.0)),
+    )
+
+
+def get_client() -> OpenAI:
+    # OpenAI 兼容：只需要 api_key + base_url；同一组合在进程内共享一个客户端（线程安全）
+    key = _client_key()
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OpenAI(
+                api_key=key[0],
+                base_url=key[1],
+                timeout=_http_timeout(),
+                max_retries=0,  # 重试由 _call_limited / _acall_limited 负责（需让限流器看到每次 429）
+                http_client=httpx.Client(limits=_http_limits(), timeout=_http_timeout()),
+            )
+            _clients[key] = client
+        return client
+
+
+# 异步客户端与并发信号量都绑定事件循环，按循环分别维护（循环结束后随之回收）
+_loop_state: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+
+
+def _state_for_loop() -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        st = _loop_state.get(loop)
+        if st is None:
+            st = _loop_state[loop] = {"clients": {}, "semaphore": None, "limit": None}
+        return st
+
+
+def llm_semaphore() -> asyncio.Semaphore:
+    """
+    当前事件循环内所有异步 LLM / embedding 请求共享的并发上限（settings.LLM_MAX_CONCURRENCY）。
+    上层可以放心 gather 大量 achat_* / aembed_texts 调用，同时在途请求数不会超过该值。
+    """
+    st = _state_for_loop()
+    limit = max(1, int(getattr(settings, "LLM_MAX_CONCURRENCY", 8)))
+    if st["semaphore"] is None or st["limit"] != limit:
+        st["semaphore"] = asyncio.Semaphore(limit)
+        st["limit"] = limit
+    return st["semaphore"]
+
+
+def get_async_client() -> AsyncOpenAI:
+    """
+    get_client 的异步版本：同一事件循环内按 (api_key, base_url) 复用 AsyncOpenAI 客户端。
+    """
+    key = _client_key()
+    clients = _state_for_loop()["clients"]
+    client = clients.get(key)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=key[0],
+            base_url=key[1],
+            timeout=_http_timeout(),
+            max_retries=0,  # 重试由 _call_limited / _acall_limited 负责（需让限流器看到每次 429）
+            http_client=httpx.AsyncClient(limits=_http_limits(), timeout=_http_timeout()),
+        )
+        clients[key] = client
+    return client
+
+
+# 投递到当前事件循环的关闭任务（持有引用，避免任务未完成就被回收）
+_closing_tasks: "set[asyncio.Task]" = set()
+
+
+def _close_async_client(loop: asyncio.AbstractEventLoop, client: AsyncOpenAI) -> None:
+    """
+    在异步客户端所属的事件循环中关闭它：循环在本线程运行时建任务，在其它线程运行时跨线程投递，
+    空闲时就地运行；循环已关闭则无法再关闭，连接随传输对象回收释放。
+    """
+    if loop.is_closed():
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    try:
+        if running is loop:
+            task = loop.create_task(client.close())
+            _closing_tasks.add(task)
+            task.add_done_callback(_closing_tasks.discard)
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+        elif running is None:
+            loop.run_until_complete(client.close())
+    except Exception:
+        pass
+
+
+def reset_clients(*, keep_current: bool = False) -> None:
+    """
+    关闭并丢弃池中的客户端；keep_current=True 时保留与当前 settings 一致的那个
+    （侧边栏应用新配置后调用，旧 key / 旧地址的连接随之释放）。
+    异步客户端在其所属事件循环中关闭（见 _close_async_client）。
+    """
+    keep = _client_key() if keep_current else None
+    with _clients_lock:
+        stale = [k for k in _clients if k != keep]
+        closing = [_clients.pop(k) for k in stale]
+        closing_async = []
+        for loop, st in list(_loop_state.items()):
+            for k in [k for k in st["clients"] if k != keep]:
+                closing_async.append((loop, st["clients"].pop(k)))
+    for c in closing:
+        try:
+            c.close()
+        except Exception:
+            pass
+    for loop, ac in closing_async:
+        _close_async_client(loop, ac)
+
+
+# -----------------------------
+# 限流 + 重试：所有请求经 utils.rate_limit 的共享配额与自适应并发；
+# 429 / 超时 / 5xx 由这里退避重试（客户端 max_retries=0），这样 AIMD 能观察到每一次 429
+# -----------------------------
+def _usage_tokens(resp: Any) -> int | None:
+    usage = getattr(resp, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+def _backoff_sec(attempt: int, e: BaseException) -> float:
+    resp = getattr(e, "response", None)
+    try:
+        retry_after = float(resp.headers.get("retry-after")) if resp is not None else None
+    except (TypeError, ValueError):
+        retry_after = None
+    if retry_after is not None:
+        return min(retry_after, 60.0)
+    return min(30.0, 0.5 * (2 ** attempt)) * (0.5 + random.random())
+
+
+def _call_limited(kind: str, est_tokens: int, call: Callable[[], Any]) -> Any:
+    attempts = int(getattr(settings, "LLM_MAX_RETRIES", 2)) + 1
+    for attempt in range(attempts):
+        try:
+            with rate_limited(kind, est_tokens) as slot:
+                resp = call()
+                slot.tokens = _usage_tokens(resp)
+                return resp
+        except Exception as e:
+            if attempt + 1 >= attempts or classify_error(e) not in ("throttled", "error"):
+                raise
+            time.sleep(_backoff_sec(attempt, e))
+
+
+@contextmanager
+def _stream_limited(kind: str, est_tokens: int, call: Callable[[], Any]) -> Iterator[Tuple[Any, Any]]:
+    """
+    流式请求版 _call_limited：建立流时同样退避重试，成功后 slot 一直持有到 with 结束（流读完或关闭），
+    期间计入 AIMD 并发；调用方在退出前把实际 token 用量写入 slot.tokens。
+    """
+    attempts = int(getattr(settings, "LLM_MAX_RETRIES", 2)) + 1
+    for attempt in range(attempts):
+        lim = rate_limited(kind, est_tokens)
+        slot = lim.__enter__()
+        try:
+            resp = call()
+        except Exception as e:
+            lim.__exit__(type(e), e, e.__traceback__)
+            if attempt + 1 >= attempts or classify_error(e) not in ("throttled", "error"):
+                raise
+            time.sleep(_backoff_sec(attempt, e))
+            continue
+        try:
+            yield resp, slot
+        except BaseException as e:
+            lim.__exit__(type(e), e, e.__traceback__)
+            raise
+        lim.__exit__(None, None, None)
+        return
+
+
+async def _acall_limited(kind: str, est_tokens: int, call: Callable[[], Any]) -> Any:
+    attempts = int(getattr(settings, "LLM_MAX_RETRIES", 2)) + 1
+    for attempt in range(attempts):
+        try:
+            async with arate_limited(kind, est_tokens) as slot:
+                resp = await call()
+                slot.tokens = _usage_tokens(resp)
+                return resp
+        except Exception as e:
+            if attempt + 1 >= attempts or classify_error(e) not in ("throttled", "error"):
+                raise
+            await asyncio.sleep(_backoff_sec(attempt, e))
+
+
 def chat_once(messages: List[Dict[str, Any]], *, model: str | None = None) -> str:
     client = get_client()
-    resp = client.chat.completions.create(
+    resp = _call_limited("chat", estimate_messages_tokens(messages), lambda: client.chat.completions.create(
         model=model or settings.MODEL,
         messages=messages,
         temperature=settings.TEMPERATURE,
         top_p=settings.TOP_P,
         max_tokens=settings.MAX_TOKENS,
-    )
+    ))
+    return resp.choices[0].message.content
+
+
+def chat_stream(messages: List[Dict[str, Any]], *, model: str | None = None) -> Iterator[str]:
+    """
+    流式对话：逐段产出模型输出文本；生成器被 close() 时同时关闭底层 HTTP 流。
+    建立流时 429 / 超时 / 5xx 退避重试；限流 slot 持有到流读完或关闭（计入 AIMD 并发），再按实际输出结算 token。
+    """
+    client = get_client()
+    est = estimate_messages_tokens(messages)
+    with _stream_limited("chat", est, lambda: client.chat.completions.create(
+        model=model or settings.MODEL,
+        messages=messages,
+        temperature=settings.TEMPERATURE,
+        top_p=settings.TOP_P,
+        max_tokens=settings.MAX_TOKENS,
+        stream=True,
+    )) as (stream, slot):
+        n_out = 0
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                piece = chunk.choices[0].delta.content
+                if piece:
+                    n_out += estimate_tokens(piece)
+                    yield piece
+        finally:
+            stream.close()
+            slot.tokens = est + n_out
+
+
+async def achat_once(messages: List[Dict[str, Any]], *, model: str | None = None) -> str:
+    """
+    chat_once 的异步版本：在 llm_semaphore 限制下发起请求，可与其它调用并发。
+    """
+    client = get_async_client()
+    async with llm_semaphore():
+        resp = await _acall_limited("chat", estimate_messages_tokens(messages), lambda: client.chat.completions.create(
+            model=model or settings.MODEL,
+            messages=messages,
+            temperature=settings.TEMPERATURE,
+            top_p=settings.TOP_P,
+            max_tokens=settings.MAX_TOKENS,
+        ))
     return resp.choices[0].message.content
 
 
@@ -0,0 +1,275 @@
+# llm_cache.py
+# LLM 响应缓存：按 (model, temperature, top_p, max_tokens, messages) 的内容哈希寻址，
+# 内存 LRU + 磁盘持久化（TTL 过期、总大小超限按最久未用淘汰），重复的识别 / 测定请求直接复用结果
+from __future__ import annotations
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from utils import settings
+
+
+def cache_key(
+    messages: List[Dict[str, Any]],
+    *,
+    model: str,
+    temperature: float,
+    top_p: float,
+    max_tokens: int,
+    base_url: str = "",
+    api_key: str = "",
+) -> str:
+    """
+    请求内容的 sha256（JSON 规范化后计算，字段顺序不影响结果）。
+    base_url / api_key 参与计算（api_key 只取其哈希），切换服务商或模拟服务后不会命中其它端点的缓存。
+    """
+    payload = {
+        "base_url": str(base_url or "").rstrip("/"),
+        "provider": hashlib.sha256(str(api_key or "").encode("utf-8")).hexdigest()[:16],
+        "model": str(model),
+        "temperature": float(temperature),
+        "top_p": float(top_p),
+        "max_tokens": int(max_tokens),
+        "messages": messages,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    两级缓存（线程安全）：
+    - 内存：最近 mem_items 条，LRU
+    - 磁盘：disk_dir/<key[:2]>/<key>.json，写入采用 tmp + os.replace；
+      读取时检查 TTL（过期即删除），命中时更新 mtime，总大小超过 max_mb 时按 mtime 淘汰到 90%
+    disk_dir 为空时只用内存。
+    """
+
+    def __init__(
+        self,
+        *,
+        disk_dir: Optional[str] = None,
+        mem_items: int = 512,
+        ttl_sec: float = 7 * 86400,
+        max_mb: float = 256,
+    ) -> None:
+        self.disk_dir = os.path.abspath(disk_dir) if disk_dir else None
+        self.mem_items = max(0, int(mem_items))
+        self.ttl_sec = float(ttl_sec)
+        self.max_bytes = int(float(max_mb) * 1024 * 1024)
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (created, value)
+        self._lock = threading.Lock()
+        self._disk_bytes: Optional[int] = None  # 首次写入时扫描得到，之后增量维护
+        self.hits_mem = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.puts = 0
+        self.bypass = 0
+        self.evictions = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir or "", key[:2], f"{key}.json")
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl_sec > 0 and time.time() - created > self.ttl_sec
+
+    def _mem_put(self, key: str, created: float, value: str) -> None:
+        if self.mem_items <= 0:
+            return
+        self._mem[key] = (created, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_items:
+            self._mem.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None:
+                if not self._expired(item[0]):
+                    self._mem.move_to_end(key)
+                    self.hits_mem += 1
+                    return item[1]
+                self._mem.pop(key, None)
+
+            if self.disk_dir:
+                p = self._path(key)
+                try:
+                    with open(p, "r", encoding="utf-8") as f:
+                        rec = json.load(f)
+                except (OSError, ValueError):
+                    rec = None
+                if rec is not None:
+                    if self._expired(float(rec.get("created", 0))):
+                        self._remove_file(p)
+                    else:
+                        try:
+                            os.utime(p)  # 最近使用时间，供按大小淘汰
+                        except OSError:
+                            pass
+                        self._mem_put(key, float(rec["created"]), rec["value"])
+                        self.hits_disk += 1
+                        return rec["value"]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: str, *, meta: Optional[Dict[str, Any]] = None) -> None:
+        created = time.time()
+        with self._lock:
+            self.puts += 1
+            self._mem_put(key, created, value)
+            if not self.disk_dir:
+                return
+            p = self._path(key)
+            data = json.dumps({"created": created, "meta": meta or {}, "value": value}, ensure_ascii=False)
+            try:
+                os.makedirs(os.path.dirname(p), exist_ok=True)
+                old = os.path.getsize(p) if os.path.exists(p) else 0
+                tmp = f"{p}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(tmp, p)
+            except OSError:
+                return  # 磁盘缓存只是加速手段，写失败不影响调用
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_bytes()
+            else:
+                self._disk_bytes += len(data.encode("utf-8")) - old
+            if self.max_bytes > 0 and self._disk_bytes > self.max_bytes:
+                self._evict_disk()
+
+    def note_bypass(self) -> None:
+        with self._lock:
+            self.bypass += 1
+
+    def _files(self) -> List[tuple]:
+        out: List[tuple] = []
+        if not self.disk_dir or not os.path.isdir(self.disk_dir):
+            return out
+        for sub in os.listdir(self.disk_dir):
+            d = os.path.join(self.disk_dir, sub)
+            if not os.path.isdir(d):
+                continue
+            for fn in os.listdir(d):
+                if not fn.endswith(".json"):
+                    continue
+                p = os.path.join(d, fn)
+                try:
+                    stt = os.stat(p)
+                except OSError:
+                    continue
+                out.append((stt.st_mtime, stt.st_size, p))
+        return out
+
+    def _scan_bytes(self) -> int:
+        return sum(size for _, size, _ in self._files())
+
+    def _remove_file(self, p: str) -> int:
+        try:
+            size = os.path.getsize(p)
+            os.remove(p)
+        except OSError:
+            return 0
+        if self._disk_bytes is not None:
+            self._disk_bytes -= size
+        return size
+
+    def _evict_disk(self) -> None:
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        target = int(self.max_bytes * 0.9)
+        now = time.time()
+        for mtime, size, p in files:
+            if total <= target and not (self.ttl_sec > 0 and now - mtime > self.ttl_sec):
+                continue
+            try:
+                os.remove(p)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+        self._disk_bytes = total
+
+    def clear(self) -> None:
+        """
+        清空内存与磁盘缓存。
+        """
+        with self._lock:
+            self._mem.clear()
+            for _, _, p in self._files():
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            self._disk_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits_mem + self.hits_disk + self.misses
+            return {
+                "disk_dir": self.disk_dir,
+                "mem_items": len(self._mem),
+                "disk_mb": round((self._disk_bytes or 0) / 1024 / 1024, 2) if self._disk_bytes is not None else None,
+                "hits_mem": self.hits_mem,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "puts": self.puts,
+                "bypass": self.bypass,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits_mem + self.hits_disk) / lookups, 3) if lookups else None,
+            }
+
+
+_cache: Optional[LLMCache] = None
+_cache_conf: Optional[tuple] = None
+_cache_lock = threading.Lock()
+
+
+def is_mock_endpoint(base_url: Optional[str] = None) -> bool:
+    """
+    BASE_URL 是否为本地模拟服务（“本地模拟（压测）”预设或回环地址）：模拟输出不写入磁盘缓存。
+    """
+    url = str(settings.BASE_URL if base_url is None else base_url or "").rstrip("/")
+    if url and url == str(getattr(settings, "MOCK_BASE_URL", "") or "").rstrip("/"):
+        return True
+    return (urlparse(url).hostname or "") in ("127.0.0.1", "localhost", "::1")
+
+
+def _default_dir() -> str:
+    if is_mock_endpoint():
+        return ""  # 只用内存缓存，进程结束即丢弃
+    d = str(getattr(settings, "LLM_CACHE_DIR", "") or "")
+    if d:
+        return d
+    return os.path.join(str(getattr(settings, "OUTPUT_DIR", "output") or "output"), "llm_cache")
+
+
+def get_cache() -> LLMCache:
+    """
+    进程级共享缓存；OUTPUT_DIR / LLM_CACHE_* / BASE_URL（模拟服务只用内存）变化后自动按新配置重建（统计随之清零）。
+    """
+    global _cache, _cache_conf
+    conf = (
+        _default_dir(),
+        int(getattr(settings, "LLM_CACHE_MEM_ITEMS", 512)),
+        float(getattr(settings, "LLM_CACHE_TTL_SEC", 7 * 86400)),
+        float(getattr(settings, "LLM_CACHE_MAX_MB", 256)),
+    )
+    with _cache_lock:
+        if _cache is None or _cache_conf != conf:
+            _cache = LLMCache(disk_dir=conf[0], mem_items=conf[1], ttl_sec=conf[2], max_mb=conf[3])
+            _cache_conf = conf
+        return _cache
+
+
+def cache_stats() -> Dict[str, Any]:
+    """
+    当前缓存的命中统计（内存 / 磁盘命中、未命中、绕过次数、命中率）。
+    """
+    return get_cache().stats()
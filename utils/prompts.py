@@ -1,7 +1,10 @@
 # prompts.py
 # 整套系统提示词工程
 from __future__ import annotations
-from typing import List, Dict, Any
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils import settings
+from utils.rate_limit import estimate_tokens
 
 TAXONOMY = [
     {"id": "L1_PRICE_WAR", "name": "价格战主导", "definition": "持续降价/补贴/金融让利为主要竞争手段，导致行业价格下行与利润挤压。"},
@@ -15,25 +18,98 @@ TAXONOMY = [
 ]
 
 
-def build_identify_messages(user_query: str, evidence_hits: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+# -----------------------------
+# 证据打包：按 token 预算（离线估算）装入得分最高的证据，替代固定字符截断
+# -----------------------------
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    按估算 token 数截断文本（中日韩字符约 1 token/字，其余约 4 字符/token），截断处加 “…”。
+    """
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)  # 二分找最长的、估算不超过 max_tokens - 1 的前缀
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens - 1:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + "…"
+
+
+def evidence_budget(kind: str, *prompt_parts: str, scale: int = 1) -> Tuple[int, Optional[int]]:
+    """
+    返回 (证据总预算, 单条上限) token 数：取 settings.EVIDENCE_TOKEN_BUDGET[kind] × scale（多年份合并时按年份数放大），
+    并保证 提示词 + 证据 + MAX_TOKENS 不超过 MODEL_CONTEXT_TOKENS。
+    """
+    budget = int((getattr(settings, "EVIDENCE_TOKEN_BUDGET", {}) or {}).get(kind, 4000)) * max(1, int(scale))
+    hit_max = (getattr(settings, "EVIDENCE_HIT_MAX_TOKENS", {}) or {}).get(kind)
+    context = int(getattr(settings, "MODEL_CONTEXT_TOKENS", 131072))
+    fixed = sum(estimate_tokens(p) for p in prompt_parts) + int(getattr(settings, "MAX_TOKENS", 4096)) + 256
+    return max(0, min(budget, context - fixed)), (int(hit_max) if hit_max else None)
+
+
+def pack_evidence(
+    hits: List[Dict[str, Any]],
+    fmt: Callable[[int, Dict[str, Any], str], str],
+    *,
+    budget_tokens: int,
+    hit_max_tokens: Optional[int] = None,
+    min_hit_tokens: int = 40,
+) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    按得分从高到低装入证据，直到用完 budget_tokens：
+    - 每条先按 hit_max_tokens 截断，剩余预算不足整条时截断到剩余预算；剩余不足 min_hit_tokens 时停止
+    - 文本相同的命中只保留得分最高的一条（父段展开后多个子块可能指向同一父段）
+    fmt(i, hit, text) 生成单条证据文本（含编号与 chunk_id 等头部）。
+    返回 (证据行列表, 统计)，统计含 budget_tokens / used_tokens / hits_in / hits_packed / hits_truncated / hits_dropped。
+    """
+    ordered = sorted(hits, key=lambda h: float(h.get("score", 0) or 0), reverse=True)
+    lines: List[str] = []
+    seen: set = set()
+    used = 0
+    truncated = 0
+    for h in ordered:
+        text = (h.get("text") or "").replace("\n", " ").strip()
+        if text in seen:
+            continue
+        head_cost = estimate_tokens(fmt(len(lines) + 1, h, ""))
+        room = budget_tokens - used - head_cost
+        if room < min_hit_tokens:
+            break
+        cap = min(room, hit_max_tokens) if hit_max_tokens else room
+        body = truncate_to_tokens(text, cap)
+        if body != text:
+            truncated += 1
+        line = fmt(len(lines) + 1, h, body)
+        lines.append(line)
+        seen.add(text)
+        used += estimate_tokens(line)
+    info = {
+        "budget_tokens": int(budget_tokens),
+        "used_tokens": int(used),
+        "hits_in": len(hits),
+        "hits_packed": len(lines),
+        "hits_truncated": truncated,
+        "hits_dropped": len(hits) - len(lines),
+    }
+    return lines, info
+
+
+def build_identify_messages(
+    user_query: str,
+    evidence_hits: List[Dict[str, Any]],
+    *,
+    pack_info: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, str]]:
     """
     evidence_hits: rag.search() 返回的 list[ {chunk_id, doc_id, score, text} ]
+    pack_info: 传入 dict 时写入证据打包统计（预算 / 实际用量 / 装入条数等）
     """
     taxonomy_text = "\n".join([f"- {x['id']}：{x['name']}（{x['definition']}）" for x in TAXONOMY])
 
-    # 证据块（可为空）
-    if evidence_hits:
-        ev_lines = []
-        for i, h in enumerate(evidence_hits, 1):
-            snippet = (h["text"] or "").replace("\n", " ").strip()
-            ev_lines.append(
-                f"[{i}] chunk_id={h['chunk_id']} doc_id={h['doc_id']} score={h['score']:.4f}\n"
-                f"TEXT: {snippet}\n"
-            )
-        evidence_text = "\n".join(ev_lines)
-    else:
-        evidence_text = "（无检索结果）"
-
     system = f"""
     你是一名“新能源汽车行业竞争与产业组织”分析助手，任务是识别材料所反映的“内卷式竞争”特征。
     你会收到：用户问题 + RAG检索到的证据片段（可能为空）。
@@ -69,6 +145,24 @@ def build_identify_messages(user_query: str, evidence_hits: List[Dict[str, Any]]
     }}
     """
 
+    # 证据块（可为空）：按 token 预算装入得分最高的证据
+    if evidence_hits:
+        budget, hit_max = evidence_budget("identify", system, user_query)
+        ev_lines, info = pack_evidence(
+            evidence_hits,
+            lambda i, h, t: (
+                f"[{i}] chunk_id={h['chunk_id']} doc_id={h['doc_id']} score={h['score']:.4f}\n"
+                f"TEXT: {t}\n"
+            ),
+            budget_tokens=budget,
+            hit_max_tokens=hit_max,
+        )
+        if pack_info is not None:
+            pack_info.update(info)
+        evidence_text = "\n".join(ev_lines)
+    else:
+        evidence_text = "（无检索结果）"
+
     user = f"""用户问题：{user_query}  RAG证据片段：{evidence_text}"""
 
     return [
@@ -76,8 +170,6 @@ def build_identify_messages(user_query: str, evidence_hits: List[Dict[str, Any]]
         {"role": "user", "content": user.strip()},
     ]
 
-from typing import List, Dict, Any
-
 # 统一把指标都压到 0-100 的强度量表（LLM 负责生成该强度）
 # direction: +1 表示越大越“内卷严重”；-1 表示越大越“缓解内卷”（计算时会做 100-x 反转）
 METRICS = [
@@ -95,83 +187,90 @@ METRICS = [
     {"key": "sales_personnel_intensity", "name": "销售人员投入强度", "direction": +1},
 ]
 
+def _year_item_schema(indent: str) -> str:
+    """
+    单个年份的输出 JSON 字段（单年 / 多年份 prompt 共用，指标键取自 METRICS）。
+    """
+    keys = ",\n".join(f'{indent}  "{m["key"]}": float' for m in METRICS)
+    return "\n".join([
+        f'{indent}"period": str,',
+        f'{indent}"time_window": {{"start": str, "end": str}},',
+        f'{indent}"metrics": {{\n{keys}\n{indent}}},',
+        f'{indent}"metric_confidence": {{\n{keys}\n{indent}}},',
+        f'{indent}"overall_confidence": float,',
+        f'{indent}"rationale": str,',
+        f'{indent}"used_evidence": [{{"chunk_id": str, "doc_id": str}}],',
+        f'{indent}"notes": [str]',
+    ])
+
+
+def _measure_system_prompt(task: str, scope_rule: str, *, multi: bool) -> str:
+    """
+    年度测定的 system prompt：角色、硬性要求、指标列表与输出结构只在这里维护，
+    multi=True 时要求按 years 数组逐年输出。
+    """
+    rules = [
+        "只输出严格 JSON，不要任何额外文字/Markdown。",
+        ("每一个年份的" if multi else "") + "每一个指标都要有数据，如果用户提供依据不足，请根据你的经验和知识分析。",
+        scope_rule,
+        "指标尽量量化：0-1 强度量表（或明确%）；并给每个指标置信度(0-1)。"
+        + ("各年份口径保持一致，便于比较趋势。" if multi else ""),
+        "为避免截断：每年 rationale <= 120字；notes 每年不超过2条、每条<=150字。" if multi
+        else "为避免截断：rationale <= 120字；notes每条<=150字。",
+        "所有confidence不可以是0.5",
+        "按照一般规律，数字无形资产投入、数字化人才投入强度、员工培训投入强度、销售人员投入强度逐年上升明显。",
+    ]
+    if multi:
+        rules.append("每年的 used_evidence 只引用该年份下给出的证据片段。")
+    rule_text = "\n".join(f"{i}) {r}" for i, r in enumerate(rules, 1))
+    metric_lines = "\n".join(f"- {m['key']}：{m['name']}" for m in METRICS)
+    if multi:
+        schema = f'{{\n  "company": str,\n  "years": [\n    {{\n{_year_item_schema("      ")}\n    }}\n  ]\n}}'
+    else:
+        schema = f'{{\n  "company": str,\n{_year_item_schema("  ")}\n}}'
+
+    return f"""你是一位资深新能源行业分析师，拥有10年以上行业研究经验。
+请基于最新可获取的行业数据，从以下十二个指标方面对新能源汽车行业进行全面的内卷程度分析。
+{task}
+
+硬性要求：
+{rule_text}
+
+需要输出的指标（{"每个年份" if multi else ""}必须全部给出）：
+{metric_lines}
+
+输出 JSON 结构必须为：
+{schema}"""
+
+
 def build_year_measure_messages(
     company: str,
     year_label: str,
     y_start: str,
     y_end: str,
     rag_hits: List[Dict[str, Any]],
+    *,
+    pack_info: Optional[Dict[str, Any]] = None,
 ) -> List[Dict[str, str]]:
-    metric_lines = "\n".join([f"- {m['key']}：{m['name']}" for m in METRICS])
+    system = _measure_system_prompt(
+        "要求生成企业在指定年份的量化指标估计，并输出严格JSON。",
+        f"输出仅限一个年份：{year_label}（{y_start}~{y_end}）。",
+        multi=False,
+    )
 
     # 强制使用 RAG：即便证据弱，也要在 rationale 里体现“参考了哪些片段的哪些要点”
-    ev_lines = []
-    for i, h in enumerate(rag_hits, 1):
-        txt = (h.get("text") or "").replace("\n", " ").strip()
-        ev_lines.append(
-            f"[{i}] chunk_id={h['chunk_id']} score={h['score']:.4f}\n"
-            f"TEXT: {txt[:260]}"
-        )
+    # 证据按 token 预算装入（单条上限见 settings.EVIDENCE_HIT_MAX_TOKENS）
+    budget, hit_max = evidence_budget("year_measure", system)
+    ev_lines, info = pack_evidence(
+        rag_hits,
+        lambda i, h, t: f"[{i}] chunk_id={h['chunk_id']} score={h['score']:.4f}\nTEXT: {t}",
+        budget_tokens=budget,
+        hit_max_tokens=hit_max,
+    )
+    if pack_info is not None:
+        pack_info.update(info)
     evidence_text = "\n".join(ev_lines) if ev_lines else "结合自己的经验和学习知识综合分析"
 
-    system = f"""
-    你是一位资深新能源行业分析师，拥有10年以上行业研究经验。
-    请基于最新可获取的行业数据，从以下十二个指标方面对新能源汽车行业进行全面的内卷程度分析。
-    要求生成企业在指定年份的量化指标估计，并输出严格JSON。
-    
-    硬性要求：
-    1) 只输出严格 JSON，不要任何额外文字/Markdown。
-    2）每一个指标都要有数据，如果用户提供依据不足，请根据你的经验和知识分析。
-    3) 输出仅限一个年份：{year_label}（{y_start}~{y_end}）。
-    4) 指标尽量量化：0-1 强度量表（或明确%）；并给每个指标置信度(0-1)。
-    5) 为避免截断：rationale <= 120字；notes每条<=150字。
-    6) 所有confidence不可以是0.5
-    7） 按照一般规律，数字无形资产投入、数字化人才投入强度、员工培训投入强度、销售人员投入强度逐年上升明显。
-
-
-    需要输出的指标（必须全部给出）：
-    {metric_lines}
-
-    输出 JSON 结构必须为：
-    {{
-      "company": str,
-      "period": str,
-      "time_window": {{"start": str, "end": str}},
-      "metrics": {{
-        "capital_intensity_level": float,
-        "capacity_utilization_pct": float,
-        "rnd_expense_ratio": float,
-        "rnd_personnel_intensity": float,
-        "digital_intangible_asset_investment_intensity": float,
-        "digital_talent_investment_intensity": float,
-        "employee_training_investment_intensity": float,
-        "high_level_human_capital_investment_intensity": float,
-        "management_expense_ratio": float,
-        "board_meeting_intensity": float,
-        "sales_expense_ratio": float,
-        "sales_personnel_intensity": float
-      }},
-      "metric_confidence": {{
-        "capital_intensity_level": float,
-        "capacity_utilization_pct": float,
-        "rnd_expense_ratio": float,
-        "rnd_personnel_intensity": float,
-        "digital_intangible_asset_investment_intensity": float,
-        "digital_talent_investment_intensity": float,
-        "employee_training_investment_intensity": float,
-        "high_level_human_capital_investment_intensity": float,
-        "management_expense_ratio": float,
-        "board_meeting_intensity": float,
-        "sales_expense_ratio": float,
-        "sales_personnel_intensity": float
-      }},
-      "overall_confidence": float,
-      "rationale": str,
-      "used_evidence": [{{"chunk_id": str, "doc_id": str}}],
-      "notes": [str]
-    }}
-    """.strip()
-
     user = f"""
     企业：{company}
     年份：{year_label}（{y_start}~{y_end}）
@@ -182,8 +281,47 @@ def build_year_measure_messages(
     return [{"role": "system", "content": system}, {"role": "user", "content": user}]
 
 
+def build_multi_year_measure_messages(
+    company: str,
+    years: List[Tuple[str, str, str]],
+    rag_hits_by_year: Dict[str, List[Dict[str, Any]]],
+    *,
+    pack_info: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> List[Dict[str, str]]:
+    """
+    多年份合并测定：一次输出 years（[(年份, 起, 止), ...]）内每一年的指标，
+    years 数组中每一项与 build_year_measure_messages 的单年 JSON 结构一致。
+    rag_hits_by_year: 年份 -> 该年检索结果；pack_info: 传入 dict 时按年份写入证据打包统计。
+    """
+    labels = [y[0] for y in years]
+    year_text = "、".join(f"{label}（{ys}~{ye}）" for label, ys, ye in years)
+    system = _measure_system_prompt(
+        "要求一次生成企业在多个年份的量化指标估计，并输出严格JSON。",
+        f"years 数组必须恰好包含以下 {len(years)} 个年份，按年份升序、每年一项：{year_text}。",
+        multi=True,
+    )
+
+    # 证据预算按年份数放大后平均分给各年（单条上限同单年模式）
+    budget, hit_max = evidence_budget("year_measure", system, scale=len(years))
+    per_year = budget // max(1, len(years))
+    blocks: List[str] = []
+    for label, ys, ye in years:
+        ev_lines, info = pack_evidence(
+            rag_hits_by_year.get(label) or [],
+            lambda i, h, t: f"[{i}] chunk_id={h['chunk_id']} score={h['score']:.4f}\nTEXT: {t}",
+            budget_tokens=per_year,
+            hit_max_tokens=hit_max,
+        )
+        if pack_info is not None:
+            pack_info[label] = info
+        evidence_text = "\n".join(ev_lines) if ev_lines else "结合自己的经验和学习知识综合分析"
+        blocks.append(f"## {label}（{ys}~{ye}）RAG证据片段：\n{evidence_text}")
+
+    user = f"企业：{company}\n年份：{'、'.join(labels)}\n" + "\n\n".join(blocks)
+
+    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+
 
-from typing import List, Dict, Any
 
 def build_policy_simulation_messages(
     *,
@@ -191,6 +329,7 @@ def build_policy_simulation_messages(
     industry_scope: str = "中国新能源汽车行业",
     time_horizon_months: int = 24,
     evidence_hits: List[Dict[str, Any]],
+    pack_info: Optional[Dict[str, Any]] = None,
 ) -> List[Dict[str, str]]:
     """Build messages for the 'policy intervention simulation & plan generation' feature.
 
@@ -201,21 +340,9 @@ def build_policy_simulation_messages(
       - 第四章 政策建议（4.1~4.3）
 
     evidence_hits: rag.search() returns list[{chunk_id, doc_id, score, text}]
+    pack_info: if a dict is given, evidence packing stats (token budget / used / packed hits) are written into it.
     """
 
-    # Evidence blocks (may be empty)
-    if evidence_hits:
-        ev_lines = []
-        for i, h in enumerate(evidence_hits, 1):
-            txt = (h.get("text") or "").replace("\n", " ").strip()
-            ev_lines.append(
-                f"[{i}] chunk_id={h.get('chunk_id')} doc_id={h.get('doc_id')} score={float(h.get('score', 0)):.4f}\n"
-                f"TEXT: {txt[:320]}\n"
-            )
-        evidence_text = "\n".join(ev_lines)
-    else:
-        evidence_text = "（无检索结果：必须在disclaimer与notes说明证据不足，并降低confidence）"
-
     system = """
     你是一名“新能源汽车产业反内卷政策仿真与方案生成”高级分析助手。
     你将收到：
@@ -356,6 +483,24 @@ def build_policy_simulation_messages(
     }
     """.strip()
 
+    # Evidence blocks (may be empty), packed into a token budget by score
+    if evidence_hits:
+        budget, hit_max = evidence_budget("policy", system, policy_input_text)
+        ev_lines, info = pack_evidence(
+            evidence_hits,
+            lambda i, h, t: (
+                f"[{i}] chunk_id={h.get('chunk_id')} doc_id={h.get('doc_id')} score={float(h.get('score', 0)):.4f}\n"
+                f"TEXT: {t}\n"
+            ),
+            budget_tokens=budget,
+            hit_max_tokens=hit_max,
+        )
+        if pack_info is not None:
+            pack_info.update(info)
+        evidence_text = "\n".join(ev_lines)
+    else:
+        evidence_text = "（无检索结果：必须在disclaimer与notes说明证据不足，并降低confidence）"
+
     user = f"""
 行业范围：{industry_scope}
 仿真时间跨度：{time_horizon_months}
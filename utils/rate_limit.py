@@ -0,0 +1,297 @@
+# rate_limit.py
+# 客户端限流：对话 / embedding 各自的请求数与 token 令牌桶（RPM / TPM）+ AIMD 自适应并发，
+# 进程内所有调用方（同步线程、异步协程）共享，429 时并发减半，顺畅时逐步加一，吞吐贴近配额
+from __future__ import annotations
+
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from utils import settings
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算 token 数：中日韩字符约 1 token/字，其余约 4 字符/token。
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if "⺀" <= ch <= "鿿" or "豈" <= ch <= "﫿")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(estimate_tokens(str(m.get("content") or "")) + 4 for m in messages)
+
+
+class TokenBucket:
+    """
+    令牌桶：每秒补充 rate 个，容量 capacity。acquire 预扣令牌并返回需要等待的秒数（允许透支，
+    之后的请求依次排队），settle 按实际用量多退少补。rate <= 0 表示不限。
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(self.rate, 1.0))
+        self._tokens = self.capacity
+        self._t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._t) * self.rate)
+        self._t = now
+
+    def reserve(self, n: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self._tokens -= min(float(n), self.capacity)
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def settle(self, delta: float) -> None:
+        """
+        delta > 0：实际用量超过预扣，补扣；delta < 0：退还。
+        """
+        if self.rate <= 0 or not delta:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - float(delta))
+
+
+class AIMDLimiter:
+    """
+    自适应并发上限（AIMD）：
+    - 每个成功请求使上限 +1/limit（约每轮并发 +1），但延迟 EWMA 超过历史最优的 latency_factor 倍时不再增加
+      （排队变长说明已到服务端容量）
+    - 429 时上限减半、超时 / 5xx 时乘 0.75；同一冷却期内只减一次，避免一批并发的 429 把上限压到底
+    """
+
+    def __init__(self, *, initial: int, min_limit: int = 1, max_limit: int = 32,
+                 latency_factor: float = 2.0, cooldown_sec: float = 2.0) -> None:
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(max(int(initial), self.min_limit), self.max_limit))
+        self.latency_factor = float(latency_factor)
+        self.cooldown_sec = float(cooldown_sec)
+        self.inflight = 0
+        self.ewma_latency: Optional[float] = None
+        self.best_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self.throttled = 0
+        self.errors = 0
+        self.ok = 0
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self.inflight < int(self.limit):
+                self.inflight += 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait(0.5)
+            self.inflight += 1
+
+    def release(self, *, outcome: str = "ok", latency: Optional[float] = None) -> None:
+        """
+        outcome："ok" | "throttled"（429）| "error"（超时 / 5xx）| "other"（其它异常，不调整上限）
+        """
+        with self._cond:
+            self.inflight -= 1
+            now = time.monotonic()
+            if outcome in ("throttled", "error"):
+                if outcome == "throttled":
+                    self.throttled += 1
+                else:
+                    self.errors += 1
+                if now - self._last_decrease >= self.cooldown_sec:
+                    factor = 0.5 if outcome == "throttled" else 0.75
+                    self.limit = max(float(self.min_limit), self.limit * factor)
+                    self._last_decrease = now
+            elif outcome == "ok":
+                self.ok += 1
+                if latency is not None:
+                    self.ewma_latency = latency if self.ewma_latency is None else 0.8 * self.ewma_latency + 0.2 * latency
+                    if self.best_latency is None or self.ewma_latency < self.best_latency:
+                        self.best_latency = self.ewma_latency
+                congested = (
+                    self.ewma_latency is not None and self.best_latency is not None
+                    and self.ewma_latency > self.latency_factor * self.best_latency
+                )
+                if not congested:
+                    self.limit = min(float(self.max_limit), self.limit + 1.0 / max(self.limit, 1.0))
+            self._cond.notify_all()
+
+
+class Slot:
+    """
+    一次受限调用：调用方在拿到响应后把实际 token 用量写入 tokens（未写入则按预估值结算）。
+    """
+
+    def __init__(self, est_tokens: int) -> None:
+        self.est_tokens = int(est_tokens)
+        self.tokens: Optional[int] = None
+
+
+class ApiLimiter:
+    """
+    一类接口（chat / embed）的组合限流：请求桶（RPM）+ token 桶（TPM）+ AIMD 并发。
+    """
+
+    def __init__(self, kind: str, *, rpm: float, tpm: float, max_concurrency: int) -> None:
+        self.kind = kind
+        self.requests = TokenBucket(rpm / 60.0, capacity=max(1.0, rpm / 60.0 * 2))
+        self.tokens = TokenBucket(tpm / 60.0, capacity=max(1.0, tpm / 60.0 * 2))
+        self.aimd = AIMDLimiter(
+            initial=max(1, int(max_concurrency) // 2),
+            min_limit=int(getattr(settings, "LLM_AIMD_MIN_CONCURRENCY", 1)),
+            max_limit=int(max_concurrency),
+            latency_factor=float(getattr(settings, "LLM_AIMD_LATENCY_FACTOR", 2.0)),
+        )
+        self.wait_sec = 0.0
+
+    def _reserve(self, est_tokens: int) -> float:
+        return max(self.requests.reserve(1), self.tokens.reserve(est_tokens))
+
+    def _finish(self, slot: Slot, outcome: str, t0: float) -> None:
+        used = slot.tokens if slot.tokens is not None else slot.est_tokens
+        self.tokens.settle(used - slot.est_tokens)
+        self.aimd.release(outcome=outcome, latency=time.monotonic() - t0)
+
+    @contextmanager
+    def limit(self, est_tokens: int) -> Iterator[Slot]:
+        slot = Slot(est_tokens)
+        self.aimd.acquire()
+        wait = self._reserve(est_tokens)
+        if wait > 0:
+            self.wait_sec += wait
+            time.sleep(wait)
+        t0 = time.monotonic()
+        outcome = "ok"
+        try:
+            yield slot
+        except BaseException as e:
+            outcome = classify_error(e)
+            raise
+        finally:
+            self._finish(slot, outcome, t0)
+
+    @asynccontextmanager
+    async def alimit(self, est_tokens: int) -> AsyncIterator[Slot]:
+        slot = Slot(est_tokens)
+        delay = 0.01
+        while not self.aimd.try_acquire():
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.2)
+        wait = self._reserve(est_tokens)
+        if wait > 0:
+            self.wait_sec += wait
+            await asyncio.sleep(wait)
+        t0 = time.monotonic()
+        outcome = "ok"
+        try:
+            yield slot
+        except BaseException as e:
+            outcome = classify_error(e)
+            raise
+        finally:
+            self._finish(slot, outcome, t0)
+
+    def stats(self) -> Dict[str, Any]:
+        a = self.aimd
+        return {
+            "concurrency_limit": round(a.limit, 2),
+            "inflight": a.inflight,
+            "ok": a.ok,
+            "throttled": a.throttled,
+            "errors": a.errors,
+            "ewma_latency_sec": round(a.ewma_latency, 3) if a.ewma_latency is not None else None,
+            "wait_sec": round(self.wait_sec, 2),
+        }
+
+
+def classify_error(e: BaseException) -> str:
+    """
+    把异常映射为 AIMD 的结果类别（按类名判断，不依赖 openai 的具体版本）。
+    """
+    name = type(e).__name__
+    status = getattr(e, "status_code", None)
+    if name == "RateLimitError" or status == 429:
+        return "throttled"
+    if name in ("APITimeoutError", "APIConnectionError", "InternalServerError") or (
+            isinstance(status, int) and status >= 500):
+        return "error"
+    return "other"
+
+
+_limiters: Dict[str, ApiLimiter] = {}
+_limiters_conf: Dict[str, tuple] = {}
+_limiters_lock = threading.Lock()
+
+
+def _conf(kind: str) -> tuple:
+    if kind == "embed":
+        return (
+            float(getattr(settings, "EMBED_RPM", 1800)),
+            float(getattr(settings, "EMBED_TPM", 1_200_000)),
+            int(getattr(settings, "EMBED_MAX_CONCURRENCY", 8)),
+        )
+    return (
+        float(getattr(settings, "CHAT_RPM", 600)),
+        float(getattr(settings, "CHAT_TPM", 1_000_000)),
+        int(getattr(settings, "LLM_MAX_CONCURRENCY", 8)),
+    )
+
+
+def get_limiter(kind: str) -> ApiLimiter:
+    """
+    进程级共享的限流器（kind 为 "chat" 或 "embed"）；配额设置变化后按新配置重建。
+    """
+    conf = _conf(kind)
+    with _limiters_lock:
+        lim = _limiters.get(kind)
+        if lim is None or _limiters_conf.get(kind) != conf:
+            lim = _limiters[kind] = ApiLimiter(kind, rpm=conf[0], tpm=conf[1], max_concurrency=conf[2])
+            _limiters_conf[kind] = conf
+        return lim
+
+
+def _enabled() -> bool:
+    return bool(getattr(settings, "LLM_RATE_LIMIT_ENABLED", True))
+
+
+@contextmanager
+def rate_limited(kind: str, est_tokens: int) -> Iterator[Slot]:
+    """
+    同步调用的限流上下文：with rate_limited("chat", n) as slot: ...; slot.tokens = 实际用量
+    """
+    if not _enabled():
+        yield Slot(est_tokens)
+        return
+    with get_limiter(kind).limit(est_tokens) as slot:
+        yield slot
+
+
+@asynccontextmanager
+async def arate_limited(kind: str, est_tokens: int) -> AsyncIterator[Slot]:
+    """
+    异步调用的限流上下文（与同步调用共享同一组配额与并发上限）。
+    """
+    if not _enabled():
+        yield Slot(est_tokens)
+        return
+    async with get_limiter(kind).alimit(est_tokens) as slot:
+        yield slot
+
+
+def limiter_stats() -> Dict[str, Any]:
+    with _limiters_lock:
+        return {k: v.stats() for k, v in _limiters.items()}
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import streamlit as st
 from utils import settings
+from utils.llm import reset_clients
 from typing import List
 
 def llm_defaults_from_settings() -> dict:
@@ -69,6 +70,9 @@ def apply_llm_active_to_settings(active: dict) -> None:
     settings.TOP_K = int(active.get("TOP_K", 10))
     settings.OUTPUT_DIR = str(active.get("OUTPUT_DIR") or "")
 
+    # 密钥 / 地址变化后，旧组合的 LLM 客户端（及其连接池）不再使用，关闭释放
+    reset_clients(keep_current=True)
+
 
 
 
@@ -11,9 +11,12 @@ LLM_KEYS = ("DASHSCOPE_API_KEY", "BASE_URL", "MODEL", "TEMPERATURE", "TOP_P",
             "MAX_TOKENS","EMBED_MODEL", "EMBED_DIM", "EMBED_BATCH",
             "RAG_STORE_DIR", "TOP_K", "OUTPUT_DIR")
 
+# 本地模拟服务（python -m benchmarks.mock_llm_server）的默认地址；使用它时 LLM 响应不写入磁盘缓存
+MOCK_BASE_URL = "http://127.0.0.1:8765/v1"
 BASE_URL_PRESETS = {
     "北京（中国大陆）": "https://dashscope.aliyuncs.com/compatible-mode/v1",
     "新加坡（国际）": "https://dashscope-intl.aliyuncs.com/compatible-mode/v1",
+    "本地模拟（压测）": MOCK_BASE_URL,
     "自定义": "__CUSTOM__",
 }
 EMBED_MODEL_PRESETS = ["text-embedding-v4", "__CUSTOM__"]
@@ -30,21 +33,90 @@ MODEL = "qwen-plus"
 TEMPERATURE = 0.2
 TOP_P = 0.9
 MAX_TOKENS = 4096
+# LLM HTTP 客户端（进程内按 api_key + base_url 复用，保持长连接）
+LLM_HTTP_MAX_CONNECTIONS = 32
+LLM_HTTP_MAX_KEEPALIVE = 16
+LLM_HTTP_KEEPALIVE_EXPIRY = 60.0  # 空闲连接保活秒数
+LLM_HTTP_TIMEOUT = 120.0  # 单次请求超时（秒）
+LLM_HTTP_CONNECT_TIMEOUT = 10.0
+LLM_MAX_RETRIES = 2  # 连接错误 / 429 / 5xx 的退避重试次数
+LLM_MAX_CONCURRENCY = 8  # 对话请求同时在途的上限（异步接口的信号量与自适应并发的上限）
+# 客户端限流（进程内共享）：按服务商配额设置每分钟请求数 / token 数；并发在 [MIN, MAX] 内按 429 与延迟自适应（AIMD）
+LLM_RATE_LIMIT_ENABLED = True
+CHAT_RPM = 600
+CHAT_TPM = 1_000_000
+EMBED_RPM = 1800
+EMBED_TPM = 1_200_000
+EMBED_MAX_CONCURRENCY = 8
+LLM_AIMD_MIN_CONCURRENCY = 1
+LLM_AIMD_LATENCY_FACTOR = 2.0  # 延迟 EWMA 超过历史最优的该倍数时停止增加并发
+# chat_json 响应缓存：内存 LRU + 磁盘（LLM_CACHE_DIR 为空时使用 OUTPUT_DIR/llm_cache）
+LLM_CACHE_ENABLED = True
+LLM_CACHE_DIR = ""
+LLM_CACHE_MEM_ITEMS = 512
+LLM_CACHE_TTL_SEC = 7 * 86400
+LLM_CACHE_MAX_MB = 256
+# chat_json 解析失败：先本地修复，再发起至多 REPAIR_CALLS 次“修复 JSON”请求，仍失败才重新生成（总共 MAX_ATTEMPTS 次）
+LLM_JSON_MAX_ATTEMPTS = 2
+LLM_JSON_REPAIR_CALLS = 1
 
 EMBED_MODEL = "text-embedding-v4"
 EMBED_DIM = 1024  # v3/v4 支持 dimensions 参数；v4 默认也可不填，但建议固定维度便于索引一致
 EMBED_BATCH = 10  # v4 文档给的最大行数是 10，
+# embedding 后端："openai"（调用 EMBED_MODEL）| "local_hash"（本地确定性哈希 n-gram，离线基准测试/CI 用，无语义能力）
+EMBED_BACKEND = "openai"
 
 # RAG 切分参数（先用字符长度近似，后面可换 token-based）
 CHUNK_SIZE = 800
 CHUNK_OVERLAP = 120
+# 父子切分（small-to-big）：>0 时先切出该长度的父段，父段内按 CHUNK_SIZE 无重叠切子块；
+# 只对子块做 embedding，检索命中后返回所属父段作为证据。0 = 关闭（单层滑窗切分）
+PARENT_CHUNK_SIZE = 0
 XLSX_MAX_SHEETS = 20
 XLSX_MAX_ROWS_PER_SHEET = 5000
 XLSX_MAX_COLS_PER_SHEET = 50
 XLSX_INCLUDE_EMPTY_VALUES = False
+# 多 Sheet 的大文件按 Sheet 在子进程并行解析（文件小于 MIN_BYTES 时串行，避免进程启动开销）
+XLSX_PARALLEL_WORKERS = 4
+XLSX_PARALLEL_MIN_BYTES = 2 * 1024 * 1024
+# Sheet 读不到“值”时，探测前 N 行是否有公式，有才改读公式文本（0 = 不读公式）
+XLSX_FORMULA_PROBE_ROWS = 50
+# CSV / JSON(L)：每行/每条记录一个切片（表头绑定）；流式读取，每批 TABLE_READ_BATCH 行
+CSV_MAX_ROWS = 50000
+JSON_MAX_RECORDS = 50000
+TABLE_READ_BATCH = 1000
+
+# 检查点入库：每新增 N 篇文档或 M 个切片提交一次（失败后可 --resume 续传，已付费的 embedding 不丢失）
+INGEST_CHECKPOINT_DOCS = 20
+INGEST_CHECKPOINT_CHUNKS = 2000
+# 批量入库流水线（rag_store_manager bulk）：各阶段线程数与阶段间有界队列长度
+INGEST_PARSE_WORKERS = 2
+INGEST_EMBED_WORKERS = 4
+INGEST_QUEUE_SIZE = 16
 
 RAG_STORE_DIR = "C:\Rag_store"
+RAG_LOCK_TIMEOUT = 600  # 多会话并发写同一知识库时，等待写锁的最长秒数
+RAG_KEEP_SNAPSHOTS = 2  # 每次提交后保留的最近快照数（含当前）；更旧且无读者钉住的快照会被回收
+RAG_SNAPSHOT_PIN_TTL = 3600  # 读者 pin 的有效期（秒），超时视为崩溃遗留
+# PCA 降维检索：>0 时把索引降到该维度（建议 128–256）做第一阶段检索，候选用 mmap 侧文件中的全精度向量精排
+RAG_PCA_DIM = 0
+RAG_PCA_MIN_TRAIN = 4096   # 向量数达到该值才训练 PCA（之前仍为全精度 Flat 索引）
+RAG_PCA_RERANK_FACTOR = 8  # 第一阶段候选数 = 最终条数 × factor
+RAG_REGISTRY_BUDGET_MB = 2048  # 进程内缓存的已加载知识库总内存预算（MB），超出按最近最少使用淘汰
+# 多库联合检索：分数归一化方式（minmax | zscore 以所有库的候选为锚点；store_minmax 各库分别归一化；none）与并发检索线程数
+RAG_FEDERATED_NORMALIZE = "minmax"
+RAG_FEDERATED_WORKERS = 8
 TOP_K = 10
+# 提示词证据预算（估算 token）：按得分从高到低装入证据，超出预算的丢弃、单条超过上限的截断；
+# 实际预算还会受 MODEL_CONTEXT_TOKENS - MAX_TOKENS - 提示词 限制
+MODEL_CONTEXT_TOKENS = 131072
+EVIDENCE_TOKEN_BUDGET = {"identify": 6000, "year_measure": 2000, "policy": 4000}
+EVIDENCE_HIT_MAX_TOKENS = {"identify": 800, "year_measure": 200, "policy": 260}
+# 年度测定：开启后多个年份合并为一次模型调用（默认关闭，保持逐年调用的原有行为）；
+# 每窗口年数受 MEASURE_MULTI_YEAR_MAX 与 MAX_TOKENS / MEASURE_YEAR_OUTPUT_TOKENS（单年输出的估算 token 数）限制，超出时自动切分
+MEASURE_MULTI_YEAR = False
+MEASURE_MULTI_YEAR_MAX = 5
+MEASURE_YEAR_OUTPUT_TOKENS = 900
 OUTPUT_DIR = "C:\Industry_involution_agent_output"
 
 #政策仿真部分容易出现格式生成错误，需多次迭代，此处设置迭代上限